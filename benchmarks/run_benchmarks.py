@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""Benchmark runner. Run from repo root: `python benchmarks/run_benchmarks.py [--sizes 10000 100000 ...]`
+
+Times each stage separately on seeded synthetic points (benchmarks/synthetic.py) and writes
+benchmarks/results/<label>.json. --compare OLD.json prints per-stage ratios against an earlier run
+and exits non-zero when a stage got slower than --tolerance (stages faster than --min-seconds and
+slowdowns under --min-delta are treated as timer noise).
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO))
+
+from src.config import GridConfig, ModelConfig, ClusterConfig, FEATURES_BASELINE
+from benchmarks.synthetic import make_points
+
+STAGES = ["points_to_grid", "aggregate_to_cells", "fix_and_log10", "score_iforest", "dbscan_clusters",
+          "clusters_to_polygons", "cluster_fingerprint", "viz"]
+
+def _measure(fn, repeat: int, memory: bool) -> tuple[object, dict]:
+    """Best-of-`repeat` wall/CPU time; then one traced run for peak allocation (numpy buffers included)."""
+    walls, cpus, out = [], [], None
+    for _ in range(repeat):
+        w, c = time.perf_counter(), time.process_time()
+        out = fn()
+        walls.append(time.perf_counter() - w)
+        cpus.append(time.process_time() - c)
+    rec = {"wall_s": min(walls), "cpu_s": min(cpus), "wall_all_s": walls}
+    if memory:
+        tracemalloc.start()
+        fn()
+        rec["peak_alloc_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return out, rec
+
+def run_size(n: int, seed: int, repeat: int, memory: bool, stages: list[str], tmp: Path) -> list[dict]:
+    import src.viz as viz
+    from src.grid import points_to_grid, aggregate_to_cells
+    from src.preprocess import fix_and_log10, _MATRIX_CACHE
+    from src.modeling import score_iforest, mark_anomalies
+    from src.clustering import dbscan_clusters, clusters_to_polygons
+    from src.fingerprint import cluster_fingerprint
+    g, m, c = GridConfig(), ModelConfig(), ClusterConfig()
+
+    t = time.perf_counter()
+    pts = make_points(n, seed)
+    print(f"[{n:>9}] generated in {time.perf_counter() - t:.1f}s")
+    rows = []
+
+    def record(stage, fn, rows_in):
+        if stage not in stages:
+            return fn()
+        def call():
+            _MATRIX_CACHE.clear()    # stages must not profit from a transform cached by an earlier repeat
+            return fn()
+        out, rec = _measure(call, repeat, memory)
+        rows_out = len(out[0]) if isinstance(out, tuple) else (len(out) if hasattr(out, "__len__") else None)
+        rows.append({"n_points": n, "stage": stage, "rows_in": rows_in, "rows_out": rows_out, **rec})
+        print(f"[{n:>9}] {stage:<22} {rec['wall_s']:8.3f}s" + (f"  {rec['peak_alloc_mb']:8.1f} MB" if memory else ""))
+        return out
+
+    pts_utm = record("points_to_grid", lambda: points_to_grid(pts, g.utm_epsg, g.grid_size_m), len(pts))
+    cells = record("aggregate_to_cells", lambda: aggregate_to_cells(pts_utm, FEATURES_BASELINE), len(pts_utm))
+    cells = cells[cells["n_points"] >= m.min_points].copy()
+    record("fix_and_log10", lambda: fix_and_log10(cells, FEATURES_BASELINE), len(cells))
+    scored, _ = record("score_iforest", lambda: score_iforest(cells, FEATURES_BASELINE, m.contamination, m.random_state),
+                       len(cells))
+    scored, _ = mark_anomalies(scored, m.contamination)
+    anom = scored[scored["is_anomaly"] == 1].copy()
+    anom = record("dbscan_clusters", lambda: dbscan_clusters(anom, c.eps_m, c.min_samples), len(anom))
+    polys, _ = record("clusters_to_polygons", lambda: clusters_to_polygons(anom, c.buffer_m), len(anom))
+    _, fp_long = record("cluster_fingerprint",
+                        lambda: cluster_fingerprint(scored, anom, FEATURES_BASELINE, str(tmp / "fp.csv")), len(anom))
+
+    def figures():
+        # basemap tiles are a network fetch, not our code
+        viz.map_anomaly_score(scored, str(tmp / "score.png"), "bench", basemap=False)
+        viz.plot_fingerprint_heatmap(fp_long, str(tmp / "fp.png"), "bench")
+        return [tmp / "score.png", tmp / "fp.png"]
+    record("viz", figures, len(scored))
+    return rows
+
+def _environment() -> dict:
+    import sklearn, pandas, geopandas, shapely
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__, "pandas": pandas.__version__, "scikit-learn": sklearn.__version__,
+        "geopandas": geopandas.__version__, "shapely": shapely.__version__,
+    }
+
+def compare(new: dict, old: dict, tolerance: float, min_s: float = 0.05, min_delta_s: float = 0.01) -> list[str]:
+    """
+    Print wall-time ratios new/old per (n_points, stage); return the stages beyond tolerance.
+    Stages where both timings are under min_s, or that got slower by less than min_delta_s,
+    are never flagged: at that scale the ratio is timer noise.
+    """
+    before = {(r["n_points"], r["stage"]): r for r in old["results"]}
+    slower = []
+    print(f"\n{'n_points':>9} {'stage':<22} {'old s':>8} {'new s':>8} {'ratio':>6}")
+    for r in new["results"]:
+        o = before.get((r["n_points"], r["stage"]))
+        if o is None:
+            continue
+        ratio = r["wall_s"] / max(o["wall_s"], 1e-9)
+        noise = max(r["wall_s"], o["wall_s"]) < min_s or r["wall_s"] - o["wall_s"] < min_delta_s
+        flag = "  <-- slower" if ratio > tolerance and not noise else ""
+        print(f"{r['n_points']:>9} {r['stage']:<22} {o['wall_s']:8.3f} {r['wall_s']:8.3f} {ratio:6.2f}{flag}")
+        if flag:
+            slower.append(f"{r['n_points']}:{r['stage']}")
+    return slower
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+ap.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+ap.add_argument("--seed", type=int, default=0)
+ap.add_argument("--repeat", type=int, default=3, help="timed runs per stage (best is reported)")
+ap.add_argument("--no-memory", action="store_true", help="skip the traced run for peak allocations")
+ap.add_argument("--label", default=None, help="result file name (default: UTC timestamp + commit)")
+ap.add_argument("--out-dir", type=Path, default=REPO / "benchmarks" / "results")
+ap.add_argument("--compare", type=Path, default=None, help="earlier result JSON to compare against")
+ap.add_argument("--tolerance", type=float, default=1.25, help="slowdown ratio that counts as a regression")
+ap.add_argument("--min-seconds", type=float, default=0.05,
+                help="stages where both timings are below this are never flagged")
+ap.add_argument("--min-delta", type=float, default=0.01,
+                help="slowdowns smaller than this many seconds are never flagged")
+args = ap.parse_args()
+
+env = _environment()
+results = []
+with tempfile.TemporaryDirectory() as tmp:
+    for n in args.sizes:
+        results += run_size(n, args.seed, args.repeat, not args.no_memory, args.stages, Path(tmp))
+
+stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+report = {"created": stamp, "environment": env,
+          "params": {"sizes": args.sizes, "seed": args.seed, "repeat": args.repeat, "stages": args.stages},
+          "results": results}
+label = args.label or f"{stamp}_{env['git_commit'] or 'nogit'}"
+out = args.out_dir / f"{label}.json"
+out.parent.mkdir(parents=True, exist_ok=True)
+out.write_text(json.dumps(report, indent=2))
+print("Saved:", out)
+
+if args.compare is not None:
+    slower = compare(report, json.loads(args.compare.read_text()), args.tolerance,
+                     args.min_seconds, args.min_delta)
+    if slower:
+        print("Regressions:", ", ".join(slower))
+        sys.exit(1)
@@ -0,0 +1,110 @@
+from __future__ import annotations
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from src.config import FEATURES_BASELINE
+
+# Seeded NTGS-like stream-sediment points for benchmarks.
+# Samples come in survey blocks (campaign-style rectangles over the NT), mostly strung along
+# drainage traverses inside each block, with a lognormal regional background, a few planted
+# multi-element anomalies, detection-limit negatives (reported as -DL, e.g. -0.1) and elements
+# not analysed in some surveys (NULL). Coordinates are GDA94 lon/lat like the NTGS layer.
+
+NT_BOUNDS = (129.0, -26.0, 138.0, -11.0)   # lon_min, lat_min, lon_max, lat_max
+
+# median background (units of the column) and detection limit per element
+ELEMENTS = {
+    "CU_PPM": (20.0, 1.0), "PB_PPM": (15.0, 2.0), "ZN_PPM": (40.0, 2.0), "AU_PPB": (2.0, 1.0),
+    "AS_PPM": (5.0, 0.5), "MN_PPM": (500.0, 5.0), "FE_PCT": (3.0, 0.01), "CO_PPM": (10.0, 1.0),
+    "NI_PPM": (15.0, 1.0), "AG_PPM": (0.08, 0.1), "MO_PPM": (1.0, 0.5), "U_PPM": (2.0, 0.1),
+    "CR_PPM": (40.0, 2.0), "BI_PPM": (0.2, 0.1),
+}
+
+# planted anomaly styles: element -> log10 enrichment at the centre
+SIGNATURES = [
+    {"CU_PPM": 1.0, "AU_PPB": 1.3, "BI_PPM": 0.8, "MO_PPM": 0.6},
+    {"PB_PPM": 1.2, "ZN_PPM": 1.0, "AG_PPM": 1.0},
+    {"NI_PPM": 0.9, "CO_PPM": 0.7, "CR_PPM": 0.8},
+    {"U_PPM": 1.2, "MO_PPM": 0.5},
+    {"AS_PPM": 1.0, "AU_PPB": 1.0},
+]
+
+def _blocks(rng: np.random.Generator, n_blocks: int, side_km: float) -> np.ndarray:
+    """Survey blocks as rows (lon0, lat0, width, height, weight); sides scatter around side_km."""
+    x0, y0, x1, y1 = NT_BOUNDS
+    w = np.minimum(side_km * rng.lognormal(0, 0.4, n_blocks) / 105.0, x1 - x0)   # ~105 km per degree of lon
+    h = np.minimum(side_km * rng.lognormal(0, 0.4, n_blocks) / 111.0, y1 - y0)
+    lon = rng.uniform(x0, x1 - w)
+    lat = rng.uniform(y0, y1 - h)
+    weight = rng.dirichlet(np.full(n_blocks, 2.0))
+    return np.column_stack([lon, lat, w, h, weight])
+
+def make_points(n: int, seed: int = 0, features: list[str] | None = None, n_blocks: int | None = None,
+                n_anomalies: int | None = None, density_km2: float = 3.0, start_id: int = 0,
+                layout_n: int | None = None) -> gpd.GeoDataFrame:
+    """
+    n synthetic samples (UNIQ_ID, LONGITUDE, LATITUDE, element columns, point geometry in EPSG:4283).
+    Survey effort scales with n (or layout_n): more blocks, sized for ~density_km2 samples per km2 of block.
+    Deterministic for (n, seed, ...).
+    """
+    features = list(features or FEATURES_BASELINE)
+    total = layout_n or n                       # chunked writers share the layout of the full set
+    layout = np.random.default_rng([seed, total])
+    n_blocks = n_blocks or int(np.clip(np.sqrt(total) / 10, 8, 300))
+    n_anomalies = n_anomalies or max(5, n_blocks // 2)
+    blocks = _blocks(layout, n_blocks, side_km=float(np.sqrt(total / (density_km2 * n_blocks))))
+    # drainage traverses: 6 per block, as (start, direction) in block-relative units
+    trav_start = layout.uniform(0, 1, (n_blocks, 6, 2))
+    trav_dir = layout.normal(0, 1, (n_blocks, 6, 2))
+    trav_dir /= np.linalg.norm(trav_dir, axis=2, keepdims=True)
+    anom_block = layout.integers(0, n_blocks, n_anomalies)
+    anom_xy = blocks[anom_block, :2] + layout.uniform(0, 1, (n_anomalies, 2)) * blocks[anom_block, 2:4]
+    anom_r = layout.uniform(0.01, 0.06, n_anomalies)
+    anom_sig = layout.integers(0, len(SIGNATURES), n_anomalies)
+    not_analysed = layout.random((n_blocks, len(features))) < 0.12
+    phase = layout.uniform(0, 2 * np.pi, (len(features), 3))
+
+    rng = np.random.default_rng([seed, n, start_id])
+    b = rng.choice(n_blocks, size=n, p=blocks[:, 4])
+    on_line = rng.random(n) < 0.75
+    t = rng.uniform(-0.6, 0.6, n)
+    k = rng.integers(0, 6, n)
+    rel = np.where(on_line[:, None],
+                   trav_start[b, k] + t[:, None] * trav_dir[b, k] + rng.normal(0, 0.01, (n, 2)),
+                   rng.uniform(0, 1, (n, 2)))
+    rel = np.mod(rel, 1.0)
+    lon = blocks[b, 0] + rel[:, 0] * blocks[b, 2]
+    lat = blocks[b, 1] + rel[:, 1] * blocks[b, 3]
+
+    df = pd.DataFrame({"UNIQ_ID": np.arange(start_id, start_id + n, dtype=np.int64), "LONGITUDE": lon, "LATITUDE": lat})
+    for j, f in enumerate(features):
+        med, dl = ELEMENTS.get(f, (10.0, 1.0))
+        # smooth regional (lithology-like) trend + sample noise, in log10 units
+        trend = 0.25 * (np.sin(lon * 1.3 + phase[j, 0]) + np.sin(lat * 1.7 + phase[j, 1])
+                        + 0.5 * np.sin((lon + lat) * 3.1 + phase[j, 2]))
+        logv = np.log10(med) + trend + rng.normal(0, 0.3, n)
+        for a in np.flatnonzero([f in SIGNATURES[s] for s in anom_sig]):
+            d2 = (lon - anom_xy[a, 0]) ** 2 + (lat - anom_xy[a, 1]) ** 2
+            logv += SIGNATURES[anom_sig[a]][f] * np.exp(-d2 / (2 * anom_r[a] ** 2))
+        v = 10.0 ** logv
+        digits = max(0, int(-np.floor(np.log10(dl))))
+        v = np.round(v, digits)
+        v = np.where(v < dl, -dl, v)
+        v[not_analysed[b, j]] = np.nan
+        df[f] = v
+    return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(lon, lat), crs="EPSG:4283")
+
+def write_points_gpkg(path: str | Path, n: int, seed: int = 0, chunk: int = 1_000_000, layer: str = "stream_sediments",
+                      features: list[str] | None = None) -> Path:
+    """Write make_points(...) in chunks (appending), so 10M-point files never sit in memory at once."""
+    import pyogrio
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        path.unlink()
+    for i, s in enumerate(range(0, n, chunk)):
+        part = make_points(min(chunk, n - s), seed, features, start_id=s, layout_n=n)
+        pyogrio.write_dataframe(part, path, layer=layer, driver="GPKG", append=i > 0)
+    return path
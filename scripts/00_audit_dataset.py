@@ -2,21 +2,45 @@
 """CLI-style script. Run from repo root: `python scripts/<name>.py`"""
 
 from pathlib import Path
-import pandas as pd
-import geopandas as gpd
+import numpy as np
 from src.config import default_paths
+from src.io import iter_points_gpkg, layer_columns
 
 REPO = Path(__file__).resolve().parents[1]
 paths = default_paths(REPO)
 
-gdf = gpd.read_file(paths.raw_gpkg)
-print("rows:", len(gdf), "cols:", len(gdf.columns))
-print("CRS:", gdf.crs)
+# stream only the audited columns; memory is bounded by the batch size
+# (plus the sets of seen coordinates / ids used for the duplicate checks)
+cols = layer_columns(paths.raw_gpkg)
+read_cols = [c for c in ["LONGITUDE", "LATITUDE", "UNIQ_ID"] if c in cols]
 
-print("lon min/max:", float(gdf["LONGITUDE"].min()), float(gdf["LONGITUDE"].max()))
-print("lat min/max:", float(gdf["LATITUDE"].min()), float(gdf["LATITUDE"].max()))
+n_rows, crs = 0, None
+lon_min, lon_max, lat_min, lat_max = np.inf, -np.inf, np.inf, -np.inf
+seen_xy, dup_xy = set(), 0
+seen_id, id_unique = set(), True
+for batch in iter_points_gpkg(paths.raw_gpkg, columns=read_cols):
+    crs = batch.crs
+    n_rows += len(batch)
+    lon = batch["LONGITUDE"].to_numpy(dtype=float)
+    lat = batch["LATITUDE"].to_numpy(dtype=float)
+    lon_min, lon_max = min(lon_min, np.nanmin(lon)), max(lon_max, np.nanmax(lon))
+    lat_min, lat_max = min(lat_min, np.nanmin(lat)), max(lat_max, np.nanmax(lat))
+    for xy in zip(lon.tolist(), lat.tolist()):
+        if xy in seen_xy:
+            dup_xy += 1
+        else:
+            seen_xy.add(xy)
+    if "UNIQ_ID" in batch.columns and id_unique:
+        ids = batch["UNIQ_ID"].tolist()
+        id_unique = len(set(ids)) == len(ids) and seen_id.isdisjoint(ids)
+        seen_id.update(ids)
+
+print("rows:", n_rows, "cols:", len(cols) + 1)
+print("CRS:", crs)
+
+print("lon min/max:", float(lon_min), float(lon_max))
+print("lat min/max:", float(lat_min), float(lat_max))
 
-dup_xy = gdf.duplicated(subset=["LONGITUDE","LATITUDE"]).sum()
 print("duplicate coordinate rows:", int(dup_xy))
 
-print("UNIQ_ID unique:", gdf["UNIQ_ID"].is_unique if "UNIQ_ID" in gdf.columns else "N/A")
+print("UNIQ_ID unique:", id_unique if "UNIQ_ID" in read_cols else "N/A")
@@ -2,22 +2,36 @@
 """CLI-style script. Run from repo root: `python scripts/<name>.py`"""
 
 from pathlib import Path
-import geopandas as gpd
 from src.config import default_paths, GridConfig, FEATURES_BASELINE
-from src.grid import points_to_grid, aggregate_to_cells
-from src.io import write_gpkg
+from src.grid import stream_aggregate_to_pyramid, level_name
+from src.incremental import SAMPLE_KEY, index_batch, write_sample_index, sample_index_name
+from src.io import iter_points_gpkg, layer_columns
+from src.store import write_table
+from src.instrument import start_run, finish_run
 
 REPO = Path(__file__).resolve().parents[1]
 paths = default_paths(REPO)
 cfg = GridConfig()
+run = start_run("10_build_grid")
 
-gdf = gpd.read_file(paths.raw_gpkg)
-if gdf.crs is None:
-    gdf = gdf.set_crs("EPSG:4283")
+# only the element columns + geometry are read, in batches; per-cell medians are built out of core
+# (same result as points_to_grid + aggregate_to_cells on the full layer), for every pyramid level at once
+# the per-sample index (key, row hash, cell) recorded on the way lets scripts/65 update incrementally
+has_key = SAMPLE_KEY in layer_columns(paths.raw_gpkg)
+batches = iter_points_gpkg(paths.raw_gpkg, columns=FEATURES_BASELINE + ([SAMPLE_KEY] if has_key else []))
+sizes = tuple(sorted(set(cfg.pyramid_sizes_m) | {cfg.grid_size_m}))
+index_parts = []
+record = (lambda b, cx, cy: index_parts.append(index_batch(b, cx, cy, FEATURES_BASELINE))) if has_key else None
+levels = stream_aggregate_to_pyramid(batches, FEATURES_BASELINE, cfg.utm_epsg, sizes, on_batch=record)  # include baseline features; noAG is subset anyway
 
-gdf_pts = points_to_grid(gdf, cfg.utm_epsg, cfg.grid_size_m)
-cells = aggregate_to_cells(gdf_pts, FEATURES_BASELINE)  # include baseline features; noAG is subset anyway
+# intermediate only (Parquet); GPKG is kept for exported results
+for size, cells in levels.items():
+    out = paths.artifacts_dir / "baseline" / f"grid_cells_{level_name(size)}.parquet"
+    write_table(cells, out)
+    print("Saved:", out, f"({len(cells)} cells)")
 
-out = paths.artifacts_dir / "baseline" / "grid_cells_1km.gpkg"
-write_gpkg(cells, out, layer="cells_1km")
-print("Saved:", out)
+out = write_sample_index(index_parts, paths.artifacts_dir / "baseline" / sample_index_name(), sizes[0]) if has_key else None
+if out is not None:
+    print("Saved:", out)
+
+finish_run(run, paths, configs={"grid": cfg}, inputs=[paths.raw_gpkg])
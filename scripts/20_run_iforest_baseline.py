@@ -2,28 +2,36 @@
 """CLI-style script. Run from repo root: `python scripts/<name>.py`"""
 
 from pathlib import Path
-import geopandas as gpd
 from src.config import default_paths, ModelConfig, FEATURES_BASELINE
-from src.modeling import score_iforest, mark_anomalies
+from src.modeling import score_anomalies, mark_anomalies, save_model
 from src.io import write_gpkg
+from src.store import read_table, table_path, write_table
+from src.instrument import start_run, finish_run
 
 REPO = Path(__file__).resolve().parents[1]
 paths = default_paths(REPO)
 m = ModelConfig()
+run = start_run("20_run_iforest_baseline")
 
-# you can also load from grid_cells_1km.gpkg if you saved it; here we assume you re-aggregate earlier step
-cells = gpd.read_file(paths.artifacts_dir / "baseline" / "grid_cells_1km.gpkg", layer="cells_1km")
+cells = read_table(paths.artifacts_dir / "baseline" / "grid_cells_1km.parquet",
+                   columns=["cell_id", *FEATURES_BASELINE, "n_points", "geometry"],
+                   filters=[("n_points", ">=", m.min_points)])
 
-# min_points filter
-cells = cells[cells["n_points"] >= 5].copy()
-
-scored, meta = score_iforest(cells, FEATURES_BASELINE, m.contamination, m.random_state)
+scored, meta, model = score_anomalies(cells, FEATURES_BASELINE, m.contamination, m.random_state,
+                                      scorer=m.scorer, return_model=True)
 scored, thr = mark_anomalies(scored, m.contamination)
 meta["threshold"] = thr
-meta["min_points"] = 5
+meta["min_points"] = m.min_points
 meta["n_anomaly_cells"] = int(scored["is_anomaly"].sum())
 
+# frozen background model for scoring new survey batches (scripts/22_score_new_cells.py)
+save_model(model.with_threshold(thr), paths.artifacts_dir / "baseline" / "iforest_model_baseline.joblib")
+
 out = paths.artifacts_dir / "baseline" / "ntgs_anomaly_grid_1km_stable_baseline.gpkg"
 write_gpkg(scored, out, layer="iforest_min5_baseline")
+write_table(scored, table_path(out))
 print("Saved:", out)
 print("Meta:", meta)
+
+finish_run(run, paths, configs={"model": m}, inputs=[paths.artifacts_dir / "baseline" / "grid_cells_1km.parquet"],
+           extra={"meta": meta})
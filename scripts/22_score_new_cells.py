@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""CLI-style script. Run from repo root: `python scripts/<name>.py <new_samples.gpkg> [--variant baseline]`
+
+Scores a new survey batch against the frozen background model saved by 20_run_iforest_baseline.py
+(or 21_... for noAG): samples are gridded on the same lattice and scored without refitting.
+"""
+
+import argparse
+from pathlib import Path
+from src.config import default_paths, GridConfig
+from src.grid import stream_aggregate_to_cells
+from src.io import iter_points_gpkg, write_gpkg
+from src.modeling import load_model
+from src.store import write_table
+
+REPO = Path(__file__).resolve().parents[1]
+paths = default_paths(REPO)
+cfg = GridConfig()
+
+ap = argparse.ArgumentParser()
+ap.add_argument("samples", help="GeoPackage with the new samples (same columns as the NTGS layer)")
+ap.add_argument("--variant", default="baseline", help="model to score against (baseline | noAG)")
+args = ap.parse_args()
+
+variant_dir = paths.artifacts_dir / ("baseline" if args.variant == "baseline" else f"robustness_{args.variant}")
+model = load_model(variant_dir / f"iforest_model_{args.variant}.joblib")
+
+batches = iter_points_gpkg(args.samples, columns=model.features)
+cells = stream_aggregate_to_cells(batches, model.features, cfg.utm_epsg, cfg.grid_size_m)
+scored = model.score_cells(cells)
+
+stem = Path(args.samples).stem
+out = variant_dir / f"new_cells_scored_{stem}.gpkg"
+write_gpkg(scored, out, layer=f"new_cells_{args.variant}")
+write_table(scored, out.with_suffix(".parquet"))
+print("Saved:", out)
+print("cells:", len(scored), "| flagged:", int(scored["is_anomaly"].sum()), "| threshold:", model.threshold)
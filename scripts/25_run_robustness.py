@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""CLI-style script. Run from repo root: `python scripts/<name>.py [--subset NAME=AG_PPM,AU_PPB,...]`
+
+Leave-one-element-out robustness: every FEATURES_BASELINE minus one element (plus any --subset)
+is scored and clustered in one job, and baseline targets are tabulated against each removal.
+Every variant's target polygons go to robustness/target_polygons.parquet (see 26_compare_targets.py).
+"""
+
+import argparse
+from dataclasses import replace
+from pathlib import Path
+import pandas as pd
+from src.clustering import clusters_to_polygons
+from src.config import default_paths, GridConfig, ModelConfig, ClusterConfig, FEATURES_BASELINE
+from src.robustness import leave_one_out_variants, run_variants, target_survival
+from src.store import read_table, write_table
+
+REPO = Path(__file__).resolve().parents[1]
+paths = default_paths(REPO)
+m = ModelConfig()
+c = ClusterConfig()
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--subset", action="append", default=[], metavar="NAME=F1,F2,...",
+                help="extra feature subset to run (repeatable)")
+ap.add_argument("--n-jobs", type=int, default=-1)
+args = ap.parse_args()
+
+extra = {}
+for spec in args.subset:
+    name, feats = spec.split("=", 1)
+    extra[name] = [f.strip() for f in feats.split(",") if f.strip()]
+variants = leave_one_out_variants(FEATURES_BASELINE, extra)
+
+cells = read_table(paths.artifacts_dir / "baseline" / "grid_cells_1km.parquet",
+                   columns=["cell_id", *FEATURES_BASELINE, "n_points"],
+                   filters=[("n_points", ">=", m.min_points)])
+results = run_variants(cells, variants, m, c, n_jobs=args.n_jobs)
+
+out_dir = paths.artifacts_dir / "robustness"
+survival = target_survival(results, reference="baseline")
+out = out_dir / "target_survival.csv"
+out.parent.mkdir(parents=True, exist_ok=True)
+survival.to_csv(out, index=False)
+print("Saved:", out)
+
+# per-cell flags/clusters for every variant (wide: is_anomaly_<v>, cluster_id_<v>)
+base = results["baseline"]
+per_cell = base.frame(["cell_id", "n_points"])
+for v, t in results.items():
+    per_cell[f"is_anomaly_{v}"] = t["is_anomaly"]
+    per_cell[f"cluster_id_{v}"] = t["cluster_id"]
+out = write_table(per_cell, out_dir / "robustness_cells.parquet")
+print("Saved:", out)
+
+# target polygons of every variant (long: one row per variant x cluster)
+g = GridConfig()
+polys = [clusters_to_polygons(replace(t, crs=g.utm_epsg), buffer_m=c.buffer_m)[0].assign(variant=v)
+         for v, t in results.items()]
+out = write_table(pd.concat(polys, ignore_index=True), out_dir / "target_polygons.parquet")
+print("Saved:", out)
+print(survival[["cluster_id", "rank", "n_cells", "n_survived", "survival_rate"]].to_string(index=False))
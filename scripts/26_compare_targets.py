@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""CLI-style script. Run from repo root: `python scripts/<name>.py [--reference baseline] [--min-iou 0.1]`
+
+Compares target polygon sets: every variant of 25_run_robustness.py (robustness/target_polygons.parquet)
+plus the full-pipeline variants (baseline/, robustness_<v>/), which take precedence on a name clash.
+Writes per-target stability, per-pair set agreement and the target matches under artifacts/robustness/.
+"""
+
+import argparse
+from pathlib import Path
+from src.config import default_paths
+from src.robustness import compare_target_sets
+from src.store import read_table, write_table
+
+REPO = Path(__file__).resolve().parents[1]
+paths = default_paths(REPO)
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--reference", default="baseline")
+ap.add_argument("--variants", default=None, help="comma-separated subset (default: all found)")
+ap.add_argument("--min-iou", type=float, default=0.1)
+ap.add_argument("--n-jobs", type=int, default=-1)
+args = ap.parse_args()
+
+sets = {}
+loo = paths.artifacts_dir / "robustness" / "target_polygons.parquet"
+if loo.exists():
+    polys = read_table(loo)
+    sets.update({v: p.drop(columns="variant") for v, p in polys.groupby("variant", sort=False)})
+for f in sorted(paths.artifacts_dir.glob("*/ntgs_target_polygons_*.parquet")):
+    sets[f.stem.removeprefix("ntgs_target_polygons_")] = read_table(f)
+if args.variants:
+    sets = {v: sets[v] for v in args.variants.split(",")}
+if args.reference not in sets:
+    raise SystemExit(f"Reference {args.reference!r} not found; available: {sorted(sets)}")
+sets = {args.reference: sets[args.reference], **{v: p for v, p in sets.items() if v != args.reference}}
+print(f"Comparing {len(sets)} target sets ({sum(len(p) for p in sets.values())} polygons)")
+
+matches, agreement, stability = compare_target_sets(sets, reference=args.reference, min_iou=args.min_iou,
+                                                    n_jobs=args.n_jobs)
+
+out_dir = paths.artifacts_dir / "robustness"
+out_dir.mkdir(parents=True, exist_ok=True)
+out = out_dir / f"target_stability_{args.reference}.csv"
+stability.to_csv(out, index=False)
+print("Saved:", out)
+out = out_dir / "set_agreement.csv"
+agreement.to_csv(out, index=False)
+print("Saved:", out)
+out = write_table(matches, out_dir / "target_matches.parquet")
+print("Saved:", out)
+
+cols = ["cluster_id", "rank", "priority_score", "n_matched", "median_offset_m", "stability_score"]
+print(stability[cols].head(20).to_string(index=False))
+print(agreement[agreement["set_a"] == args.reference].drop(columns="set_a").to_string(index=False))
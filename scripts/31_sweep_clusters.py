@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+"""CLI-style script. Run from repo root: `python scripts/<name>.py [--variant baseline]`
+
+DBSCAN parameter sweep over eps_m x min_samples on the scored anomaly cells, from one neighbour graph.
+"""
+
+import argparse
+import numpy as np
+from pathlib import Path
+from src.config import default_paths
+from src.clustering import sweep_dbscan
+from src.store import read_table
+
+REPO = Path(__file__).resolve().parents[1]
+paths = default_paths(REPO)
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--variant", default="baseline")
+ap.add_argument("--eps", type=float, nargs="+", default=list(np.arange(1000, 5001, 500)))
+ap.add_argument("--min-samples", type=int, nargs="+", default=list(range(2, 9)))
+ap.add_argument("--top", type=int, default=5)
+args = ap.parse_args()
+
+variant_dir = paths.artifacts_dir / ("baseline" if args.variant == "baseline" else f"robustness_{args.variant}")
+anom = read_table(variant_dir / f"ntgs_anomaly_grid_1km_stable_{args.variant}.parquet",
+                  columns=["cell_id", "n_points", "geometry"], filters=[("is_anomaly", "==", 1)])
+
+sweep = sweep_dbscan(anom, args.eps, args.min_samples, top_n=args.top)
+out = variant_dir / f"cluster_sweep_{args.variant}.csv"
+sweep.to_csv(out, index=False)
+print("Saved:", out)
+print(sweep.to_string(index=False))
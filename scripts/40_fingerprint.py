@@ -2,16 +2,19 @@
 """CLI-style script. Run from repo root: `python scripts/<name>.py`"""
 
 from pathlib import Path
-import geopandas as gpd
 from src.config import default_paths, FEATURES_BASELINE, FEATURES_NOAG
 from src.fingerprint import cluster_fingerprint
+from src.store import read_table
+from src.instrument import start_run, finish_run
 
 REPO = Path(__file__).resolve().parents[1]
 paths = default_paths(REPO)
+run = start_run("40_fingerprint")
 
 # baseline
-grid_base = gpd.read_file(paths.artifacts_dir / "baseline" / "ntgs_anomaly_grid_1km_stable_baseline.gpkg", layer="iforest_min5_baseline")
-anom_base = gpd.read_file(paths.artifacts_dir / "baseline" / "ntgs_anomaly_clusters_baseline.gpkg", layer="clusters_baseline_eps2km")
+# attribute columns only: no geometry is decoded
+grid_base = read_table(paths.artifacts_dir / "baseline" / "ntgs_anomaly_grid_1km_stable_baseline.parquet", columns=FEATURES_BASELINE)
+anom_base = read_table(paths.artifacts_dir / "baseline" / "ntgs_anomaly_clusters_baseline.parquet", columns=["cluster_id", *FEATURES_BASELINE])
 
 cluster_fingerprint(
     grid_scored=grid_base,
@@ -22,8 +25,8 @@ cluster_fingerprint(
 print("Saved baseline fingerprint CSV")
 
 # noAG
-grid_noag = gpd.read_file(paths.artifacts_dir / "robustness_noAG" / "ntgs_anomaly_grid_1km_stable_noAG.gpkg", layer="iforest_min5_noAG")
-anom_noag = gpd.read_file(paths.artifacts_dir / "robustness_noAG" / "ntgs_anomaly_clusters_noAG.gpkg", layer="clusters_noAG_eps2km")
+grid_noag = read_table(paths.artifacts_dir / "robustness_noAG" / "ntgs_anomaly_grid_1km_stable_noAG.parquet", columns=FEATURES_NOAG)
+anom_noag = read_table(paths.artifacts_dir / "robustness_noAG" / "ntgs_anomaly_clusters_noAG.parquet", columns=["cluster_id", *FEATURES_NOAG])
 
 cluster_fingerprint(
     grid_scored=grid_noag,
@@ -32,3 +35,5 @@ cluster_fingerprint(
     out_csv=str(paths.artifacts_dir / "robustness_noAG" / "cluster_fingerprint_noAG.csv")
 )
 print("Saved noAG fingerprint CSV")
+
+finish_run(run, paths)
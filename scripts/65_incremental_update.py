@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+"""CLI-style script. Run from repo root: `python scripts/<name>.py`
+
+Incremental update after new / changed samples land in the raw GeoPackage: only touched cells are
+re-gridded and re-scored against the frozen models from scripts/20 and 21, only the regions within
+eps of them are re-clustered, and the grid / cluster / target artifacts are patched. Needs the sample
+index written by scripts/10. Re-run scripts/40 and 50 afterwards for fingerprints and figures.
+"""
+
+from pathlib import Path
+from src.config import default_paths, GridConfig, ModelConfig, ClusterConfig, FEATURES_BASELINE
+from src.incremental import incremental_update
+
+REPO = Path(__file__).resolve().parents[1]
+paths = default_paths(REPO)
+
+summary = incremental_update(paths, FEATURES_BASELINE, GridConfig(), ModelConfig(), ClusterConfig())
+for k, v in summary.items():
+    print(f"{k}:", v)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+"""CLI-style script. Run from repo root: `python scripts/<name>.py [--variant baseline] [--serve]`
+
+Writes the scored 1 km grid (PNG tiles) and the target polygons/centroids (vector tiles) as MBTiles
+under artifacts/tiles/, for web viewers and QGIS. --serve starts a local tile server afterwards.
+"""
+
+import argparse
+from pathlib import Path
+from src.config import default_paths
+from src.store import read_table
+from src.tiles import export_grid_tiles, export_target_tiles, serve_tiles
+
+REPO = Path(__file__).resolve().parents[1]
+paths = default_paths(REPO)
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--variant", default="baseline", help="baseline | noAG")
+ap.add_argument("--minzoom", type=int, default=4)
+ap.add_argument("--maxzoom", type=int, default=11, help="grid tiles; target tiles go 3 zooms deeper")
+ap.add_argument("--serve", action="store_true", help="serve the archives on http://127.0.0.1:8000/")
+ap.add_argument("--port", type=int, default=8000)
+args = ap.parse_args()
+
+v = args.variant
+var_dir = paths.artifacts_dir / ("baseline" if v == "baseline" else f"robustness_{v}")
+out_dir = paths.artifacts_dir / "tiles"
+
+grid = read_table(var_dir / f"ntgs_anomaly_grid_1km_stable_{v}.parquet", columns=["anomaly_score", "n_points", "geometry"])
+polys = read_table(var_dir / f"ntgs_target_polygons_{v}.parquet")
+cents = read_table(var_dir / f"ntgs_target_centroids_{v}.parquet")
+
+out_grid = export_grid_tiles(grid, out_dir / f"anomaly_grid_{v}.mbtiles", args.minzoom, args.maxzoom)
+print("Saved:", out_grid)
+out_targets = export_target_tiles(polys, cents, out_dir / f"targets_{v}.mbtiles", args.minzoom, args.maxzoom + 3)
+print("Saved:", out_targets)
+
+if args.serve:
+    serve_tiles({f"anomaly_grid_{v}": out_grid, f"targets_{v}": out_targets}, port=args.port)
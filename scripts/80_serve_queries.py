@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+"""CLI-style script. Run from repo root: `python scripts/<name>.py [--variant baseline] [--port 8001]`
+
+Loads one variant's scored grid and targets into an in-memory QueryIndex and answers point / bbox /
+polygon / nearest-target queries as JSON on http://127.0.0.1:<port>/ (see src/query.py).
+"""
+
+import argparse
+import time
+from pathlib import Path
+from src.config import default_paths
+from src.query import QueryIndex, serve_queries
+
+REPO = Path(__file__).resolve().parents[1]
+paths = default_paths(REPO)
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--variant", default="baseline", help="baseline | noAG")
+ap.add_argument("--host", default="127.0.0.1")
+ap.add_argument("--port", type=int, default=8001)
+args = ap.parse_args()
+
+t = time.perf_counter()
+index = QueryIndex.from_artifacts(paths.artifacts_dir, args.variant)
+print(f"Indexed {len(index.cells)} cells, {len(index.geoms)} targets in {time.perf_counter() - t:.2f}s")
+serve_queries(index, host=args.host, port=args.port)
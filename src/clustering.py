@@ -3,14 +3,20 @@ import numpy as np
 import pandas as pd
 import geopandas as gpd
 from sklearn.cluster import DBSCAN
-from shapely.geometry import Point
-from shapely.ops import unary_union
 
+from .lattice import CellTable
+from .instrument import traced
+
+@traced
 def dbscan_clusters(anom_cells: gpd.GeoDataFrame, eps_m: float, min_samples: int) -> gpd.GeoDataFrame:
     """
     Cluster anomaly cells using DBSCAN on cell centroids (UTM meters).
-    Returns anom_cells with cluster_id.
+    Returns anom_cells with cluster_id. For a CellTable the centroids come from lattice arithmetic.
     """
+    if isinstance(anom_cells, CellTable):
+        X = np.column_stack(anom_cells.centroids())
+        labels = DBSCAN(eps=eps_m, min_samples=min_samples, metric="euclidean").fit_predict(X)
+        return anom_cells.with_columns(cluster_id=labels)
     gdf = anom_cells.copy()
     cent = gdf.geometry.centroid
     X = np.c_[cent.x.values, cent.y.values]
@@ -19,34 +25,237 @@ def dbscan_clusters(anom_cells: gpd.GeoDataFrame, eps_m: float, min_samples: int
     gdf["cluster_id"] = labels
     return gdf
 
-def clusters_to_polygons(anom_with_clusters: gpd.GeoDataFrame, buffer_m: float) -> tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+@traced
+def lattice_clusters(anom_cells, eps_m: float, min_samples: int):
+    """
+    DBSCAN on the integer cell lattice: two cells are neighbours when their centroids are within eps_m,
+    i.e. (dx^2 + dy^2) * size^2 <= eps_m^2 in cell units. Same core/border/noise rules and label
+    numbering as sklearn DBSCAN, so it reproduces dbscan_clusters; each pass is one vectorised lookup
+    per lattice offset, with no distance computations or neighbour lists.
+    Accepts a CellTable or a GeoDataFrame of grid cells; returns the same type with cluster_id.
+    """
+    table = anom_cells if isinstance(anom_cells, CellTable) else CellTable.from_cells(anom_cells, features=[])
+    offsets = _lattice_offsets(eps_m / table.grid_size_m)
+    n = len(table)
+    labels = np.full(n, -1, dtype=np.int64)
+    if n:
+        order, lookup = _lattice_lookup(table.cell_x, table.cell_y, int(np.abs(offsets).max(initial=0)))
+        labels[order] = _lattice_dbscan(n, lookup, offsets, min_samples, order)
+    if isinstance(anom_cells, CellTable):
+        return anom_cells.with_columns(cluster_id=labels)
+    gdf = anom_cells.copy()
+    gdf["cluster_id"] = labels
+    return gdf
+
+def _lattice_offsets(radius: float) -> np.ndarray:
+    """Integer (dx, dy) != (0, 0) with dx^2 + dy^2 <= radius^2 (small tolerance for float eps/size)."""
+    r = int(np.floor(radius + 1e-9))
+    d = np.arange(-r, r + 1)
+    dx, dy = np.meshgrid(d, d, indexing="ij")
+    keep = (dx * dx + dy * dy <= radius * radius + 1e-9) & ((dx != 0) | (dy != 0))
+    return np.column_stack([dx[keep], dy[keep]])
+
+def _lattice_lookup(cx: np.ndarray, cy: np.ndarray, pad: int):
+    """
+    Sort cells by lattice key (memory-local lookups) and return (order, lookup), where
+    lookup(rows, dx, dy) gives the sorted position of the cell at (x + dx, y + dy) for each sorted
+    row, or -1. Uses a dense index raster over the (padded) bounding box when that is small relative
+    to the number of cells, else binary search on the sorted keys.
+    """
+    n = len(cx)
+    x = cx.astype(np.int64) - int(cx.min()) + pad
+    y = cy.astype(np.int64) - int(cy.min()) + pad
+    w, h = int(x.max()) + pad + 1, int(y.max()) + pad + 1
+    key = x * h + y
+    order = np.argsort(key)
+    key = key[order]
+    if w * h <= max(64 * n, 1 << 20):
+        raster = np.full(w * h, -1, dtype=np.int32 if n < 2**31 else np.int64)
+        raster[key] = np.arange(n)
+        return order, lambda rows, dx, dy: raster[key[rows] + (dx * h + dy)]
+    def lookup(rows, dx, dy):
+        q = key[rows] + (dx * h + dy)
+        pos = np.minimum(np.searchsorted(key, q), n - 1)
+        return np.where(key[pos] == q, pos, -1)
+    return order, lookup
+
+def _lattice_dbscan(n: int, lookup, offsets: np.ndarray, min_samples: int, order: np.ndarray) -> np.ndarray:
+    """
+    Core counts, core-core components and border assignment, one lookup per offset and pass.
+    order[i] is the input position of cell i; clusters are numbered by their lowest input position
+    among core cells, as sklearn does.
+    """
+    count = np.ones(n, dtype=np.int32)                 # neighbourhood includes the cell itself
+    for dx, dy in offsets:
+        count += lookup(slice(None), dx, dy) >= 0
+    core = count >= min_samples
+    core_idx = np.flatnonzero(core)
+
+    # core-core edges: half the offsets suffice for an undirected graph
+    half = offsets[(offsets[:, 0] > 0) | ((offsets[:, 0] == 0) & (offsets[:, 1] > 0))]
+    src, dst = [], []
+    for dx, dy in half:
+        j = lookup(core_idx, dx, dy)
+        hit = j >= 0
+        hit[hit] = core[j[hit]]
+        src.append(core_idx[hit])
+        dst.append(j[hit])
+    labels = np.full(n, -1, dtype=np.int64)
+    if len(core_idx) == 0:
+        return labels
+    root = _components(n, np.concatenate(src), np.concatenate(dst))
+    labels[core_idx] = _number_components(root[core_idx], order[core_idx], n)
+
+    # border cells take the lowest label among their core neighbours
+    rest = np.flatnonzero(~core)
+    best = np.full(len(rest), np.iinfo(np.int64).max)
+    for dx, dy in offsets:
+        j = lookup(rest, dx, dy)
+        best = np.minimum(best, np.where(j >= 0, np.where(core[j], labels[j], best), best))
+    hit = best != np.iinfo(np.int64).max
+    labels[rest[hit]] = best[hit]
+    return labels
+
+def _number_components(root: np.ndarray, pos: np.ndarray, n: int) -> np.ndarray:
+    """Label 0, 1, ... per component root, ordered by the lowest input position `pos` in each."""
+    first = np.full(n, n, dtype=np.int64)
+    np.minimum.at(first, root, pos)
+    first = first[root]
+    return np.searchsorted(np.unique(first), first)
+
+def _dbscan_from_pairs(n: int, src: np.ndarray, dst: np.ndarray, core: np.ndarray, order: np.ndarray) -> np.ndarray:
+    """DBSCAN labels from ordered neighbour pairs (both directions, no self pairs); see _lattice_dbscan."""
+    labels = np.full(n, -1, dtype=np.int64)
+    core_idx = np.flatnonzero(core)
+    if len(core_idx) == 0:
+        return labels
+    cc = core[src] & core[dst] & (src < dst)
+    root = _components(n, src[cc], dst[cc])
+    labels[core_idx] = _number_components(root[core_idx], order[core_idx], n)
+    border = core[src] & ~core[dst]
+    best = np.full(n, np.iinfo(np.int64).max)
+    np.minimum.at(best, dst[border], labels[src[border]])
+    hit = best != np.iinfo(np.int64).max
+    labels[hit] = best[hit]
+    return labels
+
+def _components(n: int, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """
+    Connected components of the undirected graph (u, v) by vectorised union-find (hook larger root
+    onto smaller, then pointer jumping). Returns for every node the lowest node index in its component.
+    """
+    root = np.arange(n, dtype=np.int64)
+    while len(u):
+        ru, rv = root[u], root[v]
+        live = ru != rv
+        u, v, ru, rv = u[live], v[live], ru[live], rv[live]
+        if not len(u):
+            break
+        np.minimum.at(root, np.maximum(ru, rv), np.minimum(ru, rv))
+        while True:
+            nxt = root[root]
+            if np.array_equal(nxt, root):
+                break
+            root = nxt
+    return root
+
+def sweep_dbscan(anom_cells, eps_values: list[float], min_samples_values: list[int], top_n: int = 5,
+                 n_jobs: int = -1) -> pd.DataFrame:
+    """
+    Cluster statistics for every (eps_m, min_samples) pair, from one lattice neighbour graph built at
+    max(eps_values). Pairs are sorted by squared lattice distance, so each eps is a prefix of the graph;
+    labels are those lattice_clusters / dbscan_clusters would give. eps values run in parallel (threads).
+    Columns: eps_m, min_samples, n_clusters, n_clustered, noise_frac, top1..top<top_n> (cells in the
+    largest clusters, 0 when fewer clusters).
+    """
+    from joblib import Parallel, delayed
+    table = anom_cells if isinstance(anom_cells, CellTable) else CellTable.from_cells(anom_cells, features=[])
+    n, size = len(table), table.grid_size_m
+    offsets = _lattice_offsets(max(eps_values) / size)
+    src, dst, d2 = [np.empty(0, np.int64)], [np.empty(0, np.int64)], [np.empty(0, np.int64)]
+    order = np.arange(n)
+    if n and len(offsets):
+        order, lookup = _lattice_lookup(table.cell_x, table.cell_y, int(np.abs(offsets).max()))
+        idx = np.arange(n)
+        for dx, dy in offsets:
+            j = lookup(slice(None), dx, dy)
+            hit = j >= 0
+            src.append(idx[hit])
+            dst.append(j[hit].astype(np.int64))
+            d2.append(np.full(int(hit.sum()), dx * dx + dy * dy))
+    src, dst, d2 = np.concatenate(src), np.concatenate(dst), np.concatenate(d2)
+    by = np.argsort(d2, kind="stable")
+    src, dst, d2 = src[by], dst[by], d2[by]
+
+    def run_eps(eps: float) -> list[dict]:
+        k = np.searchsorted(d2, (eps / size) ** 2 + 1e-9, side="right")
+        s, d = src[:k], dst[:k]
+        count = 1 + np.bincount(s, minlength=n)
+        rows = []
+        for ms in min_samples_values:
+            labels = _dbscan_from_pairs(n, s, d, count >= ms, order)
+            sizes = np.sort(np.bincount(labels[labels >= 0]))[::-1]
+            row = {"eps_m": eps, "min_samples": ms, "n_clusters": int(len(sizes)),
+                   "n_clustered": int(sizes.sum()), "noise_frac": float((labels < 0).mean()) if n else 0.0}
+            row.update({f"top{i + 1}": int(sizes[i]) if i < len(sizes) else 0 for i in range(top_n)})
+            rows.append(row)
+        return rows
+
+    results = Parallel(n_jobs=n_jobs, prefer="threads")(delayed(run_eps)(e) for e in eps_values)
+    return pd.DataFrame([row for rows in results for row in rows])
+
+CLUSTER_ENGINES = {"dbscan": dbscan_clusters, "lattice": lattice_clusters}
+
+@traced
+def clusters_to_polygons(anom_with_clusters: gpd.GeoDataFrame, buffer_m: float,
+                         n_jobs: int = 1) -> tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
     """
     Make one polygon per cluster (excluding -1), and centroids (WGS84 columns lon/lat).
     Returns (polygons_utm, centroids_wgs84)
+    Cells are dissolved in integer lattice coordinates, where neighbouring boxes share edges exactly,
+    with a coverage union per cluster (n_jobs threads), then scaled to map units and buffered in one call.
     """
-    gdf = anom_with_clusters[anom_with_clusters["cluster_id"] != -1].copy()
-    polys = []
-    rows = []
-    for cid, grp in gdf.groupby("cluster_id"):
-        geom = unary_union(grp.geometry.values).buffer(buffer_m)
-        polys.append(geom)
-        rows.append({
-            "cluster_id": int(cid),
-            "n_cells": int(len(grp)),
-            "mean_score": float(grp["anomaly_score"].mean()),
-            "max_score": float(grp["anomaly_score"].max()),
-            "mean_points": float(grp["n_points"].mean()),
-        })
-
-    poly_gdf = gpd.GeoDataFrame(rows, geometry=polys, crs=gdf.crs)
+    import shapely
+    from pyproj import Transformer
+    table = anom_with_clusters if isinstance(anom_with_clusters, CellTable) \
+        else CellTable.from_cells(anom_with_clusters, features=[])
+    table = table.take(np.asarray(table["cluster_id"]) != -1)
+
+    cid = np.asarray(table["cluster_id"])
+    stats = pd.DataFrame({"cluster_id": cid, "score": table["anomaly_score"], "n_points": table.n_points}) \
+        .groupby("cluster_id", sort=True) \
+        .agg(n_cells=("score", "size"), mean_score=("score", "mean"), max_score=("score", "max"),
+             mean_points=("n_points", "mean")) \
+        .reset_index()
+    stats["cluster_id"] = stats["cluster_id"].astype(int)
+
+    order = np.argsort(cid, kind="stable")
+    x, y = table.cell_x[order].astype(np.float64), table.cell_y[order].astype(np.float64)
+    boxes = shapely.box(x, y, x + 1, y + 1)
+    groups = np.split(boxes, np.cumsum(stats["n_cells"].to_numpy())[:-1]) if len(stats) else []
+    if n_jobs == 1:
+        merged = [shapely.coverage_union_all(g) for g in groups]
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=None if n_jobs < 0 else n_jobs) as ex:
+            merged = list(ex.map(shapely.coverage_union_all, groups))
+    s = table.grid_size_m
+    ox, oy = table.origin
+    merged = shapely.transform(np.asarray(merged, dtype=object), lambda c: c * s + (ox, oy))
+    polys = shapely.buffer(merged, buffer_m, quad_segs=16)   # same as BaseGeometry.buffer
+
+    poly_gdf = gpd.GeoDataFrame(stats, geometry=polys, crs=table.crs)
     poly_gdf["priority_score"] = poly_gdf["n_cells"] * poly_gdf["mean_score"]
 
     # centroids: keep lon/lat columns for easy table export
-    cent_utm = poly_gdf.copy()
-    cent_utm["geometry"] = cent_utm.geometry.centroid
-    cent_wgs = cent_utm.to_crs("EPSG:4326")
-    cent_wgs["lon"] = cent_wgs.geometry.x
-    cent_wgs["lat"] = cent_wgs.geometry.y
+    c = shapely.centroid(polys)
+    lon, lat = Transformer.from_crs(table.crs, "EPSG:4326", always_xy=True) \
+        .transform(shapely.get_x(c), shapely.get_y(c))
+    cent_wgs = gpd.GeoDataFrame(poly_gdf.drop(columns="geometry"), geometry=shapely.points(lon, lat),
+                                crs="EPSG:4326")
+    cent_wgs = cent_wgs[[*stats.columns, "geometry", "priority_score"]]
+    cent_wgs["lon"] = lon
+    cent_wgs["lat"] = lat
     return poly_gdf, cent_wgs
 
 def top_targets_table(centroids_wgs84: gpd.GeoDataFrame, out_csv: str | None = None) -> pd.DataFrame:
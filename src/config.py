@@ -11,18 +11,26 @@ class Paths:
 @dataclass(frozen=True)
 class GridConfig:
     utm_epsg: str = "EPSG:32753"   # UTM zone 53S fits NT reasonably
-    grid_size_m: int = 1000        # 1 km grid
+    grid_size_m: int = 1000        # 1 km grid (level used for scoring/clustering)
+    pyramid_sizes_m: tuple[int, ...] = (500, 1000, 2000, 5000)  # levels built in one pass
+    tile_size_m: int | None = None # e.g. 100_000: grid/cluster/fingerprint per tile in a process pool (src/tiling)
 
 @dataclass(frozen=True)
 class ModelConfig:
     contamination: float = 0.03
     random_state: int = 42
+    min_points: int = 5            # drop sparse cells before scoring
+    n_seeds: int = 1               # > 1: multi-seed ensemble (mean/std/flag_freq per cell)
+    min_flag_freq: float | None = None  # ensemble only: flag cells flagged by at least this fraction of seeds
+    scorer: str = "iforest"        # key of modeling.SCORERS: "iforest" | "hbos" (O(n*d) screening) | "mcd"
+    local_radius_m: int | None = None   # e.g. 10_000: score residuals from a moving-window background (src/local)
 
 @dataclass(frozen=True)
 class ClusterConfig:
     eps_m: int = 2000
     min_samples: int = 3
     buffer_m: int = 500            # for nicer polygons
+    engine: str = "dbscan"         # "dbscan" (sklearn on centroids) | "lattice" (same labels, integer grid)
 
 # Feature sets
 FEATURES_BASELINE = [
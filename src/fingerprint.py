@@ -1,28 +1,142 @@
 from __future__ import annotations
+import warnings
+import numpy as np
 import pandas as pd
-from .preprocess import fix_and_log10, median_impute
+from .preprocess import cached_log10_matrix
+from .lattice import CellTable
+from .instrument import traced
 
-def cluster_fingerprint(grid_scored: pd.DataFrame, anom_with_clusters: pd.DataFrame, features: list[str], out_csv: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+@traced
+def cluster_fingerprint(grid_scored: pd.DataFrame, anom_with_clusters: pd.DataFrame, features: list[str], out_csv: str,
+                        n_boot: int = 1000, ci: float = 0.95, random_state: int = 42) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     Per-cluster fingerprint: median(log10(feature))_cluster - median(log10(feature))_background
-    Writes long CSV: cluster_id, element, delta_log10
+    Cluster cells go through the background's fitted transform without imputation: a cell missing an
+    element is left out of that element's cluster median (NaN where no cell has it).
+    n_boot > 0 adds a percentile bootstrap interval: cells resampled within each cluster, background fixed.
+    Writes long CSV: cluster_id, element, delta_log10 (, delta_ci_low, delta_ci_high)
     """
-    X_bg, keep_cols, dropped = fix_and_log10(grid_scored, features)
-    X_bg = median_impute(X_bg)
-    bg_med = X_bg.median(numeric_only=True)
-
-    cl = anom_with_clusters[anom_with_clusters["cluster_id"] != -1].copy()
-    X_cl, keep_cols2, dropped2 = fix_and_log10(cl, features)
-    X_cl = median_impute(X_cl)
-    X_cl["cluster_id"] = cl["cluster_id"].to_numpy()
-
-    cl_med = X_cl.groupby("cluster_id")[keep_cols2].median(numeric_only=True)
-    delta = cl_med.subtract(bg_med[keep_cols2], axis=1)
-
-    delta_long = (
-        delta.reset_index()
-             .melt(id_vars="cluster_id", var_name="element", value_name="delta_log10")
-             .sort_values(["cluster_id","delta_log10"], ascending=[True, False])
-    )
-    delta_long.to_csv(out_csv, index=False)
+    if isinstance(anom_with_clusters, CellTable):
+        anom_with_clusters = anom_with_clusters.frame()
+    # background matrix is shared with score_iforest through the (dataset, features) cache
+    fm_bg = cached_log10_matrix(grid_scored, features)
+    bg_med = np.median(fm_bg.X.astype(np.float64), axis=0)
+
+    cl = anom_with_clusters[anom_with_clusters["cluster_id"] != -1]
+    X = fm_bg.prep.transform(cl, impute=False).astype(np.float64)
+    stats = _cluster_stats(X, cl["cluster_id"].to_numpy(), n_boot, ci, random_state)
+    return _fingerprint_tables(*stats, bg_med, fm_bg.columns, out_csv)
+
+def _cluster_stats(X: np.ndarray, cluster_id: np.ndarray, n_boot: int, ci: float, random_state: int):
+    """(clusters, medians, ci_low, ci_high) per cluster and column, NaN skipped; ci_* are None when n_boot == 0."""
+    uniq, start, n, sv = _segment_sort(X, cluster_id)
+    valid = np.add.reduceat(~np.isnan(sv), start, axis=0, dtype=np.int64) if len(uniq) else np.zeros((0, X.shape[1]), np.int64)
+    med = _segment_median(sv, start[:, None], valid)
+    if n_boot <= 0 or not len(uniq):
+        return uniq, med, None, None
+    lo, hi = bootstrap_median_ci(sv, start, n, uniq, n_boot, ci, random_state, valid=valid)
+    return uniq, med, lo, hi
+
+def _segment_median(sv: np.ndarray, start: np.ndarray, k: np.ndarray) -> np.ndarray:
+    """Median of the first k values of each sorted segment (NaN where k == 0); start/k broadcast over columns."""
+    cols = np.arange(sv.shape[1])
+    lo = sv[start + np.maximum(k - 1, 0) // 2, cols]
+    hi = sv[start + k // 2 - (k == 0), cols]
+    return np.where(k > 0, (lo + hi) / 2.0, np.nan)
+
+def _fingerprint_tables(uniq, med, lo, hi, bg_med: np.ndarray, cols: list[str], out_csv: str | None):
+    delta = pd.DataFrame(med - bg_med, index=pd.Index(uniq, name="cluster_id"), columns=list(cols))
+    delta_long = delta.reset_index().melt(id_vars="cluster_id", var_name="element", value_name="delta_log10")
+    if lo is not None:
+        # melt is column-major: element by element, clusters in index order
+        delta_long["delta_ci_low"] = (lo - bg_med).ravel(order="F")
+        delta_long["delta_ci_high"] = (hi - bg_med).ravel(order="F")
+    delta_long = delta_long.sort_values(["cluster_id", "delta_log10"], ascending=[True, False])
+    if out_csv is not None:
+        delta_long.to_csv(out_csv, index=False)
     return delta, delta_long
+
+def _segment_sort(X: np.ndarray, cluster_id: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Rows grouped by cluster, every column sorted within its cluster (NaN last): (clusters, start, counts, sorted X)."""
+    order = np.argsort(cluster_id, kind="stable")
+    uniq, start, n = np.unique(cluster_id[order], return_index=True, return_counts=True)
+    seg = np.repeat(np.arange(len(uniq)), n)
+    sv = np.empty((len(order), X.shape[1]), dtype=np.float64)
+    for j in range(X.shape[1]):
+        v = X[order, j]
+        sv[:, j] = v[np.lexsort((v, seg))]
+    return uniq, start, n, sv
+
+def _mix64(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finaliser (uint64, wrapping)."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def bootstrap_median_ci(sv: np.ndarray, start: np.ndarray, n: np.ndarray, clusters: np.ndarray, n_boot: int = 1000,
+                        ci: float = 0.95, random_state: int = 42, chunk_elems: int = 1 << 22,
+                        valid: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Percentile interval of every per-cluster, per-column median.
+    sv holds each column sorted within its cluster segment (NaN last; valid = non-NaN count per cluster
+    and column), so a resample's median is read off at the middle order statistics of the resampled row
+    positions that fall on values: one integer sort per replicate serves every column. Draws are a
+    counter-based hash of (random_state, cluster_id, replicate, position), so a cluster's interval does
+    not depend on which other clusters are in the batch (e.g. per tile). Clusters are processed in
+    blocks of about chunk_elems replicate medians, so memory does not grow with the number of clusters.
+    Returns (low, high), each (n_clusters, n_columns).
+    """
+    if valid is None:
+        valid = np.broadcast_to(n[:, None], (len(n), sv.shape[1]))
+    alpha = (1.0 - ci) / 2.0
+    lo, hi = np.empty((len(n), sv.shape[1])), np.empty((len(n), sv.shape[1]))
+    block = max(1, chunk_elems // max(n_boot * sv.shape[1], 1))
+    for c0 in range(0, len(n), block):
+        c1 = min(len(n), c0 + block)
+        r0, r1 = start[c0], start[c1 - 1] + n[c1 - 1]
+        meds = _bootstrap_medians(sv[r0:r1], start[c0:c1] - r0, n[c0:c1], clusters[c0:c1], valid[c0:c1],
+                                  n_boot, random_state, chunk_elems)
+        if np.isnan(meds).any():
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)     # all-NaN: no cell has the element
+                q = np.nanquantile(meds, [alpha, 1.0 - alpha], axis=0)
+        else:
+            q = np.quantile(meds, [alpha, 1.0 - alpha], axis=0)
+        lo[c0:c1], hi[c0:c1] = q[0], q[1]
+    return lo, hi
+
+def _bootstrap_medians(sv: np.ndarray, start: np.ndarray, n: np.ndarray, clusters: np.ndarray, valid: np.ndarray,
+                       n_boot: int, random_state: int, chunk_elems: int) -> np.ndarray:
+    """(n_boot, n_clusters, n_columns) resampled medians of one block of contiguous cluster segments."""
+    total = int(n.sum())
+    seg = np.repeat(np.arange(len(n)), n)
+    base = start[seg]
+    size = n[seg].astype(np.float64)
+    end_valid = start[:, None] + valid                 # sv rows >= this hold NaN
+    full = bool((valid == n[:, None]).all())
+    with np.errstate(over="ignore"):
+        key = _mix64(np.asarray(clusters, dtype=np.int64).astype(np.uint64)[seg] + np.uint64(random_state & 0xFFFFFFFF) * np.uint64(0x9E3779B97F4A7C15))
+        key = _mix64(key + (np.arange(total) - base).astype(np.uint64))
+    step = max(1, chunk_elems // max(total, 1))
+    meds = np.empty((n_boot, len(n), sv.shape[1]), dtype=np.float64)
+    for b0 in range(0, n_boot, step):
+        reps = np.arange(b0, min(n_boot, b0 + step), dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            h = _mix64(key[None, :] + _mix64(reps + np.uint64(0x632BE59BD9B4E019))[:, None])
+        u = (h >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+        # draws stay inside their own segment and segments are contiguous, so a row sort orders each
+        # segment's draws without mixing segments
+        pos = base + (u * size).astype(np.int64)
+        pos.sort(axis=1)
+        if full:
+            meds[b0:b0 + len(reps)] = (sv[pos[:, start + (n - 1) // 2]] + sv[pos[:, start + n // 2]]) / 2.0
+            continue
+        for j in range(sv.shape[1]):
+            # sorted draws landing on values come first in their segment; k of them per replicate
+            k = np.add.reduceat(pos < end_valid[seg, j], start, axis=1, dtype=np.int64)
+            lo = np.take_along_axis(pos, start + np.maximum(k - 1, 0) // 2, axis=1)
+            hi = np.take_along_axis(pos, start + k // 2 - (k == 0), axis=1)
+            meds[b0:b0 + len(reps), :, j] = np.where(k > 0, (sv[lo, j] + sv[hi, j]) / 2.0, np.nan)
+    return meds
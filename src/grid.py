@@ -1,13 +1,18 @@
 from __future__ import annotations
+import tempfile
+from pathlib import Path
+from typing import Callable, Iterable
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import box
+import shapely
+from .instrument import traced
 
+@traced
 def points_to_grid(gdf_wgs84: gpd.GeoDataFrame, utm_epsg: str, grid_size_m: int) -> gpd.GeoDataFrame:
     """
     Project points to UTM, assign each point to a grid cell, and create a cell geometry.
-    Returns gdf_points_utm with columns: cell_x, cell_y, cell_id.
+    Returns gdf_points_utm with columns: cell_x, cell_y, cell_id (grid size kept in attrs).
     """
     gdf = gdf_wgs84.to_crs(utm_epsg)
     xs = gdf.geometry.x.values
@@ -15,14 +20,16 @@ def points_to_grid(gdf_wgs84: gpd.GeoDataFrame, utm_epsg: str, grid_size_m: int)
 
     cell_x = np.floor(xs / grid_size_m).astype(int)
     cell_y = np.floor(ys / grid_size_m).astype(int)
-    cell_id = (cell_y.astype(np.int64) << 32) + (cell_x.astype(np.int64) & 0xFFFFFFFF)
+    cell_id = pack_cell_id(cell_x, cell_y)
 
     gdf = gdf.copy()
     gdf["cell_x"] = cell_x
     gdf["cell_y"] = cell_y
     gdf["cell_id"] = cell_id
+    gdf.attrs["grid_size_m"] = int(grid_size_m)
     return gdf
 
+@traced
 def aggregate_to_cells(gdf_pts_utm: gpd.GeoDataFrame, features: list[str]) -> gpd.GeoDataFrame:
     """
     Median aggregate geochem features per cell. Also keep n_points.
@@ -37,13 +44,169 @@ def aggregate_to_cells(gdf_pts_utm: gpd.GeoDataFrame, features: list[str]) -> gp
     df = gdf_pts_utm.groupby("cell_id").agg(agg)
     df["n_points"] = gdf_pts_utm.groupby("cell_id").size().astype(int)
 
-    # build polygons
-    x0 = df["cell_x"].values * grid_size_m
-    y0 = df["cell_y"].values * grid_size_m
-    geoms = [box(x, y, x + grid_size_m, y + grid_size_m) for x, y in zip(x0, y0)]
-    gdf_cells = gpd.GeoDataFrame(df.drop(columns=["cell_x","cell_y"]), geometry=geoms, crs=gdf_pts_utm.crs).reset_index(drop=True)
-    return gdf_cells
+    return _cells_frame(df.drop(columns=["cell_x","cell_y"]), grid_size_m, gdf_pts_utm.crs)
 
-def _infer_grid_size(gdf_pts_utm: gpd.GeoDataFrame) -> int:
-    # Infer from cell_x step: use 1000 as default
+@traced
+def aggregate_to_pyramid(gdf_pts_utm: gpd.GeoDataFrame, features: list[str], grid_sizes_m: tuple[int, ...]) -> dict[int, gpd.GeoDataFrame]:
+    """
+    Build several grid levels from one projection of the points.
+    Every size must be a multiple of the size the points were binned at: coarse bins are integer
+    floor-divisions of the fine cell_x/cell_y, so the points are never re-projected.
+    Returns {grid_size_m: cells}; each level matches aggregate_to_cells at that size.
+    """
+    base = _infer_grid_size(gdf_pts_utm)
+    cols = [c for c in features if c in gdf_pts_utm.columns]
+    values = gdf_pts_utm[cols].to_numpy(dtype=np.float64, na_value=np.nan)
+    cx = gdf_pts_utm["cell_x"].to_numpy(dtype=np.int64)
+    cy = gdf_pts_utm["cell_y"].to_numpy(dtype=np.int64)
+    levels = {}
+    for size, (lx, ly) in _level_bins(cx, cy, base, grid_sizes_m).items():
+        df = _median_by_cell(pack_cell_id(lx, ly), values, cols)
+        levels[size] = _cells_frame(df, size, gdf_pts_utm.crs)
+    return levels
+
+def level_name(grid_size_m: int) -> str:
+    """1000 -> '1km', 500 -> '500m' (used in artifact names)."""
+    return f"{grid_size_m // 1000}km" if grid_size_m % 1000 == 0 else f"{grid_size_m}m"
+
+def _level_bins(cx: np.ndarray, cy: np.ndarray, base: int, grid_sizes_m) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+    out = {}
+    for size in grid_sizes_m:
+        if size % base:
+            raise ValueError(f"Grid size {size} m is not a multiple of the base grid size {base} m")
+        f = size // base
+        out[int(size)] = (np.floor_divide(cx, f), np.floor_divide(cy, f))
+    return out
+
+def _cells_frame(df: pd.DataFrame, grid_size_m: int, crs) -> gpd.GeoDataFrame:
+    """Attach the cell polygon (from cell_id) to a per-cell table."""
+    cell_x, cell_y = split_cell_id(df["cell_id"].to_numpy())
+    x0 = (cell_x * grid_size_m).astype(np.float64)
+    y0 = (cell_y * grid_size_m).astype(np.float64)
+    geoms = shapely.box(x0, y0, x0 + grid_size_m, y0 + grid_size_m)
+    gdf = gpd.GeoDataFrame(df.reset_index(drop=True), geometry=geoms, crs=crs)
+    gdf.attrs["grid_size_m"] = int(grid_size_m)
+    return gdf
+
+def _cells_table(df: pd.DataFrame, grid_size_m: int, crs, features: list[str]):
+    """Per-cell medians as a lattice CellTable (no geometry)."""
+    from .lattice import CellTable
+    cell_x, cell_y = split_cell_id(df["cell_id"].to_numpy())
+    X = np.ascontiguousarray(df[features].to_numpy(dtype=np.float32)).reshape(len(df), len(features))
+    return CellTable(cell_x=cell_x.astype(np.int32), cell_y=cell_y.astype(np.int32), X=X, features=list(features),
+                     n_points=df["n_points"].to_numpy(dtype=np.int32), grid_size_m=int(grid_size_m),
+                     crs=crs.to_string() if crs is not None else None)
+
+def pack_cell_id(cell_x: np.ndarray, cell_y: np.ndarray) -> np.ndarray:
+    """cell_id = cell_y in the high 32 bits, cell_x (two's complement) in the low 32 bits."""
+    return (np.asarray(cell_y).astype(np.int64) << 32) + (np.asarray(cell_x).astype(np.int64) & 0xFFFFFFFF)
+
+def split_cell_id(cell_id: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Inverse of pack_cell_id: returns (cell_x, cell_y) as int64."""
+    cell_id = np.asarray(cell_id, dtype=np.int64)
+    cell_x = (cell_id & 0xFFFFFFFF).astype(np.uint32).view(np.int32).astype(np.int64)
+    cell_y = cell_id >> 32
+    return cell_x, cell_y
+
+def stream_aggregate_to_cells(batches: Iterable[gpd.GeoDataFrame], features: list[str], utm_epsg: str, grid_size_m: int,
+                              n_partitions: int = 16, spill_dir: str | Path | None = None) -> gpd.GeoDataFrame:
+    """
+    Out-of-core equivalent of points_to_grid + aggregate_to_cells.
+    Each batch is projected and binned, then its (cell_id, feature values) rows are appended to one of
+    n_partitions spill files by cell_id. Partitions are finalised one at a time with exact
+    (NaN-skipping) per-cell medians, so peak memory is ~ one batch + one partition.
+    Output matches aggregate_to_cells(points_to_grid(all_points, ...), features).
+    """
+    return stream_aggregate_to_pyramid(batches, features, utm_epsg, (grid_size_m,), n_partitions, spill_dir)[grid_size_m]
+
+@traced
+def stream_aggregate_to_pyramid(batches: Iterable[gpd.GeoDataFrame], features: list[str], utm_epsg: str,
+                                grid_sizes_m: tuple[int, ...], n_partitions: int = 16,
+                                spill_dir: str | Path | None = None, as_table: bool = False,
+                                on_batch: Callable[[gpd.GeoDataFrame, np.ndarray, np.ndarray], None] | None = None) -> dict:
+    """
+    Streaming aggregate_to_pyramid. Points are binned once at the finest size; spill partitions are
+    keyed by blocks of lcm(grid_sizes_m) so every coarse cell of every level lands in one partition.
+    as_table=True returns lattice CellTables (no polygons built) instead of GeoDataFrames.
+    on_batch(batch, cell_x, cell_y) is called with each raw batch and its finest-level cells
+    (e.g. to record the per-sample index used by src/incremental).
+    """
+    sizes = tuple(sorted(int(s) for s in grid_sizes_m))
+    base = sizes[0]
+    block = int(np.lcm.reduce(np.array(sizes, dtype=np.int64))) // base
+    tmp = tempfile.TemporaryDirectory(dir=spill_dir)
+    spill = Path(tmp.name)
+    cols, crs, dtype = None, None, None
+    try:
+        for batch in batches:
+            if cols is None:
+                cols = [c for c in features if c in batch.columns]
+                dtype = np.dtype([("cx", np.int64), ("cy", np.int64), ("v", np.float64, (len(cols),))])
+            pts = points_to_grid(batch, utm_epsg, base)
+            crs = pts.crs
+            if on_batch is not None:
+                on_batch(batch, pts["cell_x"].to_numpy(), pts["cell_y"].to_numpy())
+            rec = np.empty(len(pts), dtype=dtype)
+            rec["cx"] = pts["cell_x"].to_numpy()
+            rec["cy"] = pts["cell_y"].to_numpy()
+            rec["v"] = pts[cols].to_numpy(dtype=np.float64, na_value=np.nan)
+            blk = pack_cell_id(np.floor_divide(rec["cx"], block), np.floor_divide(rec["cy"], block))
+            part = np.mod(blk, n_partitions)
+            for p in np.unique(part):
+                with open(spill / f"part{p}.bin", "ab") as f:
+                    rec[part == p].tofile(f)
+
+        if cols is None:
+            raise ValueError("No point batches to aggregate")
+        frames = {s: [] for s in sizes}
+        for p in range(n_partitions):
+            fp = spill / f"part{p}.bin"
+            if not fp.exists():
+                continue
+            rec = np.fromfile(fp, dtype=dtype)
+            for size, (lx, ly) in _level_bins(rec["cx"], rec["cy"], base, sizes).items():
+                frames[size].append(_median_by_cell(pack_cell_id(lx, ly), rec["v"], cols))
+            fp.unlink()
+    finally:
+        tmp.cleanup()
+
+    levels = {}
+    for size in sizes:
+        df = pd.concat(frames[size], ignore_index=True).sort_values("cell_id", kind="stable")
+        levels[size] = _cells_table(df, size, crs, cols) if as_table else _cells_frame(df, size, crs)
+    return levels
+
+def _median_by_cell(cell_id: np.ndarray, values: np.ndarray, cols: list[str]) -> pd.DataFrame:
+    """Sort-based segmented median per cell (NaN-skipping, mean of the two middles for even counts)."""
+    order = np.argsort(cell_id, kind="stable")
+    cid = cell_id[order]
+    uniq, start, n_points = np.unique(cid, return_index=True, return_counts=True)
+    seg = np.repeat(np.arange(len(uniq)), n_points)
+    out = {}
+    for j, c in enumerate(cols):
+        v = values[order, j]
+        o = np.lexsort((v, seg))                      # NaN sorts last within each cell
+        v = v[o]
+        k = np.bincount(seg, weights=~np.isnan(v), minlength=len(uniq)).astype(np.int64)
+        lo = start + np.maximum(k - 1, 0) // 2
+        hi = start + k // 2
+        med = (v[lo] + v[hi]) / 2.0
+        med[k == 0] = np.nan
+        out[c] = med
+    df = pd.DataFrame(out)
+    df["cell_id"] = uniq
+    df["n_points"] = n_points.astype(int)
+    return df
+
+def _infer_grid_size(gdf: gpd.GeoDataFrame) -> int:
+    """
+    Grid size recorded by points_to_grid / the aggregators (attrs), else the width of the cell
+    polygons (e.g. after a GPKG round-trip), else the 1 km default.
+    """
+    if "grid_size_m" in gdf.attrs:
+        return int(gdf.attrs["grid_size_m"])
+    geom = getattr(gdf, "geometry", None)
+    if geom is not None and len(gdf) and geom.geom_type.iloc[0] == "Polygon":
+        b = geom.iloc[0].bounds
+        return int(round(b[2] - b[0]))
     return 1000
@@ -0,0 +1,292 @@
+from __future__ import annotations
+import warnings
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from .config import Paths, GridConfig, ModelConfig, ClusterConfig
+from .grid import points_to_grid, pack_cell_id, split_cell_id, level_name, _level_bins, _median_by_cell, _cells_frame
+from .io import iter_points_gpkg, write_gpkg
+from .store import read_table, write_table, table_path
+
+# Incremental re-targeting after a data release.
+# scripts/10 records a per-sample index (key, row_hash, finest-level cell). A release is diffed
+# against it by key; only cells holding added / changed / deleted samples are re-aggregated, re-scored
+# with the stored (frozen) background model and threshold, and only the eps-connected regions
+# around them are re-clustered. Outputs equal a full rebuild that scores every cell with the same
+# stored model: medians, scores and DBSCAN are all per-cell or per-region, and cluster ids are
+# renumbered the way DBSCAN numbers them.
+
+SAMPLE_KEY = "UNIQ_ID"
+
+def sample_index_name() -> str:
+    return "sample_index.parquet"
+
+def index_batch(batch: gpd.GeoDataFrame, cell_x: np.ndarray, cell_y: np.ndarray, features: list[str],
+                key: str = SAMPLE_KEY) -> pd.DataFrame:
+    """key, row_hash (features + raw coordinates), cell_x, cell_y for one raw batch."""
+    return pd.DataFrame({"key": _keys(batch, key), "row_hash": _row_hash(batch, features),
+                         "cell_x": np.asarray(cell_x, dtype=np.int64), "cell_y": np.asarray(cell_y, dtype=np.int64)})
+
+def write_sample_index(parts: list[pd.DataFrame], path: str | Path, grid_size_m: int) -> Path | None:
+    """Write the sample index; skipped (with a warning) when the key is not unique."""
+    idx = pd.concat(parts, ignore_index=True)
+    if idx["key"].duplicated().any():
+        warnings.warn("Sample key is not unique; no sample index written, incremental updates are disabled")
+        return None
+    idx.attrs["grid_size_m"] = int(grid_size_m)
+    return write_table(idx, path)
+
+def _keys(batch: pd.DataFrame, key: str) -> np.ndarray:
+    if key not in batch.columns:
+        raise ValueError(f"Sample key column {key!r} not in layer")
+    return batch[key].to_numpy()
+
+def _row_hash(batch: gpd.GeoDataFrame, features: list[str]) -> np.ndarray:
+    cols = [c for c in features if c in batch.columns]
+    df = pd.DataFrame(batch[cols].to_numpy(dtype=np.float64, na_value=np.nan), columns=cols)
+    df["_x"] = batch.geometry.x.to_numpy()
+    df["_y"] = batch.geometry.y.to_numpy()
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+def diff_samples(raw_gpkg: str | Path, index: pd.DataFrame, features: list[str], utm_epsg: str,
+                 key: str = SAMPLE_KEY) -> tuple[pd.DataFrame, np.ndarray, dict]:
+    """
+    Pass over the raw layer (features + key, no projection of unchanged rows).
+    Returns (new index in layer row order, touched finest-level cell ids, counts).
+    Touched cells hold an added or changed sample (new position) or a deleted or changed one (old position).
+    """
+    base = int(index.attrs["grid_size_m"])
+    lookup = pd.Index(index["key"])
+    old_hash = index["row_hash"].to_numpy(dtype=np.uint64)
+    old_cx, old_cy = index["cell_x"].to_numpy(), index["cell_y"].to_numpy()
+    seen = np.zeros(len(index), dtype=bool)
+    parts, touched = [], []
+    counts = {"added": 0, "changed": 0, "deleted": 0}
+    for batch in iter_points_gpkg(raw_gpkg, columns=[*features, key]):
+        keys, h = _keys(batch, key), _row_hash(batch, features)
+        pos = lookup.get_indexer(keys)
+        known = pos >= 0
+        seen[pos[known]] = True
+        dirty = ~known
+        dirty[known] = old_hash[pos[known]] != h[known]
+        was = known & dirty
+        cx = np.where(known, old_cx[pos], 0)
+        cy = np.where(known, old_cy[pos], 0)
+        touched.append(pack_cell_id(cx[was], cy[was]))
+        if dirty.any():
+            pts = points_to_grid(batch[dirty], utm_epsg, base)
+            cx[dirty], cy[dirty] = pts["cell_x"].to_numpy(), pts["cell_y"].to_numpy()
+            touched.append(pack_cell_id(cx[dirty], cy[dirty]))
+        counts["added"] += int((~known).sum())
+        counts["changed"] += int(was.sum())
+        parts.append(pd.DataFrame({"key": keys, "row_hash": h, "cell_x": cx, "cell_y": cy}))
+    new = pd.concat(parts, ignore_index=True)
+    if new["key"].duplicated().any():
+        raise ValueError("Sample key is not unique; incremental updates need a unique key column")
+    gone = ~seen
+    counts["deleted"] = int(gone.sum())
+    touched.append(pack_cell_id(old_cx[gone], old_cy[gone]))
+    new.attrs["grid_size_m"] = base
+    return new, np.unique(np.concatenate(touched)), counts
+
+def regrid_touched(raw_gpkg: str | Path, index: pd.DataFrame, touched: np.ndarray, features: list[str],
+                   grid_sizes_m: tuple[int, ...], key: str = SAMPLE_KEY) -> dict[int, tuple[np.ndarray, pd.DataFrame]]:
+    """
+    Re-aggregate only the touched cells of every level: a second pass keeps just the rows whose cell
+    is touched at some level (cells come from the index, so nothing is re-projected).
+    Returns {size: (touched cell ids at that level, per-cell medians of those cells that still have points)}.
+    """
+    base = int(index.attrs["grid_size_m"])
+    cx, cy = index["cell_x"].to_numpy(), index["cell_y"].to_numpy()
+    tx, ty = split_cell_id(touched)
+    want = np.zeros(len(index), dtype=bool)
+    level_touched = {}
+    for size, (lx, ly) in _level_bins(tx, ty, base, grid_sizes_m).items():
+        ids = np.unique(pack_cell_id(lx, ly))
+        level_touched[size] = ids
+        f = size // base
+        want |= np.isin(pack_cell_id(np.floor_divide(cx, f), np.floor_divide(cy, f)), ids)
+
+    rows, vals, cols, start = [], [], None, 0
+    for batch in iter_points_gpkg(raw_gpkg, columns=[*features, key]):
+        sel = want[start:start + len(batch)]
+        if cols is None:
+            cols = [c for c in features if c in batch.columns]
+        if sel.any():
+            rows.append(np.flatnonzero(sel) + start)
+            vals.append(batch.loc[sel, cols].to_numpy(dtype=np.float64, na_value=np.nan))
+        start += len(batch)
+    if start != len(index):
+        raise RuntimeError("Raw layer changed between the diff and re-aggregation passes")
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+    vals = np.concatenate(vals) if vals else np.empty((0, len(cols or [])))
+
+    out = {}
+    for size, (lx, ly) in _level_bins(cx[rows], cy[rows], base, grid_sizes_m).items():
+        cid = pack_cell_id(lx, ly)
+        keep = np.isin(cid, level_touched[size])
+        out[size] = (level_touched[size], _median_by_cell(cid[keep], vals[keep], cols))
+    return out
+
+def _patch(table: pd.DataFrame, drop_ids: np.ndarray, new_rows: pd.DataFrame) -> pd.DataFrame:
+    """Replace the rows of drop_ids by new_rows, keeping the cell_id order the full build produces."""
+    attrs = dict(table.attrs)
+    kept = table[~table["cell_id"].isin(drop_ids)]
+    parts = [p for p in (kept, new_rows) if len(p)]
+    out = pd.concat(parts, ignore_index=True) if parts else kept
+    out = out.sort_values("cell_id", kind="stable").reset_index(drop=True)
+    out.attrs = attrs
+    return out
+
+def recluster_touched(anom: gpd.GeoDataFrame, anom_old: gpd.GeoDataFrame, seeds: np.ndarray,
+                      cluster_cfg: ClusterConfig) -> tuple[gpd.GeoDataFrame, np.ndarray, dict[int, int]]:
+    """
+    Re-cluster only the eps-connected regions of the new anomaly cells that lie within eps of a seed
+    (touched) cell; every other cell keeps its old cluster. Cluster ids are then renumbered in DBSCAN
+    order (by the first core cell in table order).
+    Returns (anom with cluster_id, affected mask, {old id: new id} for clusters carried over unchanged).
+    """
+    from .clustering import CLUSTER_ENGINES, _lattice_offsets, _lattice_lookup, _components
+    size = int(anom.attrs.get("grid_size_m", 1000))
+    n = len(anom)
+    cx, cy = split_cell_id(anom["cell_id"].to_numpy())
+    offsets = _lattice_offsets(cluster_cfg.eps_m / size)
+
+    # neighbour counts (core cells) and eps-connected regions over all anomaly cells
+    count = np.ones(n, dtype=np.int64)
+    region = np.arange(n)
+    if n and len(offsets):
+        order, lookup = _lattice_lookup(cx, cy, int(np.abs(offsets).max()))
+        src, dst = [], []
+        idx = np.arange(n)
+        for dx, dy in offsets:
+            j = lookup(slice(None), dx, dy)
+            hit = j >= 0
+            count[order[hit]] += 1
+            src.append(idx[hit])
+            dst.append(j[hit].astype(np.int64))
+        region[order] = _components(n, np.concatenate(src), np.concatenate(dst))
+    core = count >= cluster_cfg.min_samples
+
+    sx, sy = split_cell_id(seeds)
+    reach = [pack_cell_id(sx, sy)] + [pack_cell_id(sx + dx, sy + dy) for dx, dy in offsets]
+    near = np.isin(anom["cell_id"].to_numpy(), np.concatenate(reach))
+    affected = np.isin(region, region[near])
+
+    old_label = pd.Series(anom_old["cluster_id"].to_numpy(), index=anom_old["cell_id"].to_numpy())
+    label = old_label.reindex(anom["cell_id"].to_numpy()).to_numpy(dtype=np.float64, na_value=-1).astype(np.int64)
+    shift = int(label.max(initial=-1)) + 1
+    if affected.any():
+        local = CLUSTER_ENGINES[cluster_cfg.engine](anom[affected], eps_m=cluster_cfg.eps_m,
+                                                    min_samples=cluster_cfg.min_samples)
+        lab = np.asarray(local["cluster_id"], dtype=np.int64)
+        label[affected] = np.where(lab >= 0, lab + shift, -1)
+
+    # DBSCAN numbering: clusters ordered by their first core cell
+    first = np.full(int(label.max(initial=-1)) + 1, n, dtype=np.int64)
+    pos = np.flatnonzero(core & (label >= 0))
+    np.minimum.at(first, label[pos], pos)
+    used = np.flatnonzero(first < n)
+    rank = np.full(len(first), -1, dtype=np.int64)
+    rank[used[np.argsort(first[used])]] = np.arange(len(used))
+    new_label = np.full(n, -1, dtype=np.int64)
+    new_label[label >= 0] = rank[label[label >= 0]]
+
+    carried = {int(o): int(rank[o]) for o in np.unique(label[~affected & (label >= 0)])}
+    out = anom.copy()
+    out["cluster_id"] = new_label
+    return out, affected, carried
+
+def _patch_targets(old: gpd.GeoDataFrame, new: gpd.GeoDataFrame, carried: dict[int, int]) -> gpd.GeoDataFrame:
+    """Carried-over target rows (renumbered) + rebuilt ones, ordered by cluster_id."""
+    keep = old[old["cluster_id"].isin(list(carried))].copy()
+    keep["cluster_id"] = keep["cluster_id"].map(carried).astype(new["cluster_id"].dtype if len(new) else int)
+    parts = [p for p in (keep, new) if len(p)]
+    out = pd.concat(parts, ignore_index=True) if parts else new
+    return out.sort_values("cluster_id", kind="stable").reset_index(drop=True)
+
+def update_variant(paths: Paths, variant: str, grid_cells: pd.DataFrame, touched_ids: np.ndarray,
+                   model_cfg: ModelConfig, cluster_cfg: ClusterConfig, grid_size_m: int) -> dict:
+    """Re-score touched cells with the stored model, re-cluster affected regions, patch the variant's artifacts."""
+    from .modeling import load_model
+    from .clustering import clusters_to_polygons, top_targets_table
+    v = variant
+    vdir = paths.artifacts_dir / ("baseline" if v == "baseline" else f"robustness_{v}")
+    lvl = level_name(grid_size_m)
+    model = load_model(vdir / f"iforest_model_{v}.joblib")
+    if model.threshold is None:
+        raise ValueError(f"Model for {v} has no threshold; re-run scripts/2x to refreeze it")
+
+    grid_path = table_path(vdir / f"ntgs_anomaly_grid_{lvl}_stable_{v}.gpkg")
+    scored = read_table(grid_path)
+    fresh = grid_cells[grid_cells["cell_id"].isin(touched_ids) & (grid_cells["n_points"] >= model_cfg.min_points)]
+    fresh = model.score_cells(fresh[[c for c in scored.columns if c in fresh.columns]])
+    scored = _patch(scored, touched_ids, fresh)
+
+    clusters_path = vdir / f"ntgs_anomaly_clusters_{v}.gpkg"
+    anom_old = read_table(table_path(clusters_path))
+    anom = scored[scored["is_anomaly"] == 1].reset_index(drop=True)
+    anom.attrs["grid_size_m"] = grid_size_m
+    anom, affected, carried = recluster_touched(anom, anom_old, touched_ids, cluster_cfg)
+
+    polys_old = read_table(vdir / f"ntgs_target_polygons_{v}.parquet")
+    cents_old = read_table(vdir / f"ntgs_target_centroids_{v}.parquet")
+    rebuilt = anom[affected]
+    if (rebuilt["cluster_id"] != -1).any():
+        polys_new, cents_new = clusters_to_polygons(rebuilt, buffer_m=cluster_cfg.buffer_m)
+    else:
+        polys_new, cents_new = polys_old.iloc[:0], cents_old.iloc[:0]
+    polys = _patch_targets(polys_old, polys_new, carried)
+    cents = _patch_targets(cents_old, cents_new, carried)
+
+    write_table(scored, grid_path)
+    write_gpkg(scored, grid_path.with_suffix(".gpkg"), layer=f"iforest_min{model_cfg.min_points}_{v}")
+    write_table(anom, table_path(clusters_path))
+    write_gpkg(anom, clusters_path, layer=f"clusters_{v}_eps{cluster_cfg.eps_m / 1000:g}km")
+    out_targets = vdir / f"ntgs_target_clusters_{v}.gpkg"
+    write_gpkg(polys, out_targets, layer=f"{v}_polygons")
+    write_gpkg(cents, out_targets, layer=f"{v}_centroids_wgs84")
+    write_table(polys, vdir / f"ntgs_target_polygons_{v}.parquet")
+    write_table(cents, vdir / f"ntgs_target_centroids_{v}.parquet")
+    top_targets_table(cents, out_csv=str(vdir / f"top_targets_{v}.csv"))
+    return {"rescored_cells": int(len(fresh)), "anomaly_cells": int(len(anom)),
+            "reclustered_cells": int(affected.sum()), "targets": int(len(polys)),
+            "targets_carried_over": len(carried)}
+
+def incremental_update(paths: Paths, features: list[str], grid_cfg: GridConfig = GridConfig(),
+                       model_cfg: ModelConfig = ModelConfig(), cluster_cfg: ClusterConfig = ClusterConfig(),
+                       variants: tuple[str, ...] = ("baseline", "noAG"), key: str = SAMPLE_KEY) -> dict:
+    """
+    Bring the scripts/10 -> 30 artifacts up to date with the raw GeoPackage.
+    Fingerprints and figures (scripts/40, 50) are whole-territory summaries and are simply re-run.
+    """
+    base_dir = paths.artifacts_dir / "baseline"
+    index_path = base_dir / sample_index_name()
+    index = read_table(index_path)
+    new_index, touched, counts = diff_samples(paths.raw_gpkg, index, features, grid_cfg.utm_epsg, key)
+    summary = {**counts, "touched_cells": int(len(touched))}
+    if len(touched) == 0:
+        return summary
+
+    sizes = tuple(sorted(set(grid_cfg.pyramid_sizes_m) | {grid_cfg.grid_size_m}))
+    regridded = regrid_touched(paths.raw_gpkg, new_index, touched, features, sizes, key)
+    grid_cells = None
+    for size, (ids, df) in regridded.items():
+        path = base_dir / f"grid_cells_{level_name(size)}.parquet"
+        if not path.exists():
+            continue
+        cells = read_table(path)
+        cells = _patch(cells, ids, _cells_frame(df, size, cells.crs))
+        write_table(cells, path)
+        if size == grid_cfg.grid_size_m:
+            grid_cells = cells
+
+    ids = regridded[grid_cfg.grid_size_m][0]
+    for v in variants:
+        vdir = paths.artifacts_dir / ("baseline" if v == "baseline" else f"robustness_{v}")
+        if (vdir / f"iforest_model_{v}.joblib").exists():
+            summary[v] = update_variant(paths, v, grid_cells, ids, model_cfg, cluster_cfg, grid_cfg.grid_size_m)
+    write_table(new_index, index_path)
+    return summary
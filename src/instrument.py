@@ -0,0 +1,203 @@
+from __future__ import annotations
+import functools
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, is_dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+# Run instrumentation. A RunRecorder collects one record per stage (wall/CPU time, peak RSS, rows in/out,
+# bytes read/written) and per-call statistics of hot functions decorated with @traced; write_manifest
+# saves it as JSON next to the artifacts with the config dataclasses and input-file hashes.
+# With no recorder active, @traced functions cost one list lookup per call.
+
+_ACTIVE: list["RunRecorder"] = []
+
+
+def _proc_io() -> dict[str, int] | None:
+    """Bytes read/written by this process so far (Linux /proc/self/io: rchar/wchar, incl. page-cache hits)."""
+    try:
+        with open("/proc/self/io") as f:
+            io = dict(line.split(": ") for line in f.read().splitlines())
+        return {"read": int(io["rchar"]), "written": int(io["wchar"])}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the kernel's RSS high-water mark (Linux >= 4.0); False where unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024     # bytes on macOS, KiB elsewhere
+
+
+def count_rows(obj: Any) -> int | None:
+    """Rows of a table result (DataFrame / CellTable), summed over the tables of a tuple result."""
+    if hasattr(obj, "columns") and hasattr(obj, "__len__") and not isinstance(obj, dict):
+        return len(obj)
+    if isinstance(obj, tuple):
+        counts = [c for c in (count_rows(o) for o in obj if not isinstance(o, tuple)) if c is not None]
+        return sum(counts) if counts else None
+    return None
+
+
+class RunRecorder:
+    """Stage records and @traced hook statistics of one run."""
+
+    def __init__(self, name: str = "run"):
+        self.name = name
+        self.started = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self.stages: list[dict] = []
+        self.hooks: dict[str, dict] = {}
+        self._current: dict | None = None
+        self._t0 = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int | None = None):
+        """Record the enclosed block; the yielded dict may be filled in (rows_out, meta, ...)."""
+        rec: dict[str, Any] = {"name": name, "status": "ran", "rows_in": rows_in, "rows_out": None}
+        outer, self._current = self._current, rec
+        scoped = _reset_peak_rss()
+        io0 = _proc_io()
+        w0, c0 = time.perf_counter(), time.process_time()
+        try:
+            yield rec
+        finally:
+            rec["wall_s"] = time.perf_counter() - w0
+            rec["cpu_s"] = time.process_time() - c0
+            rec["peak_rss_mb"] = _peak_rss_mb()
+            rec["peak_rss_scope"] = "stage" if scoped else "process"
+            io1 = _proc_io()
+            rec["bytes_read"] = io1["read"] - io0["read"] if io0 and io1 else None
+            rec["bytes_written"] = io1["written"] - io0["written"] if io0 and io1 else None
+            self.stages.append(rec)
+            self._current = outer
+
+    def skipped(self, name: str, status: str = "cached", **info) -> None:
+        self.stages.append({"name": name, "status": status, **info})
+
+    def hook(self, name: str, wall_s: float, rows_in: int | None, rows_out: int | None) -> None:
+        for target in (self.hooks, self._current.setdefault("hooks", {}) if self._current is not None else None):
+            if target is None:
+                continue
+            h = target.setdefault(name, {"calls": 0, "wall_s": 0.0, "rows_in": 0, "rows_out": 0})
+            h["calls"] += 1
+            h["wall_s"] += wall_s
+            h["rows_in"] += rows_in or 0
+            h["rows_out"] += rows_out or 0
+
+    def summary(self) -> dict:
+        ran = [s for s in self.stages if s["status"] == "ran"]
+        return {
+            "wall_s": time.perf_counter() - self._t0,
+            "stage_wall_s": sum(s["wall_s"] for s in ran),
+            "peak_rss_mb": max((s["peak_rss_mb"] for s in ran), default=None),
+            "bytes_read": sum(s["bytes_read"] or 0 for s in ran),
+            "bytes_written": sum(s["bytes_written"] or 0 for s in ran),
+        }
+
+
+@contextmanager
+def recording(recorder: RunRecorder):
+    """Make `recorder` receive @traced hook calls inside the block."""
+    _ACTIVE.append(recorder)
+    try:
+        yield recorder
+    finally:
+        _ACTIVE.remove(recorder)
+
+
+def traced(func: Callable | None = None, *, name: str | None = None):
+    """Decorator: count calls, wall time and rows in/out of a hot function while a recorder is active."""
+    def wrap(f):
+        label = name or f"{f.__module__.rsplit('.', 1)[-1]}.{f.__name__}"
+
+        @functools.wraps(f)
+        def inner(*args, **kwargs):
+            if not _ACTIVE:
+                return f(*args, **kwargs)
+            t = time.perf_counter()
+            out = f(*args, **kwargs)
+            _ACTIVE[-1].hook(label, time.perf_counter() - t, count_rows(args[0]) if args else None, count_rows(out))
+            return out
+        return inner
+    return wrap(func) if func is not None else wrap
+
+
+def _git_commit(repo: Path) -> str | None:
+    import subprocess
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo, capture_output=True, text=True,
+                              check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_manifest(path: str | Path, recorder: RunRecorder, configs: dict[str, Any] | None = None,
+                   inputs: list[str | Path] = (), extra: dict | None = None, repo: str | Path | None = None) -> Path:
+    """
+    JSON manifest: run info, config dataclasses, input files (size, sha256), stage records, hook
+    totals and `extra` (status, meta dicts, ...). Non-JSON values are written as strings.
+    """
+    from .pipeline import file_sha256
+    path = Path(path)
+    manifest = {
+        "run": recorder.name,
+        "started": recorder.started,
+        "finished": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": _git_commit(Path(repo)) if repo is not None else None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "configs": {k: asdict(v) if is_dataclass(v) else v for k, v in (configs or {}).items()},
+        "inputs": {str(p): {"bytes": Path(p).stat().st_size, "sha256": file_sha256(p)}
+                   for p in inputs if Path(p).exists()},
+        "summary": recorder.summary(),
+        "stages": recorder.stages,
+        "hooks": recorder.hooks,
+        **(extra or {}),
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(manifest, indent=2, default=str))
+    return path
+
+
+def start_run(name: str) -> RunRecorder:
+    """Script helper: activate a recorder and open a stage named after the script (see finish_run)."""
+    rec = RunRecorder(name)
+    _ACTIVE.append(rec)
+    rec._script_stage = rec.stage(name)
+    rec._script_stage.__enter__()
+    return rec
+
+
+def finish_run(recorder: RunRecorder, paths, configs: dict[str, Any] | None = None, inputs: list[str | Path] = (),
+               extra: dict | None = None) -> Path:
+    """Close the script stage and write <artifacts>/runs/<name>.json."""
+    recorder._script_stage.__exit__(None, None, None)
+    _ACTIVE.remove(recorder)
+    out = write_manifest(paths.artifacts_dir / "runs" / f"{recorder.name}.json", recorder, configs, inputs, extra,
+                         repo=paths.repo_root)
+    print("Saved:", out)
+    return out
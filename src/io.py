@@ -1,17 +1,78 @@
 from __future__ import annotations
 from pathlib import Path
+from typing import Iterator
 import geopandas as gpd
+from .instrument import traced
 
-def read_points_gpkg(path: str | Path, layer: str | None = None) -> gpd.GeoDataFrame:
-    """Read NTGS points as GeoDataFrame. Expects geometry column present."""
+try:
+    import pyogrio
+    HAS_PYOGRIO = True
+except Exception:
+    HAS_PYOGRIO = False
+
+DEFAULT_CRS = "EPSG:4283"  # Most NTGS layers are GDA94 but keep it explicit if missing
+
+
+@traced
+def read_points_gpkg(path: str | Path, layer: str | None = None, columns: list[str] | None = None,
+                     bbox: tuple[float, float, float, float] | None = None, where: str | None = None) -> gpd.GeoDataFrame:
+    """
+    Read NTGS points as GeoDataFrame. Expects geometry column present.
+    columns / bbox (layer CRS) / where (OGR SQL) are pushed down to the driver when given.
+    """
     path = Path(path)
-    gdf = gpd.read_file(path, layer=layer) if layer else gpd.read_file(path)
+    kwargs = {k: v for k, v in {"layer": layer, "columns": columns, "bbox": bbox, "where": where}.items() if v is not None}
+    gdf = gpd.read_file(path, **kwargs)
     if gdf.crs is None:
-        # Most NTGS layers are EPSG:4283 (GDA94) but keep it explicit if missing
-        gdf = gdf.set_crs("EPSG:4283")
+        gdf = gdf.set_crs(DEFAULT_CRS)
     return gdf
 
+
+def iter_points_gpkg(path: str | Path, layer: str | None = None, columns: list[str] | None = None,
+                     bbox: tuple[float, float, float, float] | None = None, where: str | None = None,
+                     batch_size: int = 65536) -> Iterator[gpd.GeoDataFrame]:
+    """
+    Stream NTGS points in GeoDataFrame batches of at most batch_size rows.
+    Only `columns` (+ geometry) are read; bbox and where filter rows inside GDAL.
+    Memory is bounded by the batch size, not by the layer size.
+    """
+    path = Path(path)
+    columns = None if columns is None else list(columns)      # [] = geometry only, None = every column
+    if HAS_PYOGRIO:
+        import shapely
+        with pyogrio.raw.open_arrow(path, layer=layer, columns=columns, bbox=bbox, where=where,
+                                    batch_size=batch_size, use_pyarrow=True) as (meta, reader):
+            crs = meta["crs"] or DEFAULT_CRS
+            geom_col = meta["geometry_name"] or "wkb_geometry"
+            for batch in reader:
+                geom = shapely.from_wkb(batch.column(geom_col).to_numpy(zero_copy_only=False))
+                attrs = batch.drop_columns([geom_col]).to_pandas()
+                yield gpd.GeoDataFrame(attrs, geometry=geom, crs=crs)
+        return
+
+    # fallback: row windows through the default engine
+    start = 0
+    while True:
+        kwargs = {k: v for k, v in {"layer": layer, "bbox": bbox, "where": where}.items() if v is not None}
+        gdf = gpd.read_file(path, rows=slice(start, start + batch_size), columns=columns, **kwargs)
+        if gdf.empty:
+            return
+        if gdf.crs is None:
+            gdf = gdf.set_crs(DEFAULT_CRS)
+        yield gdf
+        start += batch_size
+
+
+def layer_columns(path: str | Path, layer: str | None = None) -> list[str]:
+    """Attribute column names of a layer, without reading features."""
+    if HAS_PYOGRIO:
+        return list(pyogrio.read_info(path, layer=layer)["fields"])
+    return [c for c in gpd.read_file(path, layer=layer, rows=slice(0, 1)).columns if c != "geometry"]
+
+
+@traced
 def write_gpkg(gdf: gpd.GeoDataFrame, path: str | Path, layer: str) -> None:
+    """Export a layer for GIS users. Stage-to-stage data goes through src/store (Parquet) instead."""
     path = Path(path)
     path.parent.mkdir(parents=True, exist_ok=True)
     gdf.to_file(path, layer=layer, driver="GPKG")
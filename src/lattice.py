@@ -0,0 +1,123 @@
+from __future__ import annotations
+from dataclasses import dataclass, field, replace
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class CellTable:
+    """
+    Compact per-cell table on the integer grid lattice.
+    Cell (i, j) covers [origin_x + i*size, origin_x + (i+1)*size) x [origin_y + j*size, ...).
+    No geometry is stored: polygons/centroids are derived (vectorised) only when exporting or plotting.
+    Stages add per-cell outputs to `columns` (anomaly_score, is_anomaly, cluster_id, ...) without
+    copying X or the lattice indices.
+    """
+    cell_x: np.ndarray               # int32
+    cell_y: np.ndarray               # int32
+    X: np.ndarray                    # float32 (n_cells, n_features), per-cell medians
+    features: list[str]
+    n_points: np.ndarray             # int32
+    grid_size_m: int
+    crs: str
+    origin: tuple[float, float] = (0.0, 0.0)
+    columns: dict[str, np.ndarray] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.cell_x)
+
+    # ---- construction ----
+    @classmethod
+    def from_cells(cls, cells: pd.DataFrame, features: list[str] | None = None) -> "CellTable":
+        """
+        From an aggregate_to_cells-style frame. Lattice indices come from cell_x/cell_y, else from
+        the cell polygons (any origin, e.g. GPKG artifacts), else from the packed cell_id.
+        Non-feature numeric columns (anomaly_score, cluster_id, ...) are kept in `columns`.
+        """
+        from .grid import split_cell_id, _infer_grid_size
+        size = _infer_grid_size(cells)
+        origin = (0.0, 0.0)
+        geom_col = getattr(cells, "_geometry_column_name", None)
+        if "cell_x" in cells.columns and "cell_y" in cells.columns:
+            cx, cy = cells["cell_x"].to_numpy(), cells["cell_y"].to_numpy()
+        elif geom_col in cells.columns and len(cells) and "grid_size_m" not in cells.attrs:
+            b = cells.geometry.bounds.to_numpy()
+            origin = (float(b[0, 0] - np.round(b[0, 0] / size) * size), float(b[0, 1] - np.round(b[0, 1] / size) * size))
+            cx = np.round((b[:, 0] - origin[0]) / size)
+            cy = np.round((b[:, 1] - origin[1]) / size)
+        else:
+            cx, cy = split_cell_id(cells["cell_id"].to_numpy())
+        if features is None:
+            features = [c for c in cells.columns if c.endswith(("_PPM", "_PPB", "_PCT"))]
+        feats = [c for c in features if c in cells.columns]
+        X = np.ascontiguousarray(cells[feats].to_numpy(dtype=np.float32, na_value=np.nan)).reshape(len(cells), len(feats))
+        skip = set(feats) | {"cell_x", "cell_y", "n_points", geom_col}
+        extra = {c: cells[c].to_numpy() for c in cells.columns
+                 if c not in skip and pd.api.types.is_numeric_dtype(cells[c])}
+        crs = cells.crs.to_string() if getattr(cells, "crs", None) is not None else None
+        return cls(cell_x=np.asarray(cx, dtype=np.int32), cell_y=np.asarray(cy, dtype=np.int32), X=X,
+                   features=feats, n_points=cells["n_points"].to_numpy(dtype=np.int32), grid_size_m=int(size),
+                   crs=crs, origin=origin, columns=extra)
+
+    # ---- derived ----
+    @property
+    def cell_id(self) -> np.ndarray:
+        if "cell_id" in self.columns:
+            return self.columns["cell_id"]
+        from .grid import pack_cell_id
+        return pack_cell_id(self.cell_x, self.cell_y)
+
+    def centroids(self) -> tuple[np.ndarray, np.ndarray]:
+        s = self.grid_size_m
+        return (self.origin[0] + (self.cell_x + 0.5) * s, self.origin[1] + (self.cell_y + 0.5) * s)
+
+    def geometry(self) -> np.ndarray:
+        """Cell polygons as a shapely array (built in one vectorised call)."""
+        import shapely
+        s = self.grid_size_m
+        x0 = self.origin[0] + self.cell_x.astype(np.float64) * s
+        y0 = self.origin[1] + self.cell_y.astype(np.float64) * s
+        return shapely.box(x0, y0, x0 + s, y0 + s)
+
+    # ---- views / updates ----
+    def take(self, idx) -> "CellTable":
+        """Row subset (boolean mask or integer index)."""
+        idx = np.asarray(idx)
+        return replace(self, cell_x=self.cell_x[idx], cell_y=self.cell_y[idx], X=self.X[idx],
+                       n_points=self.n_points[idx], columns={k: v[idx] for k, v in self.columns.items()})
+
+    def with_columns(self, **arrays: np.ndarray) -> "CellTable":
+        """New table sharing all arrays, plus/replacing the given per-cell columns."""
+        for k, v in arrays.items():
+            if len(v) != len(self):
+                raise ValueError(f"Column {k!r} has {len(v)} rows, table has {len(self)}")
+        return replace(self, columns={**self.columns, **{k: np.asarray(v) for k, v in arrays.items()}})
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name in self.columns:
+            return self.columns[name]
+        if name == "n_points":
+            return self.n_points
+        if name in self.features:
+            return self.X[:, self.features.index(name)]
+        raise KeyError(name)
+
+    # ---- materialisation ----
+    def feature_frame(self) -> pd.DataFrame:
+        """Features as a DataFrame over X (no copy), for the pandas preprocessing helpers."""
+        return pd.DataFrame(self.X, columns=self.features, copy=False)
+
+    def frame(self, columns: list[str] | None = None) -> pd.DataFrame:
+        """Plain DataFrame (features + n_points + extra columns), no geometry."""
+        data = {c: self.X[:, j] for j, c in enumerate(self.features)}
+        data["cell_id"] = self.cell_id
+        data["n_points"] = self.n_points
+        data.update(self.columns)
+        df = pd.DataFrame(data if columns is None else {c: data[c] for c in columns})
+        df.attrs["grid_size_m"] = self.grid_size_m
+        return df
+
+    def to_geodataframe(self, columns: list[str] | None = None):
+        """GeoDataFrame with cell polygons, for export and plotting."""
+        import geopandas as gpd
+        return gpd.GeoDataFrame(self.frame(columns), geometry=self.geometry(), crs=self.crs)
@@ -0,0 +1,125 @@
+from __future__ import annotations
+import numpy as np
+
+from .lattice import CellTable
+from .preprocess import cached_log10_matrix
+from .instrument import traced
+
+# Local-background mode: each cell is compared with the cells around it instead of the whole territory.
+# Moving-window quantiles are computed on the dense lattice raster with integral images: every feature
+# is quantised into n_bins global-quantile bins, and for each bin one 2-D cumulative sum gives, at every
+# cell, how many window cells fall at or below it. Window medians/quartiles are read off those counts
+# (linear within the bin), so the cost is O(n_bins * lattice area) per feature, independent of radius.
+
+def window_quantiles(cell_x: np.ndarray, cell_y: np.ndarray, values: np.ndarray, radius: int,
+                     qs: tuple[float, ...] = (0.25, 0.5, 0.75), n_bins: int = 32) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Quantiles of `values` (n,) over the occupied cells of the (2*radius+1)^2 square window around each
+    cell (the cell included). Returns (quantiles (n, len(qs)), window cell count (n,)).
+    """
+    n = len(values)
+    if n == 0:
+        return np.empty((0, len(qs))), np.empty(0, dtype=np.int64)
+    # raster row/col 0 stay empty, so the integral image needs no separate zero padding
+    x = (cell_x - cell_x.min()).astype(np.int64) + 1
+    y = (cell_y - cell_y.min()).astype(np.int64) + 1
+    H, W = int(y.max()) + 1, int(x.max()) + 1
+    y0, y1 = np.clip(y - radius - 1, 0, H - 1), np.clip(y + radius, 0, H - 1)
+    x0, x1 = np.clip(x - radius - 1, 0, W - 1), np.clip(x + radius, 0, W - 1)
+    corners = (y1 * W + x1, y0 * W + x1, y1 * W + x0, y0 * W + x0)
+    raster = np.zeros((H, W), dtype=np.int32)
+    I = np.empty((H, W), dtype=np.int32)
+
+    def window_sum() -> np.ndarray:
+        np.cumsum(raster, axis=1, out=I)
+        np.cumsum(I, axis=0, out=I)
+        flat = I.ravel()
+        a, b, c, d = (flat.take(k) for k in corners)
+        return a - b - c + d
+
+    raster[y, x] = 1
+    total = window_sum()
+    raster[y, x] = 0
+
+    edges = np.unique(np.quantile(values, np.linspace(0.0, 1.0, n_bins + 1)))
+    nb = max(len(edges) - 1, 1)
+    code = np.clip(np.searchsorted(edges, values, side="right") - 1, 0, nb - 1)
+    lo_edge = edges[:nb]
+    hi_edge = edges[1:] if len(edges) > 1 else edges
+
+    # cum[:, b] = window cells with code <= b
+    cum = np.zeros((n, nb + 1), dtype=np.int32)
+    by_bin = np.argsort(code, kind="stable")
+    starts = np.searchsorted(code[by_bin], np.arange(nb + 1))
+    for b in range(nb):
+        rows = by_bin[starts[b]:starts[b + 1]]
+        if len(rows) == 0:
+            cum[:, b + 1] = cum[:, b]
+            continue
+        raster[y[rows], x[rows]] = 1
+        cum[:, b + 1] = window_sum()
+
+    out = np.empty((n, len(qs)))
+    idx = np.arange(n)
+    for k, q in enumerate(qs):
+        t = q * (total - 1) + 0.5              # rank of the linear-interpolation quantile, bin-centred
+        b = np.minimum((cum[:, 1:] < t[:, None]).sum(axis=1), nb - 1)   # first bin reaching t
+        below, upto = cum[idx, b], cum[idx, b + 1]
+        frac = (t - below) / np.maximum(upto - below, 1)
+        out[:, k] = lo_edge[b] + frac * (hi_edge[b] - lo_edge[b])
+    return out, total
+
+@traced
+def local_residuals(cells, features: list[str], radius_m: float, min_cells: int = 5, n_bins: int = 32,
+                    n_jobs: int = -1) -> tuple[np.ndarray, list[str], dict[str, np.ndarray]]:
+    """
+    Robust local z-scores of the log10 features: (x - window median) / window spread, where spread is
+    the window IQR / 1.349. Cells whose window holds fewer than min_cells cells (or has zero spread)
+    fall back to the territory-wide median / spread.
+    Features run in a thread pool (the raster passes release the GIL).
+    Returns (residual matrix (n, d) float32, feature columns, {"local_median", "local_spread", "n_window"}).
+    """
+    from joblib import Parallel, delayed
+    if not isinstance(cells, CellTable):
+        cells = CellTable.from_cells(cells, features)
+    fm = cached_log10_matrix(cells, features)
+    X = fm.X.astype(np.float64)
+    radius = int(round(radius_m / cells.grid_size_m))
+    n, d = X.shape
+    med = np.empty((n, d))
+    spread = np.empty((n, d))
+    n_window = np.zeros(n, dtype=np.int64)
+    results = Parallel(n_jobs=n_jobs, backend="threading")(
+        delayed(window_quantiles)(cells.cell_x, cells.cell_y, X[:, j], radius, n_bins=n_bins) for j in range(d)
+    )
+    for j, (q, n_window) in enumerate(results):
+        g25, g50, g75 = np.quantile(X[:, j], [0.25, 0.5, 0.75])
+        g_spread = (g75 - g25) / 1.349
+        s = (q[:, 2] - q[:, 0]) / 1.349
+        local = (n_window >= min_cells) & (s > 0)
+        med[:, j] = np.where(local, q[:, 1], g50)
+        spread[:, j] = np.where(local, s, g_spread if g_spread > 0 else 1.0)
+    R = np.ascontiguousarray((X - med) / spread, dtype=np.float32)
+    return R, fm.columns, {"local_median": med, "local_spread": spread, "n_window": n_window}
+
+def score_local(cells, features: list[str], radius_m: float, contamination: float, random_state: int,
+                scorer: str = "iforest", min_cells: int = 5):
+    """
+    Local-background anomaly scoring: the scorer is fitted on local residual features instead of the
+    territory-wide scaled matrix. Returns (cells + anomaly_score, meta), like score_anomalies.
+    """
+    from .modeling import make_scorer, _with_columns
+    table = cells if isinstance(cells, CellTable) else CellTable.from_cells(cells, features)
+    R, cols, _ = local_residuals(table, features, radius_m, min_cells)
+    score = make_scorer(scorer, contamination, random_state).fit(R).score(R)
+    meta = {
+        "scorer": scorer,
+        "background": "local",
+        "local_radius_m": radius_m,
+        "features_requested": features,
+        "features_used": cols,
+        "contamination": contamination,
+        "random_state": random_state,
+        "n_cells": int(len(score)),
+    }
+    return _with_columns(cells, anomaly_score=score), meta
@@ -1,52 +1,254 @@
 from __future__ import annotations
+import warnings
+from dataclasses import dataclass, field, replace
+from pathlib import Path
 import numpy as np
 import pandas as pd
+import sklearn
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import RobustScaler
 
-from .preprocess import fix_and_log10, median_impute
+from .preprocess import Log10Transform, cached_log10_matrix
+from .lattice import CellTable
+from .instrument import traced
 
-def score_iforest(cells_df: pd.DataFrame, features: list[str], contamination: float, random_state: int) -> tuple[pd.DataFrame, dict]:
+MODEL_FORMAT_VERSION = 2   # 2: AnomalyModel.scorer (any registered scorer) replaces .forest
+
+# ---- scorers: fit(Xs) on the scaled matrix, score(Xs) -> anomaly_score (higher = more anomalous) ----
+
+class IForestScorer:
+    """sklearn IsolationForest, 300 trees; score = -score_samples."""
+    def __init__(self, contamination: float, random_state: int, n_jobs: int = -1):
+        self.forest = IsolationForest(n_estimators=300, contamination=contamination,
+                                      random_state=random_state, n_jobs=n_jobs)
+
+    def fit(self, Xs: np.ndarray) -> "IForestScorer":
+        self.forest.fit(Xs)
+        return self
+
+    def score(self, Xs: np.ndarray) -> np.ndarray:
+        # sklearn score_samples: higher = less abnormal. invert to "anomaly_score".
+        return -self.forest.score_samples(Xs)
+
+class HBOSScorer:
     """
-    Returns cells_df with anomaly_score column (higher = more anomalous)
-    and meta dict.
+    Histogram-based outlier score: per feature, an equal-width histogram of the training cells;
+    score = sum over features of -log(bin height / max height + alpha). O(n * d) fit and score.
+    Values outside the training range score as an empty bin.
     """
-    X_log, keep_cols, dropped = fix_and_log10(cells_df, features)
-    X_imp = median_impute(X_log)
+    def __init__(self, contamination: float, random_state: int, n_jobs: int = -1, n_bins: int | None = None,
+                 alpha: float = 0.1):
+        self.n_bins = n_bins
+        self.alpha = alpha
+
+    def fit(self, Xs: np.ndarray) -> "HBOSScorer":
+        n, d = Xs.shape
+        bins = self.n_bins or max(10, int(np.sqrt(n)))
+        self.edges_ = np.empty((d, bins + 1))
+        self.log_height_ = np.empty((d, bins))
+        for j in range(d):
+            counts, self.edges_[j] = np.histogram(Xs[:, j], bins=bins)
+            h = counts / max(counts.max(), 1)
+            self.log_height_[j] = -np.log(h + self.alpha)
+        return self
+
+    def score(self, Xs: np.ndarray) -> np.ndarray:
+        score = np.zeros(Xs.shape[0])
+        empty = -np.log(self.alpha)
+        bins = self.log_height_.shape[1]
+        for j in range(Xs.shape[1]):
+            e = self.edges_[j]
+            k = np.searchsorted(e, Xs[:, j], side="right") - 1
+            k[Xs[:, j] == e[-1]] = bins - 1        # right edge belongs to the last bin (np.histogram)
+            inside = (k >= 0) & (k < bins)
+            score += np.where(inside, self.log_height_[j][np.clip(k, 0, bins - 1)], empty)
+        return score
+
+class MCDScorer:
+    """Robust Mahalanobis distance (squared) to a Minimum Covariance Determinant fit of the background."""
+    def __init__(self, contamination: float, random_state: int, n_jobs: int = -1):
+        from sklearn.covariance import MinCovDet
+        self.mcd = MinCovDet(random_state=random_state)
+
+    def fit(self, Xs: np.ndarray) -> "MCDScorer":
+        self.mcd.fit(Xs)
+        return self
+
+    def score(self, Xs: np.ndarray) -> np.ndarray:
+        return self.mcd.mahalanobis(Xs)
+
+SCORERS = {"iforest": IForestScorer, "hbos": HBOSScorer, "mcd": MCDScorer}
+
+def make_scorer(name: str, contamination: float, random_state: int, n_jobs: int = -1):
+    if name not in SCORERS:
+        raise ValueError(f"Unknown scorer {name!r}; available: {sorted(SCORERS)}")
+    return SCORERS[name](contamination, random_state, n_jobs=n_jobs)
+
+@dataclass(frozen=True)
+class AnomalyModel:
+    """
+    Frozen background model: preprocessing constants, scaler, fitted scorer and (once marked) the threshold.
+    Scores new cells without refitting.
+    """
+    features: list[str]
+    prep: Log10Transform
+    scaler: RobustScaler
+    scorer: object
+    contamination: float
+    random_state: int
+    threshold: float | None = None
+    meta: dict = field(default_factory=dict)
+
+    def score(self, cells) -> np.ndarray:
+        """anomaly_score (higher = more anomalous) for a DataFrame or CellTable of cells."""
+        Xs = self.scaler.transform(self.prep.transform(cells))
+        return self.scorer.score(Xs)
+
+    def score_cells(self, cells):
+        """cells + anomaly_score (+ is_anomaly when the model carries a threshold)."""
+        score = self.score(cells)
+        out = _with_columns(cells, anomaly_score=score)
+        if self.threshold is not None:
+            out = _with_columns(out, is_anomaly=(score >= self.threshold).astype(int))
+        return out
+
+    def with_threshold(self, threshold: float) -> "AnomalyModel":
+        return replace(self, threshold=float(threshold), meta={**self.meta, "threshold": float(threshold)})
+
+def fit_model(cells_df: pd.DataFrame, features: list[str], contamination: float, random_state: int,
+              scorer: str = "iforest") -> tuple[AnomalyModel, np.ndarray]:
+    """Fit the log10 transform, RobustScaler and the named scorer. Returns (model, training anomaly_score)."""
+    fm = cached_log10_matrix(cells_df, features)
 
     scaler = RobustScaler()
-    Xs = scaler.fit_transform(X_imp)
+    Xs = scaler.fit_transform(fm.X)
 
-    clf = IsolationForest(
-        n_estimators=300,
-        contamination=contamination,
-        random_state=random_state,
-        n_jobs=-1
-    )
-    clf.fit(Xs)
+    est = make_scorer(scorer, contamination, random_state).fit(Xs)
+    score = est.score(Xs)
 
-    # sklearn score_samples: higher = less abnormal. invert to "anomaly_score".
-    score = -clf.score_samples(Xs)
+    meta = {
+        "scorer": scorer,
+        "features_requested": features,
+        "features_used": fm.columns,
+        "dropped_all_nonpositive": fm.dropped,
+        "contamination": contamination,
+        "random_state": random_state,
+        "n_cells": int(len(score)),
+    }
+    model = AnomalyModel(features=list(features), prep=fm.prep, scaler=scaler, scorer=est,
+                         contamination=contamination, random_state=random_state, meta=meta)
+    return model, score
+
+def fit_iforest(cells_df: pd.DataFrame, features: list[str], contamination: float, random_state: int) -> tuple[AnomalyModel, np.ndarray]:
+    return fit_model(cells_df, features, contamination, random_state, scorer="iforest")
+
+@traced
+def score_anomalies(cells_df: pd.DataFrame, features: list[str], contamination: float, random_state: int,
+                    scorer: str = "iforest", return_model: bool = False):
+    """
+    Returns cells_df with anomaly_score column (higher = more anomalous)
+    and meta dict (and the fitted AnomalyModel if return_model).
+    cells_df may be a DataFrame or a lattice CellTable; scorer is a key of SCORERS.
+    """
+    model, score = fit_model(cells_df, features, contamination, random_state, scorer)
+    out = _with_columns(cells_df, anomaly_score=score)
+    meta = dict(model.meta)
+    return (out, meta, model) if return_model else (out, meta)
 
-    out = cells_df.copy()
-    out["anomaly_score"] = score
+def score_iforest(cells_df: pd.DataFrame, features: list[str], contamination: float, random_state: int,
+                  return_model: bool = False):
+    """score_anomalies with the IsolationForest scorer."""
+    return score_anomalies(cells_df, features, contamination, random_state, "iforest", return_model)
 
+@traced
+def score_iforest_ensemble(cells_df: pd.DataFrame, features: list[str], contamination: float, random_state: int,
+                           n_seeds: int = 32, n_jobs: int = -1, backend: str = "threading",
+                           scorer: str = "iforest") -> tuple[pd.DataFrame, dict]:
+    """
+    Fit the scorer (IsolationForest by default) for seeds random_state .. random_state + n_seeds - 1 in
+    parallel on one shared, read-only scaled matrix (threads share it; "loky" memory-maps it). Per-seed
+    scores are folded into running statistics as they arrive, so memory does not grow with n_seeds or
+    the number of workers.
+    Adds anomaly_score (mean over seeds), anomaly_score_std and flag_freq (fraction of seeds whose top
+    `contamination` quantile contains the cell).
+    """
+    from joblib import Parallel, delayed
+
+    fm = cached_log10_matrix(cells_df, features)
+    Xs = RobustScaler().fit_transform(fm.X)
+    Xs.setflags(write=False)
+    seeds = [random_state + i for i in range(n_seeds)]
+
+    n = Xs.shape[0]
+    mean, m2, flags = np.zeros(n), np.zeros(n), np.zeros(n, dtype=np.int32)
+    results = Parallel(n_jobs=n_jobs, backend=backend, return_as="generator")(
+        delayed(_fit_score_seed)(Xs, contamination, seed, scorer) for seed in seeds
+    )
+    for k, score in enumerate(results, start=1):
+        # Welford update
+        d = score - mean
+        mean += d / k
+        m2 += d * (score - mean)
+        flags += score >= np.quantile(score, 1.0 - contamination)
+
+    std = np.sqrt(m2 / (n_seeds - 1)) if n_seeds > 1 else np.zeros(n)
+    out = _with_columns(cells_df, anomaly_score=mean, anomaly_score_std=std, flag_freq=flags / n_seeds)
     meta = {
+        "scorer": scorer,
         "features_requested": features,
-        "features_used": keep_cols,
-        "dropped_all_nonpositive": dropped,
+        "features_used": fm.columns,
+        "dropped_all_nonpositive": fm.dropped,
         "contamination": contamination,
         "random_state": random_state,
-        "n_cells": int(len(out)),
+        "n_seeds": n_seeds,
+        "n_cells": int(n),
+        "mean_score_std": float(std.mean()),
     }
     return out, meta
 
-def mark_anomalies(df_scored: pd.DataFrame, contamination: float) -> tuple[pd.DataFrame, float]:
+def _fit_score_seed(Xs: np.ndarray, contamination: float, seed: int, scorer: str = "iforest") -> np.ndarray:
+    return make_scorer(scorer, contamination, seed, n_jobs=1).fit(Xs).score(Xs)
+
+def save_model(model: AnomalyModel, path: str | Path) -> Path:
+    """Write a versioned model artifact (joblib)."""
+    import joblib
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    joblib.dump({"format_version": MODEL_FORMAT_VERSION, "sklearn_version": sklearn.__version__, "model": model}, path)
+    return path
+
+def load_model(path: str | Path) -> AnomalyModel:
+    import joblib
+    blob = joblib.load(path)
+    if blob.get("format_version") != MODEL_FORMAT_VERSION:
+        raise ValueError(f"{path}: model format {blob.get('format_version')}, expected {MODEL_FORMAT_VERSION}")
+    if blob.get("sklearn_version") != sklearn.__version__:
+        warnings.warn(f"{path} was saved with scikit-learn {blob.get('sklearn_version')}, "
+                      f"running {sklearn.__version__}; scores may differ")
+    return blob["model"]
+
+def _with_columns(cells, **cols):
+    if isinstance(cells, CellTable):
+        return cells.with_columns(**cols)
+    out = cells.copy()
+    for k, v in cols.items():
+        out[k] = v
+    return out
+
+def mark_anomalies(df_scored: pd.DataFrame, contamination: float, column: str = "anomaly_score",
+                   min_flag_freq: float | None = None) -> tuple[pd.DataFrame, float]:
     """
     Mark top contamination fraction as anomalies.
     Returns df with is_anomaly and threshold (quantile).
+    column: score to rank on (e.g. an ensemble lower bound such as mean - std).
+    min_flag_freq: for ensemble output, flag cells with flag_freq >= min_flag_freq instead;
+    the returned threshold is then min_flag_freq.
     """
-    thr = float(np.quantile(df_scored["anomaly_score"].values, 1.0 - contamination))
-    out = df_scored.copy()
-    out["is_anomaly"] = (out["anomaly_score"] >= thr).astype(int)
-    return out, thr
+    if min_flag_freq is not None:
+        if "flag_freq" not in df_scored.columns:
+            raise ValueError("min_flag_freq needs ensemble output with a flag_freq column (n_seeds > 1)")
+        freq = np.asarray(df_scored["flag_freq"])
+        return _with_columns(df_scored, is_anomaly=(freq >= min_flag_freq).astype(int)), float(min_flag_freq)
+    score = np.asarray(df_scored[column])
+    thr = float(np.quantile(score, 1.0 - contamination))
+    return _with_columns(df_scored, is_anomaly=(score >= thr).astype(int)), thr
@@ -0,0 +1,434 @@
+from __future__ import annotations
+import functools
+import hashlib
+import inspect
+import json
+import pickle
+import re
+import shutil
+from dataclasses import dataclass, field, fields, is_dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+from .config import Paths, GridConfig, ModelConfig, ClusterConfig, FEATURES_BASELINE, FEATURES_NOAG
+
+# Stage outputs are cached under <artifacts>/.cache/<stage>/<key>/, where the key is built from
+# the stage's params (config dataclasses, feature lists), the content hash of its input files and
+# the keys of the stages it depends on, plus a hash of the stage code (the stage function and every
+# package module it reaches through relative imports). Changing one config therefore invalidates only
+# the stages downstream of where it is used. Tables inside a result are stored as (Geo)Parquet via
+# src/store, anything else (meta dicts, path lists) is pickled.
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    func: Callable[..., Any]
+    deps: dict[str, str] = field(default_factory=dict)     # func kwarg -> upstream stage name
+    params: dict[str, Any] = field(default_factory=dict)   # func kwarg -> value (part of the key)
+    inputs: tuple[Path, ...] = ()                          # files read by func (content-hashed)
+    publishes: bool = False                                # func writes artifacts/figures to disk
+    version: str = "1"                                     # bump to invalidate without a code change
+
+
+def _canon(obj: Any) -> Any:
+    """Turn params into a JSON-stable structure (dataclasses keep their type name)."""
+    if is_dataclass(obj) and not isinstance(obj, type):
+        return {"__type__": type(obj).__name__, **{f.name: _canon(getattr(obj, f.name)) for f in fields(obj)}}
+    if isinstance(obj, dict):
+        return {str(k): _canon(v) for k, v in sorted(obj.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(obj, (list, tuple)):
+        return [_canon(v) for v in obj]
+    if isinstance(obj, Path):
+        return str(obj)
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    raise TypeError(f"Cannot build a cache key from {type(obj).__name__}")
+
+
+_RELATIVE_IMPORT = re.compile(r"^\s*from \.(\w*) import ([\w, ()]+)", re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=None)
+def code_hash(func: Callable) -> str:
+    """sha256 of a stage function's source and of the package modules it imports, transitively."""
+    try:
+        src = inspect.getsource(func)
+        pkg_dir = Path(inspect.getfile(func)).parent
+    except (OSError, TypeError):
+        return hashlib.sha256(getattr(getattr(func, "__code__", None), "co_code", repr(func).encode())).hexdigest()[:20]
+    h = hashlib.sha256(src.encode("utf-8"))
+    seen, todo = set(), [src]
+    while todo:
+        for mod, names in _RELATIVE_IMPORT.findall(todo.pop()):
+            # `from .mod import x` -> mod; `from . import a, b` -> a, b
+            for m in [mod] if mod else re.findall(r"\w+", names):
+                path = pkg_dir / f"{m}.py"
+                if m not in seen and path.exists():
+                    seen.add(m)
+                    text = path.read_text(encoding="utf-8")
+                    h.update(m.encode() + b"\0" + text.encode("utf-8"))
+                    todo.append(text)
+    return h.hexdigest()[:20]
+
+
+def file_sha256(path: str | Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Pipeline:
+    """
+    Small DAG runner with content-addressed result caching.
+    Stages must be added after the stages they depend on.
+    """
+
+    def __init__(self, cache_dir: str | Path):
+        self.cache_dir = Path(cache_dir)
+        self.stages: dict[str, Stage] = {}
+        self._keys: dict[str, str] = {}
+        self._file_hashes: dict[tuple, str] = {}
+        self._loaded: dict[str, Any] = {}       # results loaded/computed during the current run()
+        self._executed: set[str] = set()        # stages that went through _execute in the current run()
+        self.recorder = None       # instrument.RunRecorder: per-stage timings/RSS/IO for the run manifest
+
+    def add(self, stage: Stage) -> Stage:
+        missing = [d for d in stage.deps.values() if d not in self.stages]
+        if missing:
+            raise ValueError(f"Stage {stage.name!r} depends on unknown stage(s): {missing}")
+        self.stages[stage.name] = stage
+        self._keys.clear()
+        return stage
+
+    # ---- keys ----
+    def _hash_file(self, path: Path) -> str:
+        st = path.stat()
+        memo = (str(path.resolve()), st.st_size, st.st_mtime_ns)
+        if memo not in self._file_hashes:
+            self._file_hashes[memo] = file_sha256(path)
+        return self._file_hashes[memo]
+
+    def key(self, name: str) -> str:
+        if name not in self._keys:
+            st = self.stages[name]
+            payload = {
+                "stage": st.name,
+                "version": st.version,
+                "code": code_hash(st.func),
+                "params": _canon(st.params),
+                "inputs": {str(p): self._hash_file(Path(p)) for p in st.inputs},
+                "deps": {arg: self.key(dep) for arg, dep in sorted(st.deps.items())},
+            }
+            blob = json.dumps(payload, sort_keys=True).encode("utf-8")
+            self._keys[name] = hashlib.sha256(blob).hexdigest()[:20]
+        return self._keys[name]
+
+    # ---- cache ----
+    def _cache_path(self, name: str) -> Path:
+        return self.cache_dir / name / self.key(name)
+
+    def _published_path(self) -> Path:
+        return self.cache_dir / "published.json"
+
+    def _read_published(self) -> dict[str, dict]:
+        p = self._published_path()
+        return json.loads(p.read_text()) if p.exists() else {}
+
+    def _mark_published(self, name: str, files: list[Path]) -> None:
+        """Record the stage key and the size/mtime/sha256 of every file the stage wrote."""
+        pub = self._read_published()
+        pub[name] = {"key": self.key(name), "files": {}}
+        for f in dict.fromkeys(Path(f) for f in files):
+            st = f.stat()
+            pub[name]["files"][str(f)] = {"bytes": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": self._hash_file(f)}
+        self._published_path().parent.mkdir(parents=True, exist_ok=True)
+        self._published_path().write_text(json.dumps(pub, indent=2, sort_keys=True))
+
+    def _published_intact(self, name: str) -> bool:
+        """Published under the current key and every recorded file still on disk, unchanged."""
+        rec = self._read_published().get(name)
+        if not isinstance(rec, dict) or rec.get("key") != self.key(name):
+            return False
+        for f, info in rec["files"].items():
+            path = Path(f)
+            if not path.exists():
+                return False
+            st = path.stat()
+            if st.st_size != info["bytes"]:
+                return False
+            if st.st_mtime_ns != info["mtime_ns"] and self._hash_file(path) != info["sha256"]:
+                return False
+        return True
+
+    def is_fresh(self, name: str) -> bool:
+        """Cached under the current key (and, for publishing stages, the files it wrote are still on disk, unchanged)."""
+        if not (self._cache_path(name) / "result.json").exists():
+            return False
+        if self.stages[name].publishes:
+            return self._published_intact(name)
+        return True
+
+    def _save(self, name: str, result: Any) -> None:
+        from .store import HAS_ARROW, write_table
+        import pandas as pd
+        path = self._cache_path(name)
+        tmp = path.with_name(path.name + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        parts = result if isinstance(result, tuple) else (result,)
+        files = []
+        for i, part in enumerate(parts):
+            if HAS_ARROW and isinstance(part, pd.DataFrame):
+                files.append(write_table(part, tmp / f"part{i}.parquet").name)
+            else:
+                with open(tmp / f"part{i}.pkl", "wb") as f:
+                    pickle.dump(part, f, protocol=pickle.HIGHEST_PROTOCOL)
+                files.append(f"part{i}.pkl")
+        (tmp / "result.json").write_text(json.dumps({"tuple": isinstance(result, tuple), "files": files}))
+        shutil.rmtree(path, ignore_errors=True)
+        tmp.replace(path)
+
+    def _read_cached(self, name: str) -> Any:
+        path = self._cache_path(name)
+        info = json.loads((path / "result.json").read_text())
+        parts = []
+        for fname in info["files"]:
+            if fname.endswith(".parquet"):
+                from .store import read_table
+                parts.append(read_table(path / fname))
+            else:
+                with open(path / fname, "rb") as f:
+                    parts.append(pickle.load(f))
+        return tuple(parts) if info["tuple"] else parts[0]
+
+    def load(self, name: str) -> Any:
+        """Return a stage result, computing it (and anything stale upstream) if needed."""
+        if name in self._loaded:
+            return self._loaded[name]
+        if self.is_fresh(name):
+            result = self._read_cached(name)
+        else:
+            result = self._execute(name)
+        self._loaded[name] = result
+        return result
+
+    def _execute(self, name: str) -> Any:
+        st = self.stages[name]
+        kwargs = dict(st.params)
+        for arg, dep in st.deps.items():
+            kwargs[arg] = self.load(dep)
+        print(f"[run]    {name} ({self.key(name)})")
+        self._executed.add(name)
+        _PUBLISHED.clear()
+        if self.recorder is None:
+            result = st.func(**kwargs)
+        else:
+            from .instrument import count_rows
+            rows_in = sum(count_rows(v) or 0 for arg, v in kwargs.items() if arg in st.deps)
+            with self.recorder.stage(name, rows_in=rows_in) as rec:
+                result = st.func(**kwargs)
+                rec["rows_out"] = count_rows(result)
+                rec["key"] = self.key(name)
+                parts = result if isinstance(result, tuple) else (result,)
+                meta = [part for part in parts if isinstance(part, dict)]
+                if meta:
+                    rec["meta"] = meta[0]
+        self._save(name, result)
+        if st.publishes:
+            self._mark_published(name, list(_PUBLISHED))
+        return result
+
+    def run(self, targets: list[str] | None = None, force: tuple[str, ...] = ()) -> dict[str, str]:
+        """
+        Bring targets (default: every stage) up to date.
+        Fresh stages are not loaded unless a stale stage downstream needs them. Every run rechecks
+        freshness: results held from an earlier run() on this object are dropped.
+        Returns {stage: "cached" | "ran"} ("ran": executed by this call, possibly as a dependency).
+        """
+        targets = list(self.stages) if targets is None else list(targets)
+        for name in force:
+            shutil.rmtree(self._cache_path(name), ignore_errors=True)
+        self._loaded.clear()
+        self._executed.clear()
+        status = {}
+        for name in targets:
+            if name in self._executed:
+                status[name] = "ran"
+            elif self.is_fresh(name):
+                status[name] = "cached"
+                print(f"[cached] {name} ({self.key(name)})")
+                if self.recorder is not None:
+                    self.recorder.skipped(name, key=self.key(name))
+            else:
+                self.load(name)
+                status[name] = "ran"
+        return status
+
+
+# ---- NTGS stages (heavy imports stay inside the stage bodies) ----
+
+_PUBLISHED: list[Path] = []     # files written by the running publishing stage (recorded in published.json)
+
+
+def _saved(*paths) -> None:
+    """Report a written artifact and record it for the running stage."""
+    for p in paths:
+        print("Saved:", p)
+        _PUBLISHED.append(Path(p))
+
+def _variant_dir(paths: Paths, variant: str) -> Path:
+    return paths.artifacts_dir / ("baseline" if variant == "baseline" else f"robustness_{variant}")
+
+
+def _stage_grid(raw_gpkg: Path, utm_epsg: str, grid_sizes_m: tuple[int, ...], features: list[str],
+                tile_size_m: int | None = None):
+    from .io import iter_points_gpkg
+    from .grid import stream_aggregate_to_pyramid
+    from .tiling import tiled_aggregate_to_pyramid
+    if tile_size_m:
+        levels = tiled_aggregate_to_pyramid(raw_gpkg, features, utm_epsg, grid_sizes_m, tile_size_m, as_table=True)
+    else:
+        batches = iter_points_gpkg(raw_gpkg, columns=features)
+        levels = stream_aggregate_to_pyramid(batches, features, utm_epsg, grid_sizes_m, as_table=True)
+    return tuple(levels[s] for s in grid_sizes_m)
+
+
+def _stage_iforest(pyramid, grid_size_m: int, features: list[str], model_cfg: ModelConfig, out_dir: Path, variant: str):
+    from .modeling import score_anomalies, score_iforest_ensemble, mark_anomalies, save_model
+    from .local import score_local
+    from .io import write_gpkg
+    from .grid import level_name
+    from .store import table_path, write_table
+    cells = next(level for level in pyramid if level.grid_size_m == grid_size_m)
+    cells = cells.take(cells.n_points >= model_cfg.min_points)
+    if model_cfg.min_flag_freq is not None and model_cfg.n_seeds <= 1:
+        raise ValueError("min_flag_freq needs the seed ensemble (n_seeds > 1)")
+    if model_cfg.local_radius_m:
+        if model_cfg.n_seeds > 1:
+            raise ValueError("local_radius_m and n_seeds > 1 cannot be combined")
+        scored, meta = score_local(cells, features, model_cfg.local_radius_m, model_cfg.contamination,
+                                   model_cfg.random_state, scorer=model_cfg.scorer)
+        model = None
+    elif model_cfg.n_seeds > 1:
+        scored, meta = score_iforest_ensemble(cells, features, model_cfg.contamination, model_cfg.random_state,
+                                              n_seeds=model_cfg.n_seeds, scorer=model_cfg.scorer)
+        model = None
+    else:
+        scored, meta, model = score_anomalies(cells, features, model_cfg.contamination, model_cfg.random_state,
+                                              scorer=model_cfg.scorer, return_model=True)
+    scored, thr = mark_anomalies(scored, model_cfg.contamination, min_flag_freq=model_cfg.min_flag_freq)
+    # threshold is always a score; the ensemble's flag-frequency cut-off is kept under its own key
+    meta["min_flag_freq" if model_cfg.min_flag_freq is not None else "threshold"] = thr
+    meta["min_points"] = model_cfg.min_points
+    meta["n_anomaly_cells"] = int(scored["is_anomaly"].sum())
+    if model is not None:
+        _saved(save_model(model.with_threshold(thr), out_dir / f"iforest_model_{variant}.joblib"))
+
+    out = out_dir / f"ntgs_anomaly_grid_{level_name(grid_size_m)}_stable_{variant}.gpkg"
+    gdf = scored.to_geodataframe()
+    write_gpkg(gdf, out, layer=f"iforest_min{model_cfg.min_points}_{variant}")
+    # Parquet intermediates under the same names as scripts 20/21 (read by scripts 22-80, query, incremental)
+    _saved(out, write_table(gdf, table_path(out)))
+    return scored, meta
+
+
+def _stage_cluster(scored, cluster_cfg: ClusterConfig, out_dir: Path, variant: str, tile_size_m: int | None = None):
+    from .clustering import CLUSTER_ENGINES, clusters_to_polygons, top_targets_table
+    from .tiling import tiled_clusters
+    from .io import write_gpkg
+    from .store import table_path, write_table
+    grid, _ = scored
+    anom = grid.take(grid["is_anomaly"] == 1)
+    if tile_size_m:
+        anom = tiled_clusters(anom, cluster_cfg.eps_m, cluster_cfg.min_samples, tile_size_m)
+    else:
+        anom = CLUSTER_ENGINES[cluster_cfg.engine](anom, eps_m=cluster_cfg.eps_m, min_samples=cluster_cfg.min_samples)
+    polys, cents = clusters_to_polygons(anom, buffer_m=cluster_cfg.buffer_m)
+
+    out_clusters = out_dir / f"ntgs_anomaly_clusters_{variant}.gpkg"
+    anom_gdf = anom.to_geodataframe()
+    write_gpkg(anom_gdf, out_clusters, layer=f"clusters_{variant}_eps{cluster_cfg.eps_m / 1000:g}km")
+    out_targets = out_dir / f"ntgs_target_clusters_{variant}.gpkg"
+    write_gpkg(polys, out_targets, layer=f"{variant}_polygons")
+    write_gpkg(cents, out_targets, layer=f"{variant}_centroids_wgs84")
+    out_top = out_dir / f"top_targets_{variant}.csv"
+    top_targets_table(cents, out_csv=str(out_top))
+    _saved(out_clusters, out_targets, out_top)
+    # Parquet intermediates under the same names as script 30
+    _saved(write_table(anom_gdf, table_path(out_clusters)),
+           write_table(polys, out_dir / f"ntgs_target_polygons_{variant}.parquet"),
+           write_table(cents, out_dir / f"ntgs_target_centroids_{variant}.parquet"))
+    return anom, polys, cents
+
+
+def _stage_fingerprint(scored, clusters, features: list[str], out_dir: Path, variant: str, tile_size_m: int | None = None):
+    from .fingerprint import cluster_fingerprint
+    from .tiling import tiled_fingerprint
+    grid, _ = scored
+    anom, _, _ = clusters
+    out_csv = out_dir / f"cluster_fingerprint_{variant}.csv"
+    if tile_size_m:
+        _, delta_long = tiled_fingerprint(grid, anom, features, str(out_csv), tile_size_m=tile_size_m)
+    else:
+        _, delta_long = cluster_fingerprint(grid, anom, features, out_csv=str(out_csv))
+    _saved(out_csv)
+    return delta_long
+
+
+def _stage_figures(scored, clusters, fingerprint, figures_dir: Path, reference: str, clusters_alt=None, alt: str | None = None):
+    from .viz import make_figures
+    _, polys, cents = clusters
+    polys_alt = clusters_alt[1] if clusters_alt is not None else None
+    # the lattice table is rasterised directly: no per-cell polygons are built for the maps
+    out = make_figures(scored[0], polys, cents, fingerprint, figures_dir, reference, polys_alt=polys_alt, alt=alt)
+    _PUBLISHED.extend(Path(p) for p in out)
+    print("Saved figures to:", figures_dir)
+    return [str(p) for p in out]
+
+
+def build_pipeline(paths: Paths,
+                   grid_cfg: GridConfig = GridConfig(),
+                   model_cfg: ModelConfig = ModelConfig(),
+                   cluster_cfg: ClusterConfig = ClusterConfig(),
+                   variants: dict[str, list[str]] | None = None) -> Pipeline:
+    """
+    grid -> iforest_<variant> -> cluster_<variant> -> fingerprint_<variant> -> figures.
+    The first variant is the reference for the figures; the second (if any) is overlaid in fig3.
+    With grid_cfg.tile_size_m set, grid/cluster/fingerprint run tile-partitioned (scoring stays global).
+    """
+    if variants is None:
+        variants = {"baseline": FEATURES_BASELINE, "noAG": FEATURES_NOAG}
+    all_features = list(dict.fromkeys(f for feats in variants.values() for f in feats))
+
+    # the grid stage builds every pyramid level; picking another level for scoring does not regrid
+    sizes = tuple(sorted(set(grid_cfg.pyramid_sizes_m) | {grid_cfg.grid_size_m}))
+    # only passed when set, so untiled runs keep their cache keys
+    tile = {"tile_size_m": grid_cfg.tile_size_m} if grid_cfg.tile_size_m else {}
+    p = Pipeline(paths.artifacts_dir / ".cache")
+    # versions: grid/cluster 2 (CellTable results), iforest 3 (CellTable, saved model), fingerprint 3
+    # (CI columns, missing cells skipped), figures 2 (lattice rasters)
+    p.add(Stage("grid", _stage_grid, inputs=(paths.raw_gpkg,), version="2",
+                params={"raw_gpkg": paths.raw_gpkg, "utm_epsg": grid_cfg.utm_epsg, "grid_sizes_m": sizes,
+                        "features": all_features, **tile}))
+    for v, feats in variants.items():
+        out_dir = _variant_dir(paths, v)
+        common = {"features": list(feats), "out_dir": out_dir, "variant": v}
+        p.add(Stage(f"iforest_{v}", _stage_iforest, deps={"pyramid": "grid"}, publishes=True, version="3",
+                    params={**common, "model_cfg": model_cfg, "grid_size_m": grid_cfg.grid_size_m}))
+        p.add(Stage(f"cluster_{v}", _stage_cluster, deps={"scored": f"iforest_{v}"}, publishes=True, version="2",
+                    params={"cluster_cfg": cluster_cfg, "out_dir": out_dir, "variant": v, **tile}))
+        p.add(Stage(f"fingerprint_{v}", _stage_fingerprint, publishes=True, version="3",
+                    deps={"scored": f"iforest_{v}", "clusters": f"cluster_{v}"}, params={**common, **tile}))
+
+    names = list(variants)
+    ref = names[0]
+    deps = {"scored": f"iforest_{ref}", "clusters": f"cluster_{ref}", "fingerprint": f"fingerprint_{ref}"}
+    params = {"figures_dir": paths.figures_dir, "reference": ref}
+    if len(names) > 1:
+        deps["clusters_alt"] = f"cluster_{names[1]}"
+        params["alt"] = names[1]
+    p.add(Stage("figures", _stage_figures, deps=deps, params=params, publishes=True, version="2"))
+    return p
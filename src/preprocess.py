@@ -1,6 +1,11 @@
 from __future__ import annotations
+import hashlib
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
 import numpy as np
 import pandas as pd
+from .instrument import traced
 
 def replace_nonpositive_with_half_minpos(s: pd.Series) -> pd.Series:
     """
@@ -17,26 +22,140 @@ def replace_nonpositive_with_half_minpos(s: pd.Series) -> pd.Series:
     x.loc[x <= 0] = repl
     return x
 
+@traced
 def fix_and_log10(df: pd.DataFrame, features: list[str]) -> tuple[pd.DataFrame, list[str], list[str]]:
     """
     Returns X (log10 transformed), keep_cols, dropped_all_nonpos.
     Only keeps columns present in df.
     """
     keep = [c for c in features if c in df.columns]
-    dropped = []
-    out = {}
-    for c in keep:
-        s = pd.to_numeric(df[c], errors="coerce")
-        # if no positive values, drop
-        if not (s > 0).any():
-            dropped.append(c)
-            continue
-        s2 = replace_nonpositive_with_half_minpos(s)
-        out[c] = np.log10(s2.astype(float))
-    X = pd.DataFrame(out, index=df.index)
+    logx, ok, _ = _log10_block(_raw_matrix(df, keep))
+    X = pd.DataFrame(logx[:, ok], index=df.index, columns=[c for c, k in zip(keep, ok) if k])
+    dropped = [c for c, k in zip(keep, ok) if not k]
     keep2 = [c for c in keep if c not in dropped]
     return X, keep2, dropped
 
 def median_impute(X: pd.DataFrame) -> pd.DataFrame:
     """Median imputation for missing values."""
     return X.fillna(X.median(numeric_only=True))
+
+@dataclass(frozen=True)
+class Log10Transform:
+    """
+    Fitted preprocessing state: per column, the raw-unit value substituted for <= 0 (half the
+    minimum positive value) and the log10 median used for imputation.
+    """
+    columns: list[str]           # features used
+    dropped: list[str]           # requested features with no positive value
+    replacement: np.ndarray      # float64
+    medians: np.ndarray          # float64
+
+    def transform(self, data, impute: bool = True) -> np.ndarray:
+        """Apply the stored replacement values and medians to new rows (no refitting); impute=False keeps NaN."""
+        df = _as_frame(data)
+        raw = _raw_matrix(df, [c for c in self.columns if c in df.columns])
+        if raw.shape[1] != len(self.columns):
+            # columns absent from the new batch are treated as missing (-> imputed with the median)
+            full = np.full((len(df), len(self.columns)), np.nan)
+            full[:, [j for j, c in enumerate(self.columns) if c in df.columns]] = raw
+            raw = full
+        raw = np.where(raw <= 0, self.replacement, raw)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            logx = np.log10(raw)
+        if impute:
+            logx = np.where(np.isnan(logx), self.medians, logx)
+        return np.ascontiguousarray(logx, dtype=np.float32)
+
+@dataclass(frozen=True)
+class FeatureMatrix:
+    """
+    log10 feature matrix plus the transform that produced it.
+    X is C-contiguous float32 (n_rows, n_cols), non-positive values replaced by half the column's
+    minimum positive value before log10, NaN replaced by the column median.
+    """
+    X: np.ndarray
+    missing: np.ndarray          # bool, True where the input was NaN (before imputation)
+    prep: Log10Transform
+
+    @property
+    def columns(self) -> list[str]:
+        return self.prep.columns
+
+    @property
+    def dropped(self) -> list[str]:
+        return self.prep.dropped
+
+@traced
+def log10_matrix(data, features: list[str]) -> FeatureMatrix:
+    """
+    Vectorised fix_and_log10 + median_impute over all columns at once.
+    data: DataFrame or lattice CellTable.
+    """
+    df = _as_frame(data)
+    keep = [c for c in features if c in df.columns]
+    return _matrix_from_raw(_raw_matrix(df, keep), keep)
+
+def _matrix_from_raw(raw: np.ndarray, keep: list[str]) -> FeatureMatrix:
+    logx, ok, repl = _log10_block(raw)
+    logx = logx[:, ok]
+    missing = np.isnan(logx)
+    med = np.nanmedian(logx, axis=0) if logx.shape[0] else np.full(logx.shape[1], np.nan)
+    logx = np.where(missing, med, logx)
+    prep = Log10Transform(
+        columns=[c for c, k in zip(keep, ok) if k],
+        dropped=[c for c, k in zip(keep, ok) if not k],
+        replacement=repl[ok],
+        medians=med,
+    )
+    return FeatureMatrix(X=np.ascontiguousarray(logx, dtype=np.float32), missing=missing, prep=prep)
+
+# (dataset, feature set) -> FeatureMatrix, so modeling and fingerprinting share one transform
+_MATRIX_CACHE: OrderedDict = OrderedDict()
+_MATRIX_CACHE_SIZE = 8
+
+def cached_log10_matrix(data, features: list[str]) -> FeatureMatrix:
+    """
+    log10_matrix, memoised per (dataset, feature set). A CellTable is identified by its feature array
+    (shared across with_columns copies), a DataFrame by a hash of its feature values.
+    """
+    raw = None
+    if hasattr(data, "X"):
+        key = ("table", id(data.X), data.X.shape, tuple(features))
+    else:
+        keep = [c for c in features if c in data.columns]
+        raw = _raw_matrix(data, keep)
+        h = hashlib.blake2b(raw.tobytes(), digest_size=16)
+        h.update(repr((keep, raw.shape)).encode())
+        key = ("frame", h.hexdigest(), tuple(features))
+    hit = _MATRIX_CACHE.get(key)
+    if hit is not None and (hit[0] is None or hit[0]() is data.X):
+        _MATRIX_CACHE.move_to_end(key)
+        return hit[1]
+    fm = log10_matrix(data, features) if raw is None else _matrix_from_raw(raw, keep)
+    _MATRIX_CACHE[key] = (weakref.ref(data.X) if raw is None else None, fm)
+    while len(_MATRIX_CACHE) > _MATRIX_CACHE_SIZE:
+        _MATRIX_CACHE.popitem(last=False)
+    return fm
+
+def _as_frame(data) -> pd.DataFrame:
+    return data.feature_frame() if hasattr(data, "feature_frame") else data
+
+def _raw_matrix(df: pd.DataFrame, cols: list[str]) -> np.ndarray:
+    """Columns as a float64 matrix; non-numeric columns are coerced (invalid -> NaN)."""
+    out = np.empty((len(df), len(cols)), dtype=np.float64)
+    for j, c in enumerate(cols):
+        s = df[c]
+        if not pd.api.types.is_numeric_dtype(s):
+            s = pd.to_numeric(s, errors="coerce")
+        out[:, j] = s.to_numpy(dtype=np.float64, na_value=np.nan)
+    return out
+
+def _log10_block(raw: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Half-min-positive substitution + log10 on every column. Returns (log10, has_positive, replacement)."""
+    pos = raw > 0
+    min_pos = np.where(pos, raw, np.inf).min(axis=0) if raw.shape[0] else np.full(raw.shape[1], np.inf)
+    ok = np.isfinite(min_pos)
+    repl = np.where(ok, min_pos / 2.0, np.nan)
+    fixed = np.where(raw <= 0, repl, raw)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.log10(fixed), ok, repl
@@ -0,0 +1,272 @@
+from __future__ import annotations
+import json
+from dataclasses import dataclass
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from .lattice import CellTable
+
+# In-memory query index over one variant's outputs, built once from the Parquet artifacts:
+#   - target polygons in a shapely STRtree (point-in-target, bbox, polygon overlap, nearest-k)
+#   - scored cells as sorted integer lattice keys: point -> cell is one binary search, a bbox is one
+#     contiguous key range per lattice row
+# Inputs are lon/lat (EPSG:4326) unless `crs` says otherwise; distances and areas are in metres of
+# the grid CRS. Batch methods take arrays and return long tables with a `query` column (input row).
+
+LONLAT = "EPSG:4326"
+
+@dataclass
+class QueryIndex:
+    cells: CellTable                 # scored cells (columns: anomaly_score, is_anomaly, cluster_id, ...)
+    keys: np.ndarray                 # int64 sorted lattice keys (row-major, see _key)
+    order: np.ndarray                # keys[i] belongs to cells row order[i]
+    targets: pd.DataFrame            # one row per target polygon (no geometry), aligned with geoms
+    geoms: np.ndarray                # target polygons (grid CRS)
+    tree: object                     # shapely.STRtree over geoms
+    inside: object                   # scipy cKDTree of one interior point per polygon (bounds nearest-k radii)
+
+    @classmethod
+    def from_layers(cls, cells, polys, cents_wgs=None) -> "QueryIndex":
+        """cells: scored grid (frame with cell polygons / CellTable); polys: target polygons; cents_wgs: lon/lat table."""
+        import shapely
+        from scipy.spatial import cKDTree
+        table = cells if isinstance(cells, CellTable) else CellTable.from_cells(cells, features=[])
+        keys = cls._key(table.cell_x, table.cell_y)
+        order = np.argsort(keys, kind="stable")
+        polys = polys.to_crs(table.crs) if table.crs is not None and polys.crs is not None else polys
+        targets = pd.DataFrame(polys.drop(columns=polys.geometry.name)).reset_index(drop=True)
+        if cents_wgs is not None and {"lon", "lat"} <= set(cents_wgs.columns):
+            targets = targets.merge(pd.DataFrame(cents_wgs[["cluster_id", "lon", "lat"]]), on="cluster_id", how="left")
+        geoms = np.asarray(polys.geometry.values)
+        return cls(cells=table, keys=keys[order], order=order, targets=targets, geoms=geoms,
+                   tree=shapely.STRtree(geoms),
+                   inside=cKDTree(shapely.get_coordinates(shapely.point_on_surface(geoms)).reshape(-1, 2)))
+
+    @classmethod
+    def from_artifacts(cls, artifacts_dir: str | Path, variant: str = "baseline") -> "QueryIndex":
+        """Load the grid (attributes + cell outlines only), cluster labels and targets written by scripts 20-30."""
+        from .store import read_table
+        d = Path(artifacts_dir) / ("baseline" if variant == "baseline" else f"robustness_{variant}")
+        grid = read_table(d / f"ntgs_anomaly_grid_1km_stable_{variant}.parquet",
+                          columns=["cell_id", "anomaly_score", "is_anomaly", "n_points", "geometry"])
+        clusters = d / f"ntgs_anomaly_clusters_{variant}.parquet"
+        if clusters.exists():
+            labels = read_table(clusters, columns=["cell_id", "cluster_id"])
+            cid = pd.Series(labels["cluster_id"].to_numpy(), index=labels["cell_id"].to_numpy())
+            grid["cluster_id"] = grid["cell_id"].map(cid).fillna(-1).astype(np.int64)
+        return cls.from_layers(grid, read_table(d / f"ntgs_target_polygons_{variant}.parquet"),
+                               read_table(d / f"ntgs_target_centroids_{variant}.parquet"))
+
+    # ---- helpers ----
+    @staticmethod
+    def _key(cx, cy) -> np.ndarray:
+        """Row-major lattice key: cells of one lattice row are contiguous and ordered by x."""
+        return (np.asarray(cy, dtype=np.int64) << 32) + (np.asarray(cx, dtype=np.int64) + (1 << 31))
+
+    def _to_grid(self, x, y, crs):
+        x, y = np.atleast_1d(np.asarray(x, dtype=np.float64)), np.atleast_1d(np.asarray(y, dtype=np.float64))
+        if crs is None or self.cells.crs is None:
+            return x, y
+        from pyproj import Transformer
+        return Transformer.from_crs(crs, self.cells.crs, always_xy=True).transform(x, y)
+
+    def _geoms_to_grid(self, geoms, crs) -> np.ndarray:
+        import shapely
+        from pyproj import Transformer
+        geoms = np.atleast_1d(np.asarray(getattr(geoms, "values", geoms), dtype=object))
+        if crs is None or self.cells.crs is None:
+            return geoms
+        tr = Transformer.from_crs(crs, self.cells.crs, always_xy=True)
+        return shapely.transform(geoms, lambda c: np.column_stack(tr.transform(c[:, 0], c[:, 1])))
+
+    def _grid_boxes(self, bboxes, crs) -> np.ndarray:
+        """(xmin, ymin, xmax, ymax) rows as densified boxes in the grid CRS (empty for no rows)."""
+        import shapely
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        if not len(bboxes):
+            return np.empty(0, dtype=object)
+        boxes = shapely.box(*bboxes.T)
+        return self._geoms_to_grid(shapely.segmentize(boxes, (bboxes[:, 2] - bboxes[:, 0]) / 16), crs)
+
+    def _cell_rows(self, cx, cy) -> np.ndarray:
+        """cells row of each lattice address, -1 where there is no scored cell."""
+        q = self._key(cx, cy)
+        pos = np.minimum(np.searchsorted(self.keys, q), len(self.keys) - 1)
+        return np.where(self.keys[pos] == q, self.order[pos], -1)
+
+    def _cell_frame(self, rows: np.ndarray) -> pd.DataFrame:
+        t = self.cells
+        x, y = t.centroids()
+        out = {"cell_id": t.cell_id[rows], "x": x[rows], "y": y[rows], "n_points": t.n_points[rows]}
+        out.update({k: v[rows] for k, v in t.columns.items() if k != "cell_id"})
+        return pd.DataFrame(out)
+
+    def _target_frame(self, q: np.ndarray, idx: np.ndarray, **extra) -> pd.DataFrame:
+        df = self.targets.iloc[idx].reset_index(drop=True)
+        df.insert(0, "query", q)
+        for k, v in extra.items():
+            df[k] = v
+        return df
+
+    # ---- cells ----
+    def score_at(self, x, y, crs: str | None = LONLAT) -> pd.DataFrame:
+        """Scored cell under each point (one row per point; found=False and NaN where no cell)."""
+        gx, gy = self._to_grid(x, y, crs)
+        s, (ox, oy) = self.cells.grid_size_m, self.cells.origin
+        rows = self._cell_rows(np.floor((gx - ox) / s).astype(np.int64), np.floor((gy - oy) / s).astype(np.int64))
+        found = rows >= 0
+        df = self._cell_frame(np.where(found, rows, 0))
+        for c in df.columns:
+            col = df[c].astype("Int64") if pd.api.types.is_integer_dtype(df[c]) else df[c]
+            df[c] = col.mask(~found)
+        df.insert(0, "found", found)
+        df.insert(0, "query", np.arange(len(rows)))
+        return df
+
+    def cells_in_bbox(self, bboxes, crs: str | None = LONLAT) -> pd.DataFrame:
+        """Scored cells whose centre lies in each (xmin, ymin, xmax, ymax) box."""
+        import shapely
+        boxes = self._grid_boxes(bboxes, crs)
+        s, (ox, oy) = self.cells.grid_size_m, self.cells.origin
+        parts = []
+        # candidate rows/columns from the projected box's bounds, then an exact centre-in-box test
+        for q, (x0, y0, x1, y1) in enumerate(shapely.bounds(boxes)):
+            cx0, cx1 = int(np.ceil((x0 - ox) / s - 0.5)), int(np.floor((x1 - ox) / s - 0.5))
+            cy = np.arange(int(np.ceil((y0 - oy) / s - 0.5)), int(np.floor((y1 - oy) / s - 0.5)) + 1)
+            if cx1 < cx0 or len(cy) == 0:
+                continue
+            lo = np.searchsorted(self.keys, self._key(cx0, cy))
+            hi = np.searchsorted(self.keys, self._key(cx1, cy), side="right")
+            pos = np.concatenate([np.arange(a, c) for a, c in zip(lo, hi)]) if len(lo) else np.empty(0, np.int64)
+            part = self._cell_frame(self.order[pos.astype(np.int64)])
+            part = part[shapely.contains_xy(boxes[q], part["x"].to_numpy(), part["y"].to_numpy())]
+            part.insert(0, "query", q)
+            parts.append(part)
+        if not parts:
+            part = self._cell_frame(np.empty(0, np.int64))
+            part.insert(0, "query", np.empty(0, np.int64))
+            parts.append(part)
+        return pd.concat(parts, ignore_index=True)
+
+    # ---- targets ----
+    def targets_at(self, x, y, crs: str | None = LONLAT) -> pd.DataFrame:
+        """Targets containing each point (points outside every target produce no row)."""
+        import shapely
+        gx, gy = self._to_grid(x, y, crs)
+        q, idx = self.tree.query(shapely.points(gx, gy), predicate="intersects")
+        return self._target_frame(q, idx)
+
+    def targets_in_bbox(self, bboxes, crs: str | None = LONLAT) -> pd.DataFrame:
+        """Targets intersecting each (xmin, ymin, xmax, ymax) box."""
+        q, idx = self.tree.query(self._grid_boxes(bboxes, crs), predicate="intersects")
+        return self._target_frame(q, idx)
+
+    def targets_intersecting(self, geoms, crs: str | None = LONLAT) -> pd.DataFrame:
+        """Targets overlapping each polygon (e.g. tenements), with the overlap area (m2) and its share of the polygon."""
+        import shapely
+        g = self._geoms_to_grid(geoms, crs)
+        q, idx = self.tree.query(g, predicate="intersects")
+        area = shapely.area(shapely.intersection(g[q], self.geoms[idx]))
+        return self._target_frame(q, idx, overlap_m2=area, overlap_frac=area / np.maximum(shapely.area(g[q]), 1e-12))
+
+    def nearest_targets(self, x, y, k: int = 5, max_distance_m: float | None = None,
+                        crs: str | None = LONLAT) -> pd.DataFrame:
+        """
+        k nearest targets per point by distance to the polygon (0 inside), ranked 1..k. The k-th nearest
+        interior point bounds the search radius, so only polygons within it are measured exactly.
+        """
+        import shapely
+        gx, gy = self._to_grid(x, y, crs)
+        pts = shapely.points(gx, gy)
+        n, k = len(pts), min(k, len(self.geoms))
+        if n == 0 or k == 0:
+            return self._target_frame(np.empty(0, np.int64), np.empty(0, np.int64), rank=[], distance_m=[])
+        d, _ = self.inside.query(np.column_stack([gx, gy]), k=k)
+        radius = d.reshape(n, -1)[:, -1] + 1e-6
+        if max_distance_m is not None:
+            radius = np.minimum(radius, max_distance_m)
+        q, idx = self.tree.query(pts, predicate="dwithin", distance=radius)
+        dist = shapely.distance(pts[q], self.geoms[idx])
+        o = np.lexsort((idx, dist, q))
+        q, idx, dist = q[o], idx[o], dist[o]
+        rank = np.arange(len(q)) - np.searchsorted(q, q) + 1
+        keep = rank <= k
+        return self._target_frame(q[keep], idx[keep], rank=rank[keep], distance_m=dist[keep])
+
+def serve_queries(index: QueryIndex, host: str = "127.0.0.1", port: int = 8001) -> None:
+    """
+    Local JSON endpoint over a QueryIndex until interrupted (lon/lat inputs; lists as comma-separated values):
+      GET  /score?lon=..&lat=..                    scored cell under each point
+      GET  /targets/at?lon=..&lat=..               targets containing each point
+      GET  /targets/nearest?lon=..&lat=..&k=5[&max_distance_m=..]
+      GET  /targets/bbox?bbox=xmin,ymin,xmax,ymax[;xmin,...]
+      GET  /cells/bbox?bbox=xmin,ymin,xmax,ymax
+      POST /targets/intersecting                   GeoJSON geometry / Feature / FeatureCollection body
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlparse, parse_qs
+
+    def floats(params, name):
+        return [float(v) for v in params[name][0].split(",")]
+
+    def bboxes(params):
+        return [[float(v) for v in b.split(",")] for b in params["bbox"][0].split(";")]
+
+    routes = {
+        "/score": lambda p: index.score_at(floats(p, "lon"), floats(p, "lat")),
+        "/targets/at": lambda p: index.targets_at(floats(p, "lon"), floats(p, "lat")),
+        "/targets/nearest": lambda p: index.nearest_targets(
+            floats(p, "lon"), floats(p, "lat"), int(p.get("k", ["5"])[0]),
+            float(p["max_distance_m"][0]) if "max_distance_m" in p else None),
+        "/targets/bbox": lambda p: index.targets_in_bbox(bboxes(p)),
+        "/cells/bbox": lambda p: index.cells_in_bbox(bboxes(p)),
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, payload):
+            body = json.dumps(payload, default=lambda v: v.item() if hasattr(v, "item") else str(v)).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _answer(self, fn):
+            try:
+                df = fn()
+            except (KeyError, ValueError, TypeError, AttributeError) as e:
+                return self._send(400, {"error": f"bad request: {e}"})
+            return self._send(200, json.loads(df.to_json(orient="records")))
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path not in routes:
+                return self._send(404, {"error": "not found", "routes": [*routes, "/targets/intersecting"]})
+            params = parse_qs(url.query)
+            return self._answer(lambda: routes[url.path](params))
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/targets/intersecting":
+                return self._send(404, {"error": "not found"})
+            from shapely.geometry import shape
+            raw = self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}"
+
+            def run():
+                body = json.loads(raw)
+                feats = body.get("features", [body])
+                return index.targets_intersecting([shape(f.get("geometry", f)) for f in feats])
+            return self._answer(run)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Serving queries at http://{host}:{port}/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
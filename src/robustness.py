@@ -0,0 +1,238 @@
+from __future__ import annotations
+from dataclasses import replace
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import RobustScaler
+
+from .config import ModelConfig, ClusterConfig
+from .lattice import CellTable
+from .preprocess import cached_log10_matrix
+
+# Feature-removal robustness: which targets survive when an element is dropped from the model.
+# The log10 transform and RobustScaler act column by column, so the full feature set is
+# preprocessed and scaled once and every variant is a column subset of that one matrix.
+
+def element_name(feature: str) -> str:
+    """AG_PPM -> AG"""
+    return feature.split("_")[0]
+
+def leave_one_out_variants(features: list[str], extra: dict[str, list[str]] | None = None) -> dict[str, list[str]]:
+    """
+    {"baseline": features, "noAG": features - AG_PPM, ...} plus any user subsets in `extra`
+    (name -> feature list).
+    """
+    variants = {"baseline": list(features)}
+    for f in features:
+        variants[f"no{element_name(f)}"] = [c for c in features if c != f]
+    for name, subset in (extra or {}).items():
+        unknown = [c for c in subset if c not in features]
+        if unknown:
+            raise ValueError(f"Variant {name!r} uses features not in the base set: {unknown}")
+        variants[name] = list(subset)
+    return variants
+
+def _fit_variant(Xs: np.ndarray, cols: np.ndarray, lattice: CellTable, model_cfg: ModelConfig,
+                 cluster_cfg: ClusterConfig) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Worker: model_cfg.scorer on Xs[:, cols], top-contamination flag, cluster_cfg.engine on the flagged cells."""
+    from .clustering import CLUSTER_ENGINES
+    from .modeling import make_scorer
+    X = Xs[:, cols]
+    score = make_scorer(model_cfg.scorer, model_cfg.contamination, model_cfg.random_state, n_jobs=1).fit(X).score(X)
+    flag = score >= np.quantile(score, 1.0 - model_cfg.contamination)
+    cluster_id = np.full(len(score), -1, dtype=np.int32)
+    if flag.any():
+        anom = CLUSTER_ENGINES[cluster_cfg.engine](lattice.take(flag), eps_m=cluster_cfg.eps_m,
+                                                    min_samples=cluster_cfg.min_samples)
+        cluster_id[flag] = np.asarray(anom["cluster_id"])
+    return score, flag.astype(np.int8), cluster_id
+
+def run_variants(cells, variants: dict[str, list[str]], model_cfg: ModelConfig, cluster_cfg: ClusterConfig,
+                 n_jobs: int = -1) -> dict[str, CellTable]:
+    """
+    Score and cluster every feature variant in one job.
+    Preprocessing runs once on the union of the variant features; workers (process pool) receive the
+    scaled matrix memory-mapped read-only and slice their columns from it.
+    Returns {variant: CellTable with anomaly_score, is_anomaly, cluster_id}; all share X and the lattice.
+    """
+    from joblib import Parallel, delayed
+    if not isinstance(cells, CellTable):
+        cells = CellTable.from_cells(cells)
+    union = list(dict.fromkeys(c for feats in variants.values() for c in feats))
+    fm = cached_log10_matrix(cells, union)
+    Xs = RobustScaler().fit_transform(fm.X)
+    # workers cluster on the lattice alone (no feature block or output columns)
+    lattice = replace(cells, X=np.empty((len(cells), 0), dtype=np.float32), features=[], columns={})
+
+    names = list(variants)
+    col_idx = {v: np.array([fm.columns.index(c) for c in variants[v] if c in fm.columns]) for v in names}
+    results = Parallel(n_jobs=n_jobs, backend="loky", max_nbytes="1M", mmap_mode="r")(
+        delayed(_fit_variant)(Xs, col_idx[v], lattice, model_cfg, cluster_cfg) for v in names
+    )
+    return {v: cells.with_columns(anomaly_score=s, is_anomaly=a, cluster_id=c)
+            for v, (s, a, c) in zip(names, results)}
+
+def target_survival(results: dict[str, CellTable], reference: str = "baseline", min_overlap: float = 0.5) -> pd.DataFrame:
+    """
+    One row per reference target (cluster), one column per other variant: the fraction of the target's
+    cells that are still in some cluster under that variant. A target survives a variant when that
+    fraction is >= min_overlap; n_survived / survival_rate summarise across variants.
+    """
+    ref = results[reference]
+    cid = np.asarray(ref["cluster_id"])
+    score = np.asarray(ref["anomaly_score"])
+    in_target = cid != -1
+    targets = pd.DataFrame({"cluster_id": cid[in_target], "anomaly_score": score[in_target]}) \
+        .groupby("cluster_id")["anomaly_score"].agg(n_cells="size", mean_score="mean")
+    targets["priority_score"] = targets["n_cells"] * targets["mean_score"]
+    targets["rank"] = targets["priority_score"].rank(ascending=False, method="first").astype(int)
+
+    others = [v for v in results if v != reference]
+    for v in others:
+        kept = np.asarray(results[v]["cluster_id"])[in_target] != -1
+        targets[v] = pd.Series(kept, dtype=float).groupby(cid[in_target]).mean()
+    targets["n_survived"] = (targets[others] >= min_overlap).sum(axis=1)
+    targets["survival_rate"] = targets["n_survived"] / max(len(others), 1)
+    return targets.reset_index().sort_values("rank")
+
+# ---- comparing target sets (polygons) ----
+# All sets share one STRtree: a single bulk `intersects` query yields every overlapping pair across
+# sets, so exact intersection areas are computed only for polygons that actually touch.
+
+def _stack_target_sets(sets: dict, crs) -> tuple[np.ndarray, np.ndarray, pd.DataFrame]:
+    """(geoms, set index, per-target frame with set/cluster_id/priority_score/rank) over all sets."""
+    frames, geoms = [], []
+    for s, (name, polys) in enumerate(sets.items()):
+        if crs is not None and polys.crs is not None and polys.crs != crs:
+            polys = polys.to_crs(crs)
+        geoms.append(np.asarray(polys.geometry.values, dtype=object))
+        frames.append(pd.DataFrame({"set": name, "set_idx": s, "cluster_id": polys["cluster_id"].to_numpy(np.int64),
+                                    "priority_score": polys["priority_score"].to_numpy(np.float64)}))
+    targets = pd.concat(frames, ignore_index=True)
+    targets["rank"] = targets.groupby("set_idx")["priority_score"].rank(ascending=False, method="first").astype(int)
+    return np.concatenate(geoms), targets["set_idx"].to_numpy(), targets
+
+def _pair_iou(geoms: np.ndarray, i: np.ndarray, j: np.ndarray, n_jobs: int = 1) -> np.ndarray:
+    """Exact IoU of polygon pairs (i[k], j[k]); n_jobs threads over chunks (shapely releases the GIL)."""
+    import shapely
+    def iou(sl):
+        a, b = geoms[i[sl]], geoms[j[sl]]
+        inter = shapely.area(shapely.intersection(a, b))
+        return inter / np.maximum(shapely.area(a) + shapely.area(b) - inter, 1e-12)
+    if n_jobs == 1 or len(i) < 10_000:
+        return iou(slice(None))
+    from concurrent.futures import ThreadPoolExecutor
+    step = 10_000
+    with ThreadPoolExecutor(max_workers=None if n_jobs < 0 else n_jobs) as ex:
+        parts = list(ex.map(iou, [slice(k, k + step) for k in range(0, len(i), step)]))
+    return np.concatenate(parts)
+
+def _best_matches(geoms: np.ndarray, set_idx: np.ndarray, n_sets: int, min_iou: float,
+                  n_jobs: int = 1) -> pd.DataFrame:
+    """
+    For each target and each other set: the partner with the highest IoU, if >= min_iou (src, dst, iou,
+    centroid_offset_m, mutual). Bounding-box candidates whose IoU cannot reach min_iou (box overlap and
+    area ratio bound) are dropped before the exact intersection.
+    """
+    import shapely
+    i, j = shapely.STRtree(geoms).query(geoms)
+    keep = set_idx[i] < set_idx[j]
+    i, j = i[keep], j[keep]
+    b, area = shapely.bounds(geoms), shapely.area(geoms)
+    w = np.minimum(b[i, 2], b[j, 2]) - np.maximum(b[i, 0], b[j, 0])
+    h = np.minimum(b[i, 3], b[j, 3]) - np.maximum(b[i, 1], b[j, 1])
+    bound = np.minimum(np.clip(w, 0, None) * np.clip(h, 0, None), np.minimum(area[i], area[j]))
+    keep = bound / np.maximum(area[i] + area[j] - bound, 1e-12) >= max(min_iou, 1e-12)
+    i, j = i[keep], j[keep]
+    iou = _pair_iou(geoms, i, j, n_jobs)
+    keep = iou >= max(min_iou, 1e-12)               # > 0: edge contact only is no overlap
+    i, j, iou = i[keep], j[keep], iou[keep]
+    c = shapely.centroid(geoms)
+    cx, cy = shapely.get_x(c), shapely.get_y(c)
+    offset = np.hypot(cx[i] - cx[j], cy[i] - cy[j])
+    src, dst = np.r_[i, j], np.r_[j, i]
+    iou, offset = np.r_[iou, iou], np.r_[offset, offset]
+    group = src * n_sets + set_idx[dst]
+    o = np.lexsort((-iou, group))
+    first = np.r_[True, group[o][1:] != group[o][:-1]] if len(o) else np.empty(0, bool)
+    o = o[first]
+    best = pd.DataFrame({"src": src[o], "dst": dst[o], "iou": iou[o], "centroid_offset_m": offset[o]})
+    # mutual: the partner's best match in this target's set is this target
+    key = group[o]
+    back = best["dst"].to_numpy() * n_sets + set_idx[best["src"].to_numpy()]
+    pos = np.minimum(np.searchsorted(key, back), max(len(key) - 1, 0))
+    best["mutual"] = (key[pos] == back) & (best["dst"].to_numpy()[pos] == best["src"].to_numpy()) if len(key) else np.zeros(0, bool)
+    return best
+
+def compare_target_sets(sets: dict, reference: str | None = None, min_iou: float = 0.1, n_jobs: int = 1
+                        ) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Match target polygons across any number of sets ({name: polygons with cluster_id, priority_score}).
+    A target matches another set when its best partner there (highest IoU) has IoU >= min_iou;
+    weaker overlaps are not measured and count as no match (IoU 0).
+    Returns
+      matches:   one row per target and other set it matches: best partner, iou, centroid_offset_m,
+                 mutual (each is the other's best match)
+      agreement: one row per pair of sets: share of each set matched, mean IoU / median centroid offset
+                 of the mutual matches and the Spearman rank correlation of their priority_score
+      stability: one row per `reference` target (default: first set): best IoU per other set (iou_<set>,
+                 0 where unmatched), n_matched, match_rate, median offset, mean |rank shift|,
+                 and stability_score = mean best IoU over the other sets
+    Offsets are in units of the reference CRS (reprojected as needed; use a projected CRS).
+    """
+    names = list(sets)
+    reference = names[0] if reference is None else reference
+    geoms, set_idx, targets = _stack_target_sets(sets, sets[reference].crs)
+    best = _best_matches(geoms, set_idx, len(names), min_iou, n_jobs)
+    src, dst = best["src"].to_numpy(), best["dst"].to_numpy()
+
+    matches = pd.DataFrame({
+        "set": targets["set"].to_numpy()[src], "cluster_id": targets["cluster_id"].to_numpy()[src],
+        "other": targets["set"].to_numpy()[dst], "other_cluster_id": targets["cluster_id"].to_numpy()[dst],
+        "iou": best["iou"], "centroid_offset_m": best["centroid_offset_m"], "mutual": best["mutual"],
+        "priority_score": targets["priority_score"].to_numpy()[src],
+        "other_priority_score": targets["priority_score"].to_numpy()[dst],
+        "rank": targets["rank"].to_numpy()[src], "other_rank": targets["rank"].to_numpy()[dst],
+    })
+
+    # set pairs (each once, in `sets` order)
+    sizes = targets.groupby("set_idx").size().reindex(range(len(names)), fill_value=0).to_numpy()
+    a, b = np.triu_indices(len(names), k=1)
+    agreement = pd.DataFrame({"set_a": np.asarray(names, dtype=object)[a], "set_b": np.asarray(names, dtype=object)[b],
+                              "n_a": sizes[a], "n_b": sizes[b]})
+    hits = matches.groupby(["set", "other"]).size()
+    pair = pd.MultiIndex.from_arrays([agreement["set_a"], agreement["set_b"]])
+    flip = pd.MultiIndex.from_arrays([agreement["set_b"], agreement["set_a"]])
+    agreement["matched_a"] = hits.reindex(pair, fill_value=0).to_numpy() / np.maximum(sizes[a], 1)
+    agreement["matched_b"] = hits.reindex(flip, fill_value=0).to_numpy() / np.maximum(sizes[b], 1)
+    order = {n: k for k, n in enumerate(names)}
+    mutual = matches[matches["mutual"]]
+    mutual = mutual[mutual["set"].map(order) < mutual["other"].map(order)]
+    g = mutual.groupby(["set", "other"])
+    stats = pd.DataFrame({
+        "n_mutual": g.size(),
+        "mean_iou": g["iou"].mean(),
+        "median_offset_m": g["centroid_offset_m"].median(),
+        "spearman_priority": g[["priority_score", "other_priority_score"]].apply(
+            lambda d: d["priority_score"].corr(d["other_priority_score"], method="spearman") if len(d) >= 3 else np.nan),
+    }).reindex(pair)
+    for col in stats.columns:
+        agreement[col] = stats[col].to_numpy()
+    agreement["n_mutual"] = agreement["n_mutual"].fillna(0).astype(int)
+
+    # per reference target
+    others = [n for n in names if n != reference]
+    ref = targets[targets["set"] == reference]
+    stability = ref[["cluster_id", "priority_score", "rank"]].reset_index(drop=True)
+    from_ref = matches[matches["set"] == reference]
+    wide = from_ref.pivot(index="cluster_id", columns="other", values="iou").reindex(
+        index=stability["cluster_id"], columns=others).fillna(0.0)
+    for v in others:
+        stability[f"iou_{v}"] = wide[v].to_numpy()
+    g = from_ref.groupby("cluster_id")
+    stability["n_matched"] = g.size().reindex(stability["cluster_id"], fill_value=0).to_numpy()
+    stability["match_rate"] = stability["n_matched"] / max(len(others), 1)
+    stability["median_offset_m"] = g["centroid_offset_m"].median().reindex(stability["cluster_id"]).to_numpy()
+    stability["mean_rank_shift"] = (from_ref["other_rank"] - from_ref["rank"]).abs().groupby(from_ref["cluster_id"]).mean() \
+        .reindex(stability["cluster_id"]).to_numpy()
+    stability["stability_score"] = wide.to_numpy().mean(axis=1) if others else np.nan
+    return matches, agreement, stability.sort_values("rank").reset_index(drop=True)
@@ -0,0 +1,112 @@
+from __future__ import annotations
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from .instrument import traced
+
+# Intermediate artifact store. GPKG (src/io.write_gpkg) stays the export format for GIS users;
+# stages hand data to each other through:
+#   - Parquet / GeoParquet tables (geometry as WKB), read back column- and row-selectively
+#   - .npy "lattice" directories (one array per column), opened with memory mapping
+
+try:
+    import pyarrow.parquet as pq
+    HAS_ARROW = True
+except Exception:
+    HAS_ARROW = False
+
+
+def _require_arrow():
+    if not HAS_ARROW:
+        raise ImportError("pyarrow is required for the Parquet intermediate store (pip install pyarrow)")
+
+
+def table_path(path: str | Path) -> Path:
+    """Intermediate (Parquet) path that sits next to an exported GPKG/CSV artifact."""
+    return Path(path).with_suffix(".parquet")
+
+
+@traced
+def write_table(df: pd.DataFrame, path: str | Path) -> Path:
+    """Write a (Geo)DataFrame as (Geo)Parquet. Index is not stored."""
+    _require_arrow()
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    df.to_parquet(tmp, index=False)
+    tmp.replace(path)
+    return path
+
+
+def table_columns(path: str | Path) -> list[str]:
+    _require_arrow()
+    return list(pq.read_schema(path).names)
+
+
+def _geometry_columns(path: str | Path) -> list[str]:
+    meta = pq.read_schema(path).metadata or {}
+    if b"geo" not in meta:
+        return []
+    return list(json.loads(meta[b"geo"])["columns"])
+
+
+@traced
+def read_table(path: str | Path, columns: list[str] | None = None, filters=None) -> pd.DataFrame:
+    """
+    Read a Parquet intermediate, loading only `columns` (default all) and the row groups/rows
+    matching `filters` (pyarrow DNF, e.g. [("is_anomaly", "==", 1)]).
+    Returns a GeoDataFrame when a geometry column is among the loaded columns.
+    """
+    _require_arrow()
+    geom_cols = _geometry_columns(path)
+    wants_geom = bool(geom_cols) and (columns is None or any(c in geom_cols for c in columns))
+    if wants_geom:
+        import geopandas as gpd
+        return gpd.read_parquet(path, columns=columns, filters=filters, memory_map=True)
+    tbl = pq.read_table(path, columns=columns, filters=filters, memory_map=True)
+    attrs = (tbl.schema.metadata or {}).get(b"PANDAS_ATTRS")
+    df = tbl.to_pandas(self_destruct=True)
+    if attrs:
+        df.attrs = json.loads(attrs)   # e.g. grid_size_m, as restored by pd.read_parquet
+    return df
+
+
+def write_lattice(df: pd.DataFrame, path: str | Path, meta: dict | None = None) -> Path:
+    """
+    Write the numeric columns of df as <path>/<column>.npy plus meta.json (geometry is dropped;
+    it is implied by cell_id and the grid size). Suited to large per-cell arrays.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    cols = []
+    for c in df.columns:
+        if c == getattr(df, "_geometry_column_name", None):
+            continue
+        arr = df[c].to_numpy()
+        if arr.dtype == object:
+            continue
+        np.save(path / f"{c}.npy", np.ascontiguousarray(arr))
+        cols.append(c)
+    info = {"columns": cols, "n_rows": int(len(df))}
+    crs = getattr(df, "crs", None)
+    if crs is not None:
+        info["crs"] = crs.to_string()
+    info.update(df.attrs)          # e.g. grid_size_m
+    info.update(meta or {})
+    (path / "meta.json").write_text(json.dumps(info, indent=2))
+    return path
+
+
+def read_lattice(path: str | Path, columns: list[str] | None = None, mmap_mode: str | None = "r") -> tuple[dict[str, np.ndarray], dict]:
+    """
+    Open a lattice directory. Arrays are memory-mapped (read-only) by default, so only the pages
+    actually touched are read. Returns ({column: array}, meta).
+    """
+    path = Path(path)
+    meta = json.loads((path / "meta.json").read_text())
+    cols = meta["columns"] if columns is None else columns
+    missing = [c for c in cols if c not in meta["columns"]]
+    if missing:
+        raise KeyError(f"Columns not in lattice {path}: {missing}")
+    return {c: np.load(path / f"{c}.npy", mmap_mode=mmap_mode) for c in cols}, meta
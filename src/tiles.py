@@ -0,0 +1,430 @@
+from __future__ import annotations
+import gzip
+import json
+import math
+import sqlite3
+import struct
+from io import BytesIO
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from .viz import WEB_MERCATOR, _lattice, _interp_weights
+from .instrument import traced
+
+# Web-map tile export. Archives are MBTiles (one SQLite file, TMS row order, `metadata` + `tiles`):
+#   - the scored grid as PNG tiles: every zoom draws the coarsest lattice level (max anomaly_score over
+#     f x f blocks of the scoring grid) whose cells are still no larger than a screen pixel, so a tile
+#     never samples more than a handful of cells and low zooms keep every hot spot visible
+#   - target polygons and centroids as Mapbox Vector Tiles (gzip-compressed protobuf), simplified to
+#     one screen pixel per zoom and clipped per tile
+# serve_tiles is a stand-in XYZ/TileJSON server for checking archives in QGIS or a browser.
+
+HALF_WORLD = 20037508.342789244    # Web Mercator half-circumference (m)
+TILE_PX = 256
+MVT_EXTENT = 4096
+MVT_BUFFER = 64                    # tile-coordinate margin kept around clipped polygons
+
+def tile_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """(xmin, ymin, xmax, ymax) in EPSG:3857 of XYZ tile (z, x, y) (y = 0 at the north edge)."""
+    w = 2 * HALF_WORLD / 2 ** z
+    return -HALF_WORLD + x * w, HALF_WORLD - (y + 1) * w, -HALF_WORLD + (x + 1) * w, HALF_WORLD - y * w
+
+def _tile_index(mx: np.ndarray, my: np.ndarray, z: int) -> tuple[np.ndarray, np.ndarray]:
+    n = 2 ** z
+    tx = np.floor((mx + HALF_WORLD) / (2 * HALF_WORLD) * n).astype(np.int64)
+    ty = np.floor((HALF_WORLD - my) / (2 * HALF_WORLD) * n).astype(np.int64)
+    return np.clip(tx, 0, n - 1), np.clip(ty, 0, n - 1)
+
+def _covering_tiles(bxmin, bymin, bxmax, bymax, z: int) -> np.ndarray:
+    """Unique (x, y) tiles touched by any of the given 3857 boxes."""
+    x0, y1 = _tile_index(np.asarray(bxmin), np.asarray(bymin), z)
+    x1, y0 = _tile_index(np.asarray(bxmax), np.asarray(bymax), z)
+    out = []
+    for dx in range(int((x1 - x0).max()) + 1 if len(x0) else 0):
+        for dy in range(int((y1 - y0).max()) + 1):
+            keep = (x0 + dx <= x1) & (y0 + dy <= y1)
+            out.append(np.column_stack([x0[keep] + dx, y0[keep] + dy]))
+    return np.unique(np.concatenate(out), axis=0) if out else np.empty((0, 2), dtype=np.int64)
+
+def _pixel_size(z: int, lat: float) -> float:
+    """Ground size (m) of one screen pixel at zoom z and latitude lat."""
+    return 2 * HALF_WORLD / (TILE_PX * 2 ** z) * math.cos(math.radians(lat))
+
+# ---- MBTiles ----
+
+def _open_mbtiles(path: Path, metadata: dict) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        path.unlink()
+    con = sqlite3.connect(path)
+    con.executescript("""
+        CREATE TABLE metadata (name TEXT, value TEXT);
+        CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+        CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+    """)
+    con.executemany("INSERT INTO metadata VALUES (?, ?)",
+                    [(k, v if isinstance(v, str) else json.dumps(v)) for k, v in metadata.items()])
+    return con
+
+def _put_tiles(con: sqlite3.Connection, tiles: list[tuple[int, int, int, bytes]]) -> None:
+    # MBTiles rows count from the south (TMS)
+    con.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                    [(z, x, 2 ** z - 1 - y, sqlite3.Binary(data)) for z, x, y, data in tiles])
+
+def read_metadata(path: str | Path) -> dict[str, str]:
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as con:
+        return dict(con.execute("SELECT name, value FROM metadata"))
+
+def read_tile(path: str | Path, z: int, x: int, y: int) -> bytes | None:
+    """Stored tile data for XYZ tile (z, x, y), or None."""
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as con:
+        row = con.execute("SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+                          (z, x, 2 ** z - 1 - y)).fetchone()
+    return None if row is None else bytes(row[0])
+
+def _lonlat_bounds(xmin: float, ymin: float, xmax: float, ymax: float, crs) -> list[float]:
+    from pyproj import Transformer
+    b = Transformer.from_crs(crs, "EPSG:4326", always_xy=True).transform_bounds(xmin, ymin, xmax, ymax,
+                                                                                densify_pts=21)
+    return [round(v, 6) for v in b]
+
+# ---- raster grid tiles ----
+
+def score_levels(cells, column: str = "anomaly_score", factors: tuple[int, ...] = (1, 2, 4, 8, 16, 32, 64)):
+    """
+    Lattice pyramid of `column` for tiling: factor -> (image, (col0, row_top), cell size), where level f
+    holds the max over f x f blocks of scoring cells as a dense array (row 0 = north, NaN = empty).
+    """
+    cx, cy, size, origin, crs = _lattice(cells)
+    values = np.asarray(cells[column], dtype=np.float32)
+    levels = {}
+    for f in factors:
+        lx, ly = cx // f, cy // f
+        x0, y1 = int(lx.min()), int(ly.max())
+        image = np.full((y1 - int(ly.min()) + 1, int(lx.max()) - x0 + 1), -np.inf, dtype=np.float32)
+        np.maximum.at(image, (y1 - ly, lx - x0), values)
+        image[np.isneginf(image)] = np.nan
+        levels[f] = (image, (x0, y1), size * f)
+    return levels, origin, crs
+
+def _render_tile(z: int, x: int, y: int, image: np.ndarray, corner: tuple[int, int], cell: float,
+                 origin: tuple[float, float], crs, vmin: float, vmax: float, cmap: str, step: int = 32) -> bytes | None:
+    """PNG bytes of one tile (nearest lattice cell per pixel), None when the tile holds no cell."""
+    from pyproj import Transformer
+    from PIL import Image
+    import matplotlib
+    xmin, ymin, xmax, ymax = tile_bounds(z, x, y)
+    px = xmin + (np.arange(TILE_PX) + 0.5) * (xmax - xmin) / TILE_PX
+    py = ymax - (np.arange(TILE_PX) + 0.5) * (ymax - ymin) / TILE_PX
+    knots = np.unique(np.r_[np.arange(0, TILE_PX, step), TILE_PX - 1])
+    gx, gy = Transformer.from_crs(WEB_MERCATOR, crs, always_xy=True).transform(*np.meshgrid(px[knots], py[knots]))
+    w = _interp_weights(knots, TILE_PX)
+    col = np.floor((w @ gx @ w.T - origin[0]) / cell).astype(np.int64) - corner[0]
+    row = corner[1] - np.floor((w @ gy @ w.T - origin[1]) / cell).astype(np.int64)
+    H, W = image.shape
+    ok = (col >= 0) & (col < W) & (row >= 0) & (row < H)
+    v = np.full((TILE_PX, TILE_PX), np.nan, dtype=np.float32)
+    v[ok] = image[row[ok], col[ok]]
+    has = np.isfinite(v)
+    if not has.any():
+        return None
+    rgba = matplotlib.colormaps[cmap]((v - vmin) / max(vmax - vmin, 1e-12), bytes=True)
+    rgba[..., 3] = np.where(has, 255, 0)
+    buf = BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buf, format="PNG")
+    return buf.getvalue()
+
+def _render_batch(z: int, xy: np.ndarray, level, origin, crs, vmin, vmax, cmap) -> list[tuple[int, int, int, bytes]]:
+    image, corner, cell = level
+    out = []
+    for x, y in xy:
+        png = _render_tile(z, int(x), int(y), image, corner, cell, origin, crs, vmin, vmax, cmap)
+        if png is not None:
+            out.append((z, int(x), int(y), png))
+    return out
+
+@traced
+def export_grid_tiles(cells, out_path: str | Path, minzoom: int = 4, maxzoom: int = 11,
+                      column: str = "anomaly_score", cmap: str = "viridis", name: str | None = None,
+                      batch: int = 256, n_jobs: int = -1) -> Path:
+    """
+    Scored grid (GeoDataFrame of cell polygons / CellTable) -> PNG MBTiles. Colours are scaled to the
+    full-grid range of `column` (stored in metadata "legend"). Tiles render in a process pool.
+    """
+    from joblib import Parallel, delayed
+    from pyproj import Transformer
+    out_path = Path(out_path)
+    levels, origin, crs = score_levels(cells, column)
+    values = np.asarray(cells[column], dtype=np.float64)
+    vmin, vmax = float(np.nanmin(values)), float(np.nanmax(values))
+    base = levels[1]
+    H, W = base[0].shape
+    gx0, gy1 = origin[0] + base[1][0] * base[2], origin[1] + (base[1][1] + 1) * base[2]
+    bounds = _lonlat_bounds(gx0, gy1 - H * base[2], gx0 + W * base[2], gy1, crs)
+    lat = (bounds[1] + bounds[3]) / 2
+    to_merc = Transformer.from_crs(crs, WEB_MERCATOR, always_xy=True)
+
+    jobs, level_of_zoom = [], {}
+    for z in range(minzoom, maxzoom + 1):
+        f = max([f for f in levels if levels[f][2] <= _pixel_size(z, lat)], default=1)
+        level_of_zoom[z] = f
+        image, (c0, r0), cell = levels[f]
+        rows, cols = np.nonzero(np.isfinite(image))
+        lx0, ly0 = origin[0] + (c0 + cols) * cell, origin[1] + (r0 - rows) * cell
+        corners = [to_merc.transform(lx0 + dx * cell, ly0 + dy * cell) for dx in (0, 1) for dy in (0, 1)]
+        mx, my = np.array([c[0] for c in corners]), np.array([c[1] for c in corners])
+        xy = _covering_tiles(mx.min(0), my.min(0), mx.max(0), my.max(0), z)
+        jobs += [(z, xy[i:i + batch], levels[f]) for i in range(0, len(xy), batch)]
+
+    meta = {
+        "name": name or out_path.stem, "format": "png", "type": "overlay", "version": "1",
+        "description": f"{column} on the {levels[1][2]:g} m lattice (max over blocks at low zooms)",
+        "bounds": ",".join(map(str, bounds)), "center": f"{(bounds[0] + bounds[2]) / 2:.6f},{lat:.6f},{minzoom}",
+        "minzoom": str(minzoom), "maxzoom": str(maxzoom),
+        "legend": {"column": column, "cmap": cmap, "vmin": vmin, "vmax": vmax},
+        "levels": {str(z): {"factor": f, "cell_m": levels[f][2]} for z, f in level_of_zoom.items()},
+    }
+    con = _open_mbtiles(out_path, meta)
+    results = Parallel(n_jobs=n_jobs, return_as="generator")(
+        delayed(_render_batch)(z, xy, level, origin, crs, vmin, vmax, cmap) for z, xy, level in jobs)
+    for tiles in results:
+        _put_tiles(con, tiles)
+    con.commit()
+    con.close()
+    return out_path
+
+# ---- vector target tiles (MVT 2.1) ----
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+def _field(num: int, payload: bytes) -> bytes:
+    """Length-delimited protobuf field."""
+    return _varint(num << 3 | 2) + _varint(len(payload)) + payload
+
+def _mvt_value(v) -> bytes:
+    if isinstance(v, (bool, np.bool_)):
+        return _varint(7 << 3) + _varint(int(v))
+    if isinstance(v, (int, np.integer)):
+        return _varint(6 << 3) + _varint(_zigzag(int(v)))
+    if isinstance(v, (float, np.floating)):
+        return _varint(3 << 3 | 1) + struct.pack("<d", float(v))
+    return _field(1, str(v).encode("utf-8"))
+
+def _ring_area(c: np.ndarray) -> float:
+    return 0.5 * float(np.sum(c[:-1, 0] * c[1:, 1] - c[1:, 0] * c[:-1, 1]))
+
+def _geometry_commands(geom, to_tile) -> tuple[int, list[int]]:
+    """(MVT geometry type, command integers) of a point / polygon geometry in tile coordinates."""
+    import shapely
+    cmds, cursor = [], [0, 0]
+
+    def move(pts):
+        for px, py in pts:
+            cmds.extend((_zigzag(int(px - cursor[0])), _zigzag(int(py - cursor[1]))))
+            cursor[:] = (int(px), int(py))
+
+    if geom.geom_type in ("Point", "MultiPoint"):
+        pts = to_tile(shapely.get_coordinates(geom))
+        cmds.append(1 | len(pts) << 3)
+        move(pts)
+        return 1, cmds
+    for part in shapely.get_parts(geom):
+        if part.geom_type != "Polygon":      # slivers left by clipping
+            continue
+        for k, ring in enumerate([part.exterior, *part.interiors]):
+            c = to_tile(np.asarray(ring.coords))
+            c = c[np.r_[True, np.any(np.diff(c, axis=0) != 0, axis=1)]]   # drop repeats after snapping
+            if len(c) < 4:
+                continue
+            # tile y points down: exterior rings have positive area, holes negative
+            if (_ring_area(c) > 0) != (k == 0):
+                c = c[::-1]
+            c = c[:-1]
+            cmds.append(1 | 1 << 3)
+            move(c[:1])
+            cmds.append(2 | (len(c) - 1) << 3)
+            move(c[1:])
+            cmds.append(7 | 1 << 3)
+    return 3, cmds
+
+def encode_mvt(layers: dict[str, list[tuple[object, dict]]], bounds: tuple[float, float, float, float]) -> bytes:
+    """
+    One vector tile: {layer name: [(shapely geometry in EPSG:3857, properties), ...]} clipped to `bounds`
+    (with a small buffer) and quantised to MVT_EXTENT. Returns the raw protobuf.
+    """
+    import shapely
+    xmin, ymin, xmax, ymax = bounds
+    sx, sy = MVT_EXTENT / (xmax - xmin), MVT_EXTENT / (ymax - ymin)
+    pad = MVT_BUFFER / sx
+
+    def to_tile(c):
+        return np.column_stack([np.round((c[:, 0] - xmin) * sx), np.round((ymax - c[:, 1]) * sy)]).astype(np.int64)
+
+    tile = b""
+    for name, feats in layers.items():
+        keys, values, body = {}, {}, b""
+        for geom, props in feats:
+            if geom.geom_type not in ("Point", "MultiPoint"):
+                geom = shapely.clip_by_rect(geom, xmin - pad, ymin - pad, xmax + pad, ymax + pad)
+            if geom.is_empty:
+                continue
+            gtype, cmds = _geometry_commands(geom, to_tile)
+            if len(cmds) < 3:
+                continue
+            tags = []
+            for k, v in props.items():
+                if v is None or (isinstance(v, (float, np.floating)) and not np.isfinite(v)):
+                    continue
+                tags += [keys.setdefault(k, len(keys)), values.setdefault((type(v).__name__, v), len(values))]
+            feat = b""
+            if "cluster_id" in props:
+                feat += _varint(1 << 3) + _varint(int(props["cluster_id"]))
+            feat += _field(2, b"".join(map(_varint, tags))) + _varint(3 << 3) + _varint(gtype)
+            feat += _field(4, b"".join(map(_varint, cmds)))
+            body += _field(2, feat)
+        if not body:
+            continue
+        layer = _varint(15 << 3) + _varint(2) + _field(1, name.encode("utf-8")) + body
+        layer += b"".join(_field(3, k.encode("utf-8")) for k in keys)
+        layer += b"".join(_field(4, _mvt_value(v)) for _, v in values)
+        layer += _varint(5 << 3) + _varint(MVT_EXTENT)
+        tile += _field(3, layer)
+    return tile
+
+def _records(gdf) -> list[dict]:
+    cols = [c for c in gdf.columns if c != gdf.geometry.name]
+    return [dict(zip(cols, row)) for row in gdf[cols].itertuples(index=False, name=None)]
+
+@traced
+def export_target_tiles(polys, cents_wgs, out_path: str | Path, minzoom: int = 4, maxzoom: int = 14,
+                        name: str | None = None) -> Path:
+    """
+    Target polygons (layer "targets") and centroids (layer "centroids", from lon/lat) -> MVT MBTiles.
+    Polygons are simplified to one screen pixel per zoom (topology preserved), then clipped per tile.
+    """
+    import geopandas as gpd
+    import shapely
+    out_path = Path(out_path)
+    polys_m = polys.to_crs(WEB_MERCATOR)
+    cents_m = cents_wgs.set_geometry(gpd.points_from_xy(cents_wgs["lon"], cents_wgs["lat"]),
+                                     crs="EPSG:4326").to_crs(WEB_MERCATOR)
+    props_p, props_c = _records(polys_m), _records(cents_m)
+    geoms_p, geoms_c = polys_m.geometry.values, cents_m.geometry.values
+    bb = shapely.bounds(np.concatenate([np.asarray(geoms_p), np.asarray(geoms_c)]))
+    bounds = _lonlat_bounds(bb[:, 0].min(), bb[:, 1].min(), bb[:, 2].max(), bb[:, 3].max(), WEB_MERCATOR)
+
+    fields = {c: ("Number" if pd.api.types.is_numeric_dtype(polys_m[c]) else "String")
+              for c in polys_m.columns if c != polys_m.geometry.name}
+    meta = {
+        "name": name or out_path.stem, "format": "pbf", "type": "overlay", "version": "1",
+        "description": "anomaly target polygons and centroids",
+        "bounds": ",".join(map(str, bounds)),
+        "center": f"{(bounds[0] + bounds[2]) / 2:.6f},{(bounds[1] + bounds[3]) / 2:.6f},{minzoom}",
+        "minzoom": str(minzoom), "maxzoom": str(maxzoom),
+        "json": {"vector_layers": [
+            {"id": "targets", "fields": fields, "minzoom": minzoom, "maxzoom": maxzoom},
+            {"id": "centroids", "fields": {**fields, "lon": "Number", "lat": "Number"},
+             "minzoom": minzoom, "maxzoom": maxzoom},
+        ]},
+    }
+    con = _open_mbtiles(out_path, meta)
+    tree_p, tree_c = shapely.STRtree(geoms_p), shapely.STRtree(geoms_c)
+    for z in range(minzoom, maxzoom + 1):
+        tol = 2 * HALF_WORLD / (TILE_PX * 2 ** z)
+        simple = shapely.simplify(np.asarray(geoms_p), tol, preserve_topology=True)
+        xy = _covering_tiles(bb[:, 0], bb[:, 1], bb[:, 2], bb[:, 3], z)
+        tiles = []
+        for x, y in xy:
+            b = tile_bounds(z, int(x), int(y))
+            box = shapely.box(*b)
+            ip, ic = tree_p.query(box, predicate="intersects"), tree_c.query(box, predicate="intersects")
+            if len(ip) == 0 and len(ic) == 0:
+                continue
+            data = encode_mvt({"targets": [(simple[i], props_p[i]) for i in np.sort(ip)],
+                               "centroids": [(geoms_c[i], props_c[i]) for i in np.sort(ic)]}, b)
+            if data:
+                tiles.append((z, int(x), int(y), gzip.compress(data)))
+        _put_tiles(con, tiles)
+    con.commit()
+    con.close()
+    return out_path
+
+# ---- local server ----
+
+def serve_tiles(tilesets: dict[str, str | Path], host: str = "127.0.0.1", port: int = 8000) -> None:
+    """
+    Serve MBTiles archives over HTTP until interrupted (testing stand-in, not a production server):
+      /                      -> {name: TileJSON URL}
+      /<name>.json           -> TileJSON
+      /<name>/{z}/{x}/{y}.png|pbf -> tile (404 when empty)
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    tilesets = {k: Path(v) for k, v in tilesets.items()}
+    metas = {k: read_metadata(p) for k, p in tilesets.items()}
+    root = f"http://{host}:{port}"
+
+    def tilejson(name: str) -> dict:
+        m = metas[name]
+        tj = {"tilejson": "2.2.0", "name": m.get("name", name), "description": m.get("description", ""),
+              "tiles": [f"{root}/{name}/{{z}}/{{x}}/{{y}}.{m['format']}"],
+              "minzoom": int(m["minzoom"]), "maxzoom": int(m["maxzoom"]),
+              "bounds": [float(v) for v in m["bounds"].split(",")]}
+        if "json" in m:
+            tj.update(json.loads(m["json"]))
+        return tj
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: bytes, ctype: str, extra: dict | None = None):
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Access-Control-Allow-Origin", "*")
+            for k, v in (extra or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parts = self.path.split("?")[0].strip("/").split("/")
+            if parts == [""]:
+                return self._send(200, json.dumps({k: f"{root}/{k}.json" for k in tilesets}).encode(),
+                                  "application/json")
+            if len(parts) == 1 and parts[0].endswith(".json") and parts[0][:-5] in tilesets:
+                return self._send(200, json.dumps(tilejson(parts[0][:-5])).encode(), "application/json")
+            if len(parts) == 4 and parts[0] in tilesets:
+                try:
+                    z, x, y = int(parts[1]), int(parts[2]), int(parts[3].split(".")[0])
+                except ValueError:
+                    return self._send(400, b"bad tile address", "text/plain")
+                data = read_tile(tilesets[parts[0]], z, x, y)
+                if data is None:
+                    return self._send(404, b"", "text/plain")
+                if metas[parts[0]]["format"] == "pbf":
+                    return self._send(200, data, "application/x-protobuf", {"Content-Encoding": "gzip"})
+                return self._send(200, data, "image/png")
+            return self._send(404, b"not found", "text/plain")
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Serving {', '.join(tilesets)} at {root}/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
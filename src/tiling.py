@@ -0,0 +1,198 @@
+from __future__ import annotations
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from .grid import pack_cell_id, split_cell_id, points_to_grid, _level_bins, _median_by_cell, _cells_frame, _cells_table
+from .lattice import CellTable
+from .instrument import traced
+
+# Tile-partitioned execution for territory-scale runs.
+# The UTM extent is cut into square tiles (a multiple of every grid level, so no cell straddles two
+# tiles). Gridding, the clustering neighbour search and the fingerprint medians run per tile in a
+# process pool; anomaly scoring stays global. Clustering workers see their tile plus an eps-wide
+# halo and return global neighbour pairs, which are labelled once, so clusters that cross tile
+# edges come out exactly as an untiled run.
+
+def tile_cells(tile_size_m: int, grid_size_m: int) -> int:
+    if tile_size_m % grid_size_m:
+        raise ValueError(f"Tile size {tile_size_m} m is not a multiple of the grid size {grid_size_m} m")
+    return tile_size_m // grid_size_m
+
+def _tile_groups(cx: np.ndarray, cy: np.ndarray, n: int) -> dict[tuple[int, int], np.ndarray]:
+    """{(tile_x, tile_y): row indices} for cells on a lattice cut into n x n-cell tiles."""
+    tid = pack_cell_id(np.floor_divide(cx, n), np.floor_divide(cy, n))
+    order = np.argsort(tid, kind="stable")
+    uniq, start = np.unique(tid[order], return_index=True)
+    tx, ty = split_cell_id(uniq)
+    return {(int(a), int(b)): rows for a, b, rows in zip(tx, ty, np.split(order, start[1:]))}
+
+# ---- gridding ----
+
+def _layer_tiles(raw_gpkg: str | Path, utm_epsg: str, tile_size_m: int) -> tuple[list[tuple], str]:
+    """Tiles covering the layer extent, each with its bbox in the layer CRS (padded; rows are re-filtered exactly)."""
+    import pyogrio
+    from pyproj import Transformer
+    from .io import DEFAULT_CRS
+    info = pyogrio.read_info(raw_gpkg)
+    crs = info["crs"] or DEFAULT_CRS
+    to_utm = Transformer.from_crs(crs, utm_epsg, always_xy=True)
+    to_layer = Transformer.from_crs(utm_epsg, crs, always_xy=True)
+    x0, y0, x1, y1 = to_utm.transform_bounds(*info["total_bounds"], densify_pts=21)
+    tiles = []
+    for tx in range(int(np.floor(x0 / tile_size_m)), int(np.floor(x1 / tile_size_m)) + 1):
+        for ty in range(int(np.floor(y0 / tile_size_m)), int(np.floor(y1 / tile_size_m)) + 1):
+            b = to_layer.transform_bounds(tx * tile_size_m, ty * tile_size_m,
+                                          (tx + 1) * tile_size_m, (ty + 1) * tile_size_m, densify_pts=21)
+            pad = 0.01 * max(b[2] - b[0], b[3] - b[1])
+            tiles.append(((tx, ty), (b[0] - pad, b[1] - pad, b[2] + pad, b[3] + pad)))
+    return tiles, crs
+
+def _grid_tile(raw_gpkg, bbox, tile: tuple[int, int], tile_n: int, features: list[str], utm_epsg: str,
+               sizes: tuple[int, ...]) -> tuple[dict[int, pd.DataFrame], list[str], object]:
+    """Worker: read the tile's bbox, keep the points whose cell is in the tile, per-cell medians per level."""
+    from .io import iter_points_gpkg
+    base = sizes[0]
+    cx, cy, vals, cols, crs = [], [], [], None, None
+    for batch in iter_points_gpkg(raw_gpkg, columns=features, bbox=bbox):
+        if cols is None:
+            cols = [c for c in features if c in batch.columns]
+        pts = points_to_grid(batch, utm_epsg, base)
+        crs = pts.crs
+        x, y = pts["cell_x"].to_numpy(dtype=np.int64), pts["cell_y"].to_numpy(dtype=np.int64)
+        mine = (np.floor_divide(x, tile_n) == tile[0]) & (np.floor_divide(y, tile_n) == tile[1])
+        cx.append(x[mine])
+        cy.append(y[mine])
+        vals.append(pts.loc[mine, cols].to_numpy(dtype=np.float64, na_value=np.nan))
+    if cols is None or not sum(len(a) for a in cx):
+        return {}, cols, crs
+    cx, cy, vals = np.concatenate(cx), np.concatenate(cy), np.concatenate(vals)
+    return ({size: _median_by_cell(pack_cell_id(lx, ly), vals, cols)
+             for size, (lx, ly) in _level_bins(cx, cy, base, sizes).items()}, cols, crs)
+
+@traced
+def tiled_aggregate_to_pyramid(raw_gpkg: str | Path, features: list[str], utm_epsg: str, grid_sizes_m: tuple[int, ...],
+                               tile_size_m: int, n_jobs: int = -1, as_table: bool = False) -> dict:
+    """
+    Tile-parallel stream_aggregate_to_pyramid: each worker reads only its tile (bbox pushdown) and
+    finalises its cells, so reading, projection and medians all scale with the number of processes.
+    tile_size_m must be a multiple of lcm(grid_sizes_m). Output matches stream_aggregate_to_pyramid.
+    """
+    from joblib import Parallel, delayed
+    sizes = tuple(sorted(int(s) for s in grid_sizes_m))
+    tile_cells(tile_size_m, int(np.lcm.reduce(np.array(sizes, dtype=np.int64))))
+    tile_n = tile_size_m // sizes[0]
+    tiles, _ = _layer_tiles(raw_gpkg, utm_epsg, tile_size_m)
+    parts = Parallel(n_jobs=n_jobs, backend="loky")(
+        delayed(_grid_tile)(raw_gpkg, bbox, tile, tile_n, features, utm_epsg, sizes) for tile, bbox in tiles
+    )
+    parts = [p for p in parts if p[0]]
+    if not parts:
+        raise ValueError("No point batches to aggregate")
+    cols, crs = parts[0][1], parts[0][2]
+    levels = {}
+    for size in sizes:
+        df = pd.concat([p[0][size] for p in parts], ignore_index=True).sort_values("cell_id", kind="stable")
+        levels[size] = _cells_table(df, size, crs, cols) if as_table else _cells_frame(df, size, crs)
+    return levels
+
+# ---- clustering ----
+
+def _tile_pairs(cx: np.ndarray, cy: np.ndarray, own: int, radius: float) -> tuple[np.ndarray, np.ndarray]:
+    """Worker: neighbour pairs (i, j) for the first `own` cells against own + halo cells (local indices)."""
+    from .clustering import _lattice_offsets, _lattice_lookup
+    offsets = _lattice_offsets(radius)
+    if len(offsets) == 0 or own == 0:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    order, lookup = _lattice_lookup(cx, cy, int(np.abs(offsets).max()))
+    rank = np.empty(len(cx), dtype=np.int64)
+    rank[order] = np.arange(len(cx))
+    rows = rank[:own]
+    src, dst = [], []
+    for dx, dy in offsets:
+        j = lookup(rows, dx, dy)
+        hit = j >= 0
+        src.append(np.flatnonzero(hit))
+        dst.append(order[j[hit]])
+    return np.concatenate(src), np.concatenate(dst)
+
+@traced
+def tiled_clusters(anom_cells, eps_m: float, min_samples: int, tile_size_m: int, n_jobs: int = -1):
+    """
+    DBSCAN with the neighbour search split over tiles (process pool). Each tile is searched together
+    with the cells of the neighbouring tiles that lie within eps of it (halo); the global pairs are
+    then labelled once (core counts, core-core components, border rule), so labels equal
+    lattice_clusters / dbscan_clusters on the whole set, including clusters crossing tile edges.
+    """
+    from joblib import Parallel, delayed
+    from .clustering import _dbscan_from_pairs
+    table = anom_cells if isinstance(anom_cells, CellTable) else CellTable.from_cells(anom_cells, features=[])
+    n = len(table)
+    size = table.grid_size_m
+    tn = tile_cells(tile_size_m, size)
+    r = int(np.floor(eps_m / size + 1e-9))
+    if r > tn:
+        raise ValueError("eps must not exceed the tile size (halo would reach beyond the neighbouring tiles)")
+    cx, cy = table.cell_x.astype(np.int64), table.cell_y.astype(np.int64)
+    groups = _tile_groups(cx, cy, tn)
+
+    jobs = []
+    for (tx, ty), own in groups.items():
+        cand = [groups.get((tx + a, ty + b)) for a in (-1, 0, 1) for b in (-1, 0, 1) if (a, b) != (0, 0)]
+        cand = np.concatenate([c for c in cand if c is not None] or [np.empty(0, np.int64)])
+        x, y = cx[cand], cy[cand]
+        halo = cand[(x >= tx * tn - r) & (x < (tx + 1) * tn + r) & (y >= ty * tn - r) & (y < (ty + 1) * tn + r)]
+        rows = np.concatenate([own, halo])
+        jobs.append(rows)
+    results = Parallel(n_jobs=n_jobs, backend="loky")(
+        delayed(_tile_pairs)(cx[rows], cy[rows], len(own), eps_m / size) for rows, own in zip(jobs, groups.values())
+    )
+    src = np.concatenate([rows[s] for rows, (s, _) in zip(jobs, results)] or [np.empty(0, np.int64)])
+    dst = np.concatenate([rows[d] for rows, (_, d) in zip(jobs, results)] or [np.empty(0, np.int64)])
+    core = (1 + np.bincount(src, minlength=n)) >= min_samples
+    labels = _dbscan_from_pairs(n, src, dst, core, np.arange(n))
+    if isinstance(anom_cells, CellTable):
+        return anom_cells.with_columns(cluster_id=labels)
+    gdf = anom_cells.copy()
+    gdf["cluster_id"] = labels
+    return gdf
+
+# ---- fingerprint ----
+
+@traced
+def tiled_fingerprint(grid_scored, anom_with_clusters, features: list[str], out_csv: str, tile_size_m: int,
+                      n_boot: int = 1000, ci: float = 0.95, random_state: int = 42,
+                      n_jobs: int = -1) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    cluster_fingerprint with the per-cluster medians and bootstrap intervals computed per tile in a
+    process pool. A cluster is handled by the tile holding its first cell (all its cells travel with
+    it); the transform and the background median stay global, so the result equals cluster_fingerprint.
+    """
+    from joblib import Parallel, delayed
+    from .preprocess import cached_log10_matrix
+    from .fingerprint import _cluster_stats, _fingerprint_tables
+    fm_bg = cached_log10_matrix(grid_scored, features)
+    bg_med = np.median(fm_bg.X.astype(np.float64), axis=0)
+
+    if isinstance(anom_with_clusters, CellTable):
+        lattice = anom_with_clusters.take(np.asarray(anom_with_clusters["cluster_id"]) != -1)
+        cl = lattice.frame()
+    else:
+        cl = anom_with_clusters[anom_with_clusters["cluster_id"] != -1]
+        lattice = CellTable.from_cells(cl, features=[])
+    X = fm_bg.prep.transform(cl, impute=False).astype(np.float64)
+    cid = cl["cluster_id"].to_numpy()
+    tn = tile_cells(tile_size_m, lattice.grid_size_m)
+    first = pd.Series(np.arange(len(cl))).groupby(cid).min().to_numpy()
+    home = pack_cell_id(np.floor_divide(lattice.cell_x[first], tn), np.floor_divide(lattice.cell_y[first], tn))
+    tile = pd.Series(home, index=np.unique(cid)).reindex(cid).to_numpy()
+    jobs = [np.flatnonzero(tile == t) for t in np.unique(tile)]
+    parts = Parallel(n_jobs=n_jobs, backend="loky")(
+        delayed(_cluster_stats)(X[rows], cid[rows], n_boot, ci, random_state) for rows in jobs
+    )
+    if not parts:
+        parts = [_cluster_stats(X, cid, n_boot, ci, random_state)]
+    uniq = np.concatenate([p[0] for p in parts])
+    order = np.argsort(uniq)
+    stack = [np.concatenate([p[k] for p in parts])[order] if parts[0][k] is not None else None for k in (1, 2, 3)]
+    return _fingerprint_tables(uniq[order], *stack, bg_med, fm_bg.columns, out_csv)
@@ -1,46 +1,191 @@
 from __future__ import annotations
 import os
+import weakref
+from dataclasses import dataclass
+from pathlib import Path
 import numpy as np
 import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
 
+from .lattice import CellTable
+
 try:
     import contextily as ctx
     HAS_BASEMAP = True
 except Exception:
     HAS_BASEMAP = False
 
-def _add_basemap(ax):
-    if HAS_BASEMAP:
+WEB_MERCATOR = "EPSG:3857"   # CRS of the basemap tiles
+
+def _use_basemap(basemap: bool | None) -> bool:
+    """basemap=None: draw one when contextily is available; False switches it off for this call."""
+    return HAS_BASEMAP if basemap is None else bool(basemap) and HAS_BASEMAP
+
+def _add_basemap(ax, basemap: bool):
+    if basemap:
         ctx.add_basemap(ax, source=ctx.providers.CartoDB.Positron, attribution_size=6)
 
-def map_anomaly_score(grid: gpd.GeoDataFrame, out_png: str, title: str):
+def _display_crs(crs, basemap: bool):
+    return WEB_MERCATOR if basemap else crs
+
+def _same_crs(a, b) -> bool:
+    from pyproj import CRS
+    return a is None or b is None or CRS.from_user_input(a) == CRS.from_user_input(b)
+
+@dataclass(frozen=True)
+class GridRaster:
+    """Lattice values as an image (row 0 = northern edge, NaN where there is no cell)."""
+    image: np.ndarray                            # float32 (H, W)
+    extent: tuple[float, float, float, float]    # (xmin, xmax, ymin, ymax), imshow order
+    crs: str | None
+
+    @property
+    def bounds(self) -> tuple[float, float, float, float]:
+        xmin, xmax, ymin, ymax = self.extent
+        return xmin, ymin, xmax, ymax
+
+def _lattice(grid) -> tuple[np.ndarray, np.ndarray, int, tuple[float, float], str | None]:
+    """(cell_x, cell_y, grid size, origin, crs) of a CellTable or a frame of square cell polygons."""
+    if isinstance(grid, CellTable):
+        return grid.cell_x, grid.cell_y, grid.grid_size_m, grid.origin, grid.crs
+    import shapely
+    from .grid import _infer_grid_size
+    size = _infer_grid_size(grid)
+    b = shapely.bounds(grid.geometry.values)
+    origin = (float(b[0, 0] - np.round(b[0, 0] / size) * size), float(b[0, 1] - np.round(b[0, 1] / size) * size))
+    cx = np.round((b[:, 0] - origin[0]) / size).astype(np.int64)
+    cy = np.round((b[:, 1] - origin[1]) / size).astype(np.int64)
+    return cx, cy, size, origin, grid.crs.to_string() if grid.crs is not None else None
+
+def _crs_of(layer) -> str | None:
+    if isinstance(layer, (GridRaster, CellTable)):
+        return layer.crs
+    return layer.crs.to_string() if getattr(layer, "crs", None) is not None else None
+
+def grid_raster(grid, column: str = "anomaly_score", crs=None) -> GridRaster:
+    """
+    Per-cell `column` as one image over the lattice bounding box (cells are regular squares, so
+    the whole grid is drawn with a single imshow instead of one polygon per cell).
+    crs: target CRS; the image is resampled (nearest cell) when it differs from the grid's.
+    """
+    cx, cy, size, origin, src_crs = _lattice(grid)
+    x0, y1 = int(cx.min()), int(cy.max())
+    W, H = int(cx.max()) - x0 + 1, y1 - int(cy.min()) + 1
+    image = np.full((H, W), np.nan, dtype=np.float32)
+    image[y1 - cy, cx - x0] = np.asarray(grid[column], dtype=np.float32)
+    extent = (origin[0] + x0 * size, origin[0] + (x0 + W) * size,
+              origin[1] + (y1 + 1 - H) * size, origin[1] + (y1 + 1) * size)
+    r = GridRaster(image, extent, src_crs)
+    return r if _same_crs(crs, src_crs) else warp_raster(r, crs)
+
+def _interp_weights(knots: np.ndarray, n: int) -> np.ndarray:
+    """(n, len(knots)) linear-interpolation weights from knot positions to 0..n-1."""
+    if len(knots) == 1:
+        return np.ones((n, 1))
+    x = np.arange(n)
+    j = np.clip(np.searchsorted(knots, x, side="right") - 1, 0, len(knots) - 2)
+    t = (x - knots[j]) / (knots[j + 1] - knots[j])
+    w = np.zeros((n, len(knots)))
+    w[x, j] = 1 - t
+    w[x, j + 1] = t
+    return w
+
+def warp_raster(r: GridRaster, crs, oversample: int = 2, step: int = 16) -> GridRaster:
+    """
+    Resample a GridRaster into another CRS (nearest cell). Output pixel centres are projected back
+    on a coarse control grid (every `step` pixels) and interpolated in between, which is exact to
+    well below a pixel for UTM <-> Web Mercator at territory scale.
+    """
+    from pyproj import Transformer
+    xmin, xmax, ymin, ymax = r.extent
+    H, W = r.image.shape
+    tx0, ty0, tx1, ty1 = Transformer.from_crs(r.crs, crs, always_xy=True).transform_bounds(
+        xmin, ymin, xmax, ymax, densify_pts=21)
+    ow = W * oversample
+    oh = max(1, int(round(ow * (ty1 - ty0) / (tx1 - tx0))))
+    px = tx0 + (np.arange(ow) + 0.5) * (tx1 - tx0) / ow
+    py = ty1 - (np.arange(oh) + 0.5) * (ty1 - ty0) / oh
+    ci = np.unique(np.r_[np.arange(0, ow, step), ow - 1])
+    ri = np.unique(np.r_[np.arange(0, oh, step), oh - 1])
+    gx, gy = Transformer.from_crs(crs, r.crs, always_xy=True).transform(*np.meshgrid(px[ci], py[ri]))
+    wr, wc = _interp_weights(ri, oh), _interp_weights(ci, ow)
+    col = np.floor((wr @ gx @ wc.T - xmin) / (xmax - xmin) * W).astype(np.int64)
+    row = np.floor((ymax - wr @ gy @ wc.T) / (ymax - ymin) * H).astype(np.int64)
+    ok = (col >= 0) & (col < W) & (row >= 0) & (row < H)
+    image = np.full((oh, ow), np.nan, dtype=np.float32)
+    image[ok] = r.image[row[ok], col[ok]]
+    crs = crs if isinstance(crs, str) else crs.to_string()
+    return GridRaster(image, (tx0, tx1, ty0, ty1), crs)
+
+# reprojected layers / rasters shared by every figure that draws the same layer:
+# (id(layer), what, crs) -> result, dropped when the layer is garbage-collected
+_LAYER_CACHE: dict = {}
+
+def _memo(layer, key: tuple, build):
+    k = (id(layer), *key)
+    if k not in _LAYER_CACHE:
+        try:
+            weakref.finalize(layer, _LAYER_CACHE.pop, k, None)
+        except TypeError:   # not weak-referenceable: no sharing
+            return build()
+        _LAYER_CACHE[k] = build()
+    return _LAYER_CACHE[k]
+
+def _raster(grid, column: str, crs) -> GridRaster:
+    if isinstance(grid, GridRaster):
+        return grid if _same_crs(crs, grid.crs) else _memo(grid, ("warp", str(crs)), lambda: warp_raster(grid, crs))
+    return _memo(grid, ("raster", column, str(crs)), lambda: grid_raster(grid, column, crs))
+
+def _to_display(gdf: gpd.GeoDataFrame, crs) -> gpd.GeoDataFrame:
+    if _same_crs(crs, _crs_of(gdf)):
+        return gdf
+    return _memo(gdf, ("crs", str(crs)), lambda: gdf.to_crs(crs))
+
+def _centroid_points(cents_wgs: gpd.GeoDataFrame, crs) -> gpd.GeoDataFrame:
+    return _memo(cents_wgs, ("lonlat", str(crs)), lambda: cents_wgs.set_geometry(
+        gpd.points_from_xy(cents_wgs["lon"], cents_wgs["lat"]), crs="EPSG:4326").to_crs(crs))
+
+def _bounds(layer, crs) -> tuple[float, float, float, float]:
+    """Bounds of a grid / raster / vector layer in `crs` (bounding box projected, not the layer)."""
+    if isinstance(layer, GridRaster):
+        b = layer.bounds
+    elif isinstance(layer, CellTable):
+        s = layer.grid_size_m
+        b = (layer.origin[0] + layer.cell_x.min() * s, layer.origin[1] + layer.cell_y.min() * s,
+             layer.origin[0] + (layer.cell_x.max() + 1) * s, layer.origin[1] + (layer.cell_y.max() + 1) * s)
+    else:
+        b = tuple(layer.total_bounds)
+    if _same_crs(crs, _crs_of(layer)):
+        return b
+    from pyproj import Transformer
+    return Transformer.from_crs(_crs_of(layer), crs, always_xy=True).transform_bounds(*b, densify_pts=21)
+
+def _draw_raster(ax, r: GridRaster, **kwargs):
+    return ax.imshow(r.image, extent=r.extent, origin="upper", interpolation="nearest", **kwargs)
+
+def map_anomaly_score(grid, out_png: str, title: str, basemap: bool | None = None):
+    """grid: scored cells (GeoDataFrame / CellTable) or a prepared GridRaster of anomaly_score."""
+    basemap = _use_basemap(basemap)
+    r = _raster(grid, "anomaly_score", _display_crs(_crs_of(grid), basemap))
     fig, ax = plt.subplots(figsize=(11,11))
-    grid.plot(column="anomaly_score", ax=ax, legend=True, linewidth=0, alpha=0.95)
-    _add_basemap(ax)
+    fig.colorbar(_draw_raster(ax, r, alpha=0.95), ax=ax)
+    _add_basemap(ax, basemap)
     ax.set_title(title)
     ax.set_axis_off()
     plt.tight_layout()
     plt.savefig(out_png, dpi=300)
     plt.close()
 
-def map_targets(grid: gpd.GeoDataFrame, polys: gpd.GeoDataFrame, cents_wgs: gpd.GeoDataFrame,
-                out_png: str, title: str, label_n: int = 10):
-    # CRS
-    if HAS_BASEMAP:
-        grid_p = grid.to_crs("EPSG:3857")
-        polys_p = polys.to_crs("EPSG:3857")
-        cents = cents_wgs.copy()
-        cents = cents.set_geometry(gpd.points_from_xy(cents["lon"], cents["lat"]), crs="EPSG:4326").to_crs("EPSG:3857")
-    else:
-        grid_p = grid
-        polys_p = polys.to_crs(grid.crs)
-        cents = cents_wgs.copy()
-        cents = cents.set_geometry(gpd.points_from_xy(cents["lon"], cents["lat"]), crs="EPSG:4326").to_crs(grid.crs)
+def map_targets(grid, polys: gpd.GeoDataFrame, cents_wgs: gpd.GeoDataFrame,
+                out_png: str, title: str, label_n: int = 10, basemap: bool | None = None):
+    basemap = _use_basemap(basemap)
+    score = _raster(grid, "anomaly_score", _display_crs(_crs_of(grid), basemap))
+    polys_p = _to_display(polys, score.crs)
+    cents = _centroid_points(cents_wgs, score.crs)
 
     fig, ax = plt.subplots(figsize=(11,11))
-    grid_p.plot(column="anomaly_score", ax=ax, alpha=0.25, linewidth=0, legend=False)
+    _draw_raster(ax, score, alpha=0.25)
     polys_p.plot(column="priority_score", ax=ax, alpha=0.55, edgecolor="black", linewidth=0.4, legend=True)
     top = cents.sort_values("priority_score", ascending=False).head(label_n)
     for _, r in top.iterrows():
@@ -50,30 +195,26 @@ def map_targets(grid: gpd.GeoDataFrame, polys: gpd.GeoDataFrame, cents_wgs: gpd.
                     textcoords="offset points",
                     fontsize=6,
                     ha="center", va="center")
-    _add_basemap(ax)
+    _add_basemap(ax, basemap)
     ax.set_title(title)
     ax.set_axis_off()
     plt.tight_layout()
     plt.savefig(out_png, dpi=300)
     plt.close()
 
-def map_robustness(polys_base: gpd.GeoDataFrame, polys_noag: gpd.GeoDataFrame, extent_ref: gpd.GeoDataFrame,
-                   out_png: str, title: str):
-    if HAS_BASEMAP:
-        base = polys_base.to_crs("EPSG:3857")
-        noag = polys_noag.to_crs("EPSG:3857")
-        ref = extent_ref.to_crs("EPSG:3857")
-    else:
-        base = polys_base
-        noag = polys_noag.to_crs(polys_base.crs)
-        ref = extent_ref
+def map_robustness(polys_base: gpd.GeoDataFrame, polys_noag: gpd.GeoDataFrame, extent_ref,
+                   out_png: str, title: str, basemap: bool | None = None):
+    basemap = _use_basemap(basemap)
+    crs = _display_crs(_crs_of(polys_base), basemap)
+    base = _to_display(polys_base, crs)
+    noag = _to_display(polys_noag, crs)
 
     fig, ax = plt.subplots(figsize=(11,11))
-    xmin, ymin, xmax, ymax = ref.total_bounds
+    xmin, ymin, xmax, ymax = _bounds(extent_ref, crs)
     ax.set_xlim(xmin, xmax); ax.set_ylim(ymin, ymax)
     base.plot(ax=ax, alpha=0.35, edgecolor="black", linewidth=0.4)
     noag.boundary.plot(ax=ax, linewidth=1.0)
-    _add_basemap(ax)
+    _add_basemap(ax, basemap)
     ax.set_title(title)
     ax.set_axis_off()
     plt.tight_layout()
@@ -82,7 +223,7 @@ def map_robustness(polys_base: gpd.GeoDataFrame, polys_noag: gpd.GeoDataFrame, e
 
 def plot_score_hist(grid: gpd.GeoDataFrame, out_png: str, title: str):
     fig, ax = plt.subplots(figsize=(9,5))
-    ax.hist(grid["anomaly_score"].values, bins=60)
+    ax.hist(np.asarray(grid["anomaly_score"]), bins=60)
     ax.set_title(title)
     ax.set_xlabel("anomaly_score (higher = more anomalous)")
     ax.set_ylabel("count")
@@ -115,3 +256,47 @@ def plot_fingerprint_heatmap(fp_long: pd.DataFrame, out_png: str, title: str):
     plt.tight_layout()
     plt.savefig(out_png, dpi=300)
     plt.close()
+
+def make_figures(grid, polys: gpd.GeoDataFrame, cents_wgs: gpd.GeoDataFrame, fp_long: pd.DataFrame,
+                 figures_dir: str | Path, reference: str = "baseline", polys_alt: gpd.GeoDataFrame | None = None,
+                 alt: str | None = None, n_jobs: int = -1, basemap: bool | None = None) -> list[Path]:
+    """
+    fig1-fig6 for one run. Shared layers (score raster, reprojected polygons) are built once here;
+    the figures then render concurrently, one per worker process.
+    basemap=None draws basemaps when contextily is available; False switches them off.
+    Returns the PNG paths (fig1, fig2, fig4, fig5, fig6, then fig3 when polys_alt is given).
+    """
+    from joblib import Parallel, delayed, effective_n_jobs
+    figures_dir = Path(figures_dir)
+    figures_dir.mkdir(parents=True, exist_ok=True)
+    basemap = _use_basemap(basemap)
+    crs = _display_crs(_crs_of(grid), basemap)
+    score = _raster(grid, "anomaly_score", crs)
+    polys_p = _to_display(polys, crs)
+    cells = pd.DataFrame({"anomaly_score": np.asarray(grid["anomaly_score"]), "n_points": np.asarray(grid["n_points"])})
+    out = [
+        figures_dir / f"fig1_anomaly_score_{reference}.png",
+        figures_dir / f"fig2_target_clusters_{reference}.png",
+        figures_dir / f"fig4_hist_anomaly_score_{reference}.png",
+        figures_dir / "fig5_scatter_npoints_vs_score.png",
+        figures_dir / f"fig6_fingerprint_heatmap_{reference}.png",
+    ]
+    jobs = [
+        (map_anomaly_score, score, str(out[0]),
+         f"Anomaly score (Isolation Forest) — NTGS Stream Sediments (1 km grid, {reference})"),
+        (map_targets, score, polys_p, cents_wgs, str(out[1]),
+         f"Target clusters ({reference}) — polygons colored by priority_score; labels shifted up-left"),
+        (plot_score_hist, cells, str(out[2]), f"Distribution of anomaly_score ({reference})"),
+        (plot_npoints_scatter, cells, str(out[3]), f"n_points vs anomaly_score ({reference})"),
+        (plot_fingerprint_heatmap, fp_long, str(out[4]),
+         f"Cluster fingerprint heatmap ({reference}): median(log10) cluster - background"),
+    ]
+    if polys_alt is not None:
+        out.append(figures_dir / "fig3_robustness_overlay.png")
+        jobs.append((map_robustness, polys_p, _to_display(polys_alt, crs), score, str(out[-1]),
+                     f"Robustness overlay — {reference.capitalize()} polygons (fill) vs {alt} polygons (outline)"))
+    n_jobs = min(len(jobs), effective_n_jobs(n_jobs))
+    maps = {map_anomaly_score, map_targets, map_robustness}
+    Parallel(n_jobs=n_jobs)(delayed(func)(*args, **({"basemap": basemap} if func in maps else {}))
+                            for func, *args in jobs)
+    return out
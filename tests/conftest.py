@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# tests import the package as `src`, like the scripts run from the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pytest
+
+from src.grid import aggregate_to_cells, points_to_grid, stream_aggregate_to_cells, stream_aggregate_to_pyramid
+
+UTM = "EPSG:32753"
+FEATURES = ["CU_PPM", "AU_PPB", "FE_PCT"]
+
+
+@pytest.fixture
+def points() -> gpd.GeoDataFrame:
+    rng = np.random.default_rng(0)
+    n = 3000
+    df = pd.DataFrame({f: rng.lognormal(size=n) for f in FEATURES})
+    df.loc[rng.random(n) < 0.1, "AU_PPB"] = np.nan          # NaN-skipping medians
+    df.loc[rng.random(n) < 0.05, "CU_PPM"] = -0.1           # detection-limit values stay raw
+    lon, lat = rng.uniform(133.0, 133.3, n), rng.uniform(-19.3, -19.0, n)
+    return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(lon, lat), crs="EPSG:4326")
+
+
+def _batches(points: gpd.GeoDataFrame, n: int = 7):
+    return (points.iloc[idx] for idx in np.array_split(np.arange(len(points)), n))
+
+
+def _assert_same_cells(got: gpd.GeoDataFrame, expected: gpd.GeoDataFrame):
+    got = got.sort_values("cell_id").reset_index(drop=True)
+    expected = expected.sort_values("cell_id").reset_index(drop=True)
+    pd.testing.assert_frame_equal(got.drop(columns="geometry"), expected.drop(columns="geometry"), check_exact=True)
+    assert got.crs == expected.crs
+    assert got.geometry.geom_equals_exact(expected.geometry, tolerance=0).all()
+
+
+def test_stream_cells_match_in_memory(points):
+    expected = aggregate_to_cells(points_to_grid(points, UTM, 1000), FEATURES)
+    got = stream_aggregate_to_cells(_batches(points), FEATURES, UTM, 1000, n_partitions=4)
+    _assert_same_cells(got, expected)
+
+
+def test_stream_pyramid_levels_match_direct_gridding(points):
+    sizes = (500, 1000, 2000, 5000)
+    levels = stream_aggregate_to_pyramid(_batches(points), FEATURES, UTM, sizes, n_partitions=3)
+    assert sorted(levels) == list(sizes)
+    for size in sizes:
+        _assert_same_cells(levels[size], aggregate_to_cells(points_to_grid(points, UTM, size), FEATURES))